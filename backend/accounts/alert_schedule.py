@@ -0,0 +1,51 @@
+"""
+When each organisation's missing-student alert is due, so the scheduler can sleep
+until the next alert minute instead of waking every 60 seconds to check.
+"""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .models import User
+
+# The evening alert goes out this long before the buses leave college
+EVENING_ALERT_LEAD = timedelta(minutes=3)
+
+
+def alert_times(morning_arrival_time, evening_departure_time):
+    """The (trip_type, local time) of an organisation's morning and evening alerts, to the minute."""
+    evening_alert = (datetime.combine(datetime(2000, 1, 2), evening_departure_time) - EVENING_ALERT_LEAD).time()
+    return (
+        ('morning', morning_arrival_time.replace(second=0, microsecond=0)),
+        ('evening', evening_alert.replace(second=0, microsecond=0)),
+    )
+
+
+def load_schedule_index():
+    """Alert schedule of every active organisation: management user id -> (morning, evening) times."""
+    rows = User.objects.filter(is_management=True, is_active=True).values_list(
+        'id', 'morning_arrival_time', 'evening_departure_time'
+    )
+    return {mgmt_id: (morning, evening) for mgmt_id, morning, evening in rows}
+
+
+def next_alert_time(index, after):
+    """The first alert minute of any organisation in the index strictly after `after`, or None."""
+    after = timezone.localtime(after)
+    next_time = None
+    for morning, evening in index.values():
+        for _, alert_time in alert_times(morning, evening):
+            fire = timezone.make_aware(datetime.combine(after.date(), alert_time))
+            if fire <= after:
+                fire = timezone.make_aware(datetime.combine(after.date() + timedelta(days=1), alert_time))
+            if next_time is None or fire < next_time:
+                next_time = fire
+    return next_time
+
+
+def alert_times_between(index, start, end):
+    """Every alert minute of any organisation in the index in (start, end], earliest first."""
+    at = next_alert_time(index, start)
+    while at is not None and at <= end:
+        yield at
+        at = next_alert_time(index, at)
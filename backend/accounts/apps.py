@@ -6,9 +6,17 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
-        # We only want to run the scheduler once, not in every worker or management command (like migrate)
-        # Avoid running during 'manage.py' commands unless it's 'runserver'
+        # Cached dashboard figures are dropped when users, buses or complaints change,
+        # and a parent's trackable buses when a child's bus or parent does
+        from . import dashboard_stats, live_state  # noqa: F401
+
+        # Avoid running during 'manage.py' commands unless it's 'runserver'.
+        # Every server worker starts the scheduler; a database lease lets only one of them run its jobs.
         if 'runserver' in sys.argv or 'wsgi' in sys.argv[0] or 'gunicorn' in sys.argv[0]:
+            # Each server process also drains the notification outbox in the background
+            from .outbox import start_outbox_worker
+            start_outbox_worker()
+
             try:
                 from .scheduler import start_scheduler
                 start_scheduler()
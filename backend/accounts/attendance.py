@@ -0,0 +1,73 @@
+"""
+Daily attendance marks (DailyAttendance). A teacher marks any number of students of their class
+in one request: one query checks the students and one upsert writes every mark, however many
+there are.
+"""
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import DailyAttendance, User
+
+TRIP_TYPES = ('morning', 'evening')
+
+
+class AttendanceError(ValueError):
+    pass
+
+
+def parse_status(value):
+    """A DailyAttendance status from the app's label ('Absent') or key ('absent')."""
+    status = str(value or '').strip().lower()
+    if status not in dict(DailyAttendance.STATUS_CHOICES):
+        raise AttendanceError(f'Unknown status: {value}')
+    return status
+
+
+def mark_attendance(teacher, marks, date=None, trip_type=None):
+    """
+    Record [{"student_id", "status"}, ...] for students of the teacher's class on `date`
+    (default today), for one trip type or, by default, both. A later mark for the same student,
+    day and trip replaces the earlier one. Raises AttendanceError, writing nothing, if any mark
+    is invalid. Returns the number of rows written.
+    """
+    if trip_type is not None and trip_type not in TRIP_TYPES:
+        raise AttendanceError(f'Unknown trip type: {trip_type}')
+    if not teacher.class_in_charge_id:
+        raise AttendanceError('You are not in charge of a class')
+
+    statuses = {}
+    for mark in marks:
+        try:
+            # Form posts send the id as a string
+            student_id = int(mark.get('student_id'))
+        except (AttributeError, TypeError, ValueError):
+            raise AttendanceError('Each mark needs an integer student_id and a status')
+        statuses[student_id] = parse_status(mark.get('status'))
+
+    students = set(User.objects.filter(
+        id__in=statuses, is_student=True, class_in_charge_id=teacher.class_in_charge_id
+    ).values_list('id', flat=True))
+    outsiders = sorted(set(statuses) - students)
+    if outsiders:
+        raise AttendanceError(f"Not students of your class: {', '.join(map(str, outsiders))}")
+
+    date = date or timezone.localdate()
+    rows = [
+        DailyAttendance(student_id=student_id, date=date, trip_type=trip, status=status, marked_by=teacher)
+        for student_id, status in statuses.items()
+        for trip in ([trip_type] if trip_type else TRIP_TYPES)
+    ]
+    DailyAttendance.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['student', 'date', 'trip_type'],
+        update_fields=['status', 'marked_by', 'updated_at'],
+    )
+    return len(rows)
+
+
+def excused(date, trip_type):
+    """Exists() condition on a User queryset: the student is marked absent or on leave for this trip."""
+    return Exists(DailyAttendance.objects.filter(
+        student=OuterRef('pk'), date=date, trip_type=trip_type, status__in=DailyAttendance.EXCUSED_STATUSES
+    ))
@@ -0,0 +1,323 @@
+"""
+QR boarding. The driver app shows the bus id and a code derived from the bus's QR secret and the
+current 30-second time step (RFC 6238 TOTP), so it rotates the QR without asking the server.
+A whole stop scans the same code within seconds, so the hot path is kept to the code check, the
+cached bus state and a single insert. Scans captured without connectivity are synced later in
+one batch.
+
+Bus ids signed with TimestampSigner, which older driver apps still fetch from the dashboard
+(qr_token), are accepted for QR_TOKEN_MAX_AGE seconds.
+"""
+import base64
+import hashlib
+import hmac
+import struct
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+from django.core.signing import BadSignature, SignatureExpired, TimestampSigner, b62_decode
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .live_state import get_bus_state, invalidate_bus_state, live_cache
+from .models import BoardingLog, Bus, Trip, User
+from .tracking import MAX_CLOCK_SKEW, parse_coordinate, parse_timestamp
+from .trip_stats import count_boardings
+
+# Upper bound on offline scans synced in one request
+MAX_SYNC_SCANS = 200
+
+# Slightly more than the 30 s refresh rate of the legacy signed tokens, to account for network latency
+QR_TOKEN_MAX_AGE = 35
+
+# Rotating QR codes: "<bus id>:<code>", the code being TOTP (HMAC-SHA1) over QR_CODE_STEP seconds
+QR_CODE_STEP = 30
+QR_CODE_DIGITS = 8
+# Steps either side of the scan time that are accepted, for clock drift between phones and server
+QR_CODE_WINDOW = 1
+# How far back a code is still recognised, to tell an old screenshot (expired) from a forged code
+QR_CODE_EXPIRED_STEPS = 10
+
+
+def qr_secret_key(bus_id):
+    return f'live:bus:{bus_id}:qr_secret'
+
+
+def get_qr_secret(bus_id):
+    """
+    QR secret of a bus, or None if there is no such bus. Cached apart from the bus state,
+    which is published to stream subscribers.
+    """
+    cache = live_cache()
+    secret = cache.get(qr_secret_key(bus_id))
+    if secret is None:
+        secret = Bus.objects.filter(pk=bus_id).values_list('qr_secret', flat=True).first()
+        if secret is not None:
+            cache.set(qr_secret_key(bus_id), secret)
+    return secret
+
+
+def qr_code_step(at=None):
+    """The time step an epoch time (default now) falls in."""
+    return int((time.time() if at is None else at) // QR_CODE_STEP)
+
+
+def qr_code(secret, step):
+    """The code for a time step: RFC 4226 HOTP of the step counter, as the driver app computes it."""
+    key = base64.b32decode(secret)
+    digest = hmac.new(key, struct.pack('>Q', step), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack('>I', digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(value % 10 ** QR_CODE_DIGITS).zfill(QR_CODE_DIGITS)
+
+
+def bus_qr_token(bus, at=None):
+    """The QR payload the driver app of `bus` shows at epoch time `at` (default now)."""
+    return f'{bus.id}:{qr_code(bus.qr_secret, qr_code_step(at))}'
+
+
+def verify_qr_code(bus_id, code, scanned_at=None):
+    """
+    Time step of a bus code that was current (within QR_CODE_WINDOW steps) when it was scanned.
+    Raises SignatureExpired or BadSignature.
+    """
+    secret = get_qr_secret(bus_id)
+    if secret is None or len(code) != QR_CODE_DIGITS or not (code.isascii() and code.isdigit()):
+        raise BadSignature('Unknown bus or malformed QR code')
+    current = qr_code_step(scanned_at)
+    for step in range(current - QR_CODE_WINDOW, current + QR_CODE_WINDOW + 1):
+        if hmac.compare_digest(qr_code(secret, step), code):
+            return step
+    for step in range(current - QR_CODE_EXPIRED_STEPS, current - QR_CODE_WINDOW):
+        if hmac.compare_digest(qr_code(secret, step), code):
+            raise SignatureExpired(f'QR code is {current - step} steps old')
+    raise BadSignature('QR code does not match')
+
+
+@lru_cache(maxsize=1024)
+def unsign_qr_token(qr_token):
+    """
+    Bus id and signing time (epoch seconds) of a legacy signed QR token. Raises BadSignature.
+    Cached, since every student at a stop scans the same token; the age is checked by the caller.
+    """
+    bus_id = TimestampSigner().unsign(qr_token)
+    signed_at = b62_decode(qr_token.rsplit(':', 2)[1])
+    return int(bus_id), signed_at
+
+
+def verify_qr_token(qr_token, scanned_at=None):
+    """
+    Bus id and time step of a QR token that was valid when it was scanned (epoch seconds,
+    default now). The step is None for legacy signed tokens. Raises SignatureExpired or BadSignature.
+    """
+    parts = qr_token.split(':')
+    if len(parts) == 2:
+        bus_id, code = parts
+        if not (bus_id.isascii() and bus_id.isdigit()):
+            raise BadSignature('Malformed QR code')
+        return int(bus_id), verify_qr_code(int(bus_id), code, scanned_at)
+
+    try:
+        bus_id, signed_at = unsign_qr_token(qr_token)
+    except (ValueError, IndexError):
+        raise BadSignature('Malformed QR token')
+    scanned_at = time.time() if scanned_at is None else scanned_at
+    age = scanned_at - signed_at
+    if age > QR_TOKEN_MAX_AGE:
+        raise SignatureExpired(f'QR token age {age:.0f} > {QR_TOKEN_MAX_AGE} seconds')
+    if age < -QR_TOKEN_MAX_AGE:
+        # Signed well after the scan: the clocks involved disagree
+        raise BadSignature('QR token scanned before it was issued')
+    return bus_id, None
+
+
+class ReplayCache:
+    """
+    Bounded, per-process set of (student, bus, trip, step) scans that were already answered, so a
+    student re-scanning the same code is turned away without touching the database. Only a
+    shortcut: the (student, trip) unique constraint is what prevents double boarding.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def add(self, key):
+        with self.lock:
+            self.entries[key] = True
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+used_qr_codes = ReplayCache()
+
+
+def get_boarding_bus_state(bus_id):
+    """
+    Live state of the bus (from the live cache), or None if there is no such bus.
+    A cached "no active trip" is re-checked against the database: the driver may have just
+    started one from another server process.
+    """
+    state = get_bus_state(bus_id)
+    if state is not None and state['active_trip_id'] is None:
+        invalidate_bus_state(bus_id)
+        state = get_bus_state(bus_id)
+    return state
+
+
+def record_boarding(student, bus_id, trip_id, latitude=None, longitude=None, scanned_at=None):
+    """
+    Insert the boarding log and count it. Returns False if the student had already boarded this
+    trip: the (student, trip) unique constraint rejects the insert, so concurrent scans of the
+    same student can't both get in.
+    """
+    scanned_at = scanned_at or timezone.now()
+    try:
+        with transaction.atomic():
+            BoardingLog.objects.create(
+                student=student,
+                bus_id=bus_id,
+                trip_id=trip_id,
+                latitude=latitude,
+                longitude=longitude,
+                scan_time=scanned_at,
+                date=timezone.localdate(scanned_at),
+            )
+            count_boardings(trip_id, [student.class_in_charge_id])
+    except IntegrityError:
+        if BoardingLog.objects.filter(student=student, trip_id=trip_id).exists():
+            return False
+        raise
+    return True
+
+
+def trip_at(trips, bus_id, scanned_at):
+    """The trip of the bus that was running at `scanned_at`, from a list of Trip rows."""
+    for trip in trips:
+        if trip.bus_id == bus_id and trip.start_time <= scanned_at and (trip.end_time is None or scanned_at <= trip.end_time):
+            return trip
+    return None
+
+
+def sync_offline_scans(user, scans):
+    """
+    Record QR scans captured while the app was offline. Each scan is
+    {"id", "qr_token", "scanned_at", "latitude", "longitude"}, plus "student_id" when a driver
+    syncs scans for the students of their bus. The token must have been valid when it was
+    scanned, and the scan is logged against the trip that was running then, even if it has
+    ended since. Replays are idempotent.
+
+    Returns one result per scan, in order: {"id", "status"[, "error"]} with status one of
+    boarded, already_boarded, expired, invalid or rejected.
+    """
+    results = [{'id': scan.get('id') if isinstance(scan, dict) else None} for scan in scans]
+
+    def reject(index, status, error):
+        results[index].update(status=status, error=error)
+
+    # Students the scans are for: the user themself, or a driver's passengers
+    if user.is_driver and user.bus_id is None:
+        students = {}
+    elif user.is_driver:
+        student_ids = {scan.get('student_id') for scan in scans if isinstance(scan, dict)}
+        students = {
+            student.id: student
+            for student in User.objects.filter(
+                id__in=[i for i in student_ids if isinstance(i, int)], is_student=True, bus_id=user.bus_id
+            ).only('id', 'class_in_charge_id')
+        }
+    else:
+        students = {user.id: user}
+
+    latest_allowed = timezone.now() + MAX_CLOCK_SKEW
+    verified = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            reject(index, 'invalid', 'Scan is not an object')
+            continue
+        student = students.get(scan.get('student_id') if user.is_driver else user.id)
+        if student is None:
+            reject(index, 'rejected', 'Not a student of your bus')
+            continue
+        scanned_at = parse_timestamp(scan.get('scanned_at'))
+        if scanned_at is None:
+            reject(index, 'invalid', 'Missing or invalid scanned_at')
+            continue
+        if scanned_at > latest_allowed:
+            reject(index, 'rejected', 'scanned_at is in the future')
+            continue
+        try:
+            bus_id, _ = verify_qr_token(scan.get('qr_token') or '', scanned_at.timestamp())
+        except SignatureExpired:
+            reject(index, 'expired', 'QR Code had expired when it was scanned')
+            continue
+        except BadSignature:
+            reject(index, 'invalid', 'Invalid QR Code')
+            continue
+        verified.append((index, student, bus_id, scanned_at, scan))
+
+    if not verified:
+        return results
+
+    # Trips that were running at any of the scan times, in one query
+    trips = list(
+        Trip.objects.filter(
+            Q(end_time__isnull=True) | Q(end_time__gte=min(v[3] for v in verified)),
+            bus_id__in={v[2] for v in verified},
+            start_time__lte=max(v[3] for v in verified),
+        ).only('id', 'bus_id', 'start_time', 'end_time')
+    )
+    boarded = set(
+        BoardingLog.objects.filter(
+            trip_id__in=[trip.id for trip in trips], student_id__in={v[1].id for v in verified}
+        ).values_list('student_id', 'trip_id')
+    )
+
+    new_logs = []
+    for index, student, bus_id, scanned_at, scan in verified:
+        trip = trip_at(trips, bus_id, scanned_at)
+        if trip is None:
+            reject(index, 'rejected', 'No trip of this bus was running at scanned_at')
+            continue
+        if (student.id, trip.id) in boarded:
+            results[index]['status'] = 'already_boarded'
+            continue
+        boarded.add((student.id, trip.id))
+        new_logs.append((index, student, BoardingLog(
+            student=student,
+            bus_id=bus_id,
+            trip=trip,
+            latitude=parse_coordinate(scan.get('latitude'), 90),
+            longitude=parse_coordinate(scan.get('longitude'), 180),
+            scan_time=scanned_at,
+            date=timezone.localdate(scanned_at),
+        )))
+
+    try:
+        with transaction.atomic():
+            BoardingLog.objects.bulk_create([log for _, _, log in new_logs])
+            grade_ids_by_trip = defaultdict(list)
+            for _, student, log in new_logs:
+                grade_ids_by_trip[log.trip_id].append(student.class_in_charge_id)
+            for trip_id, grade_ids in grade_ids_by_trip.items():
+                count_boardings(trip_id, grade_ids)
+        for index, _, _ in new_logs:
+            results[index]['status'] = 'boarded'
+    except IntegrityError:
+        # The same student was scanned online meanwhile: fall back to one insert per scan
+        for index, student, log in new_logs:
+            created = record_boarding(student, log.bus_id, log.trip_id, log.latitude, log.longitude, log.scan_time)
+            results[index]['status'] = 'boarded' if created else 'already_boarded'
+    return results
@@ -0,0 +1,107 @@
+"""
+Validators for conditional GET (If-None-Match / If-Modified-Since) on the
+endpoints clients poll. Used with django.views.decorators.http.condition, so an
+unchanged poll is answered with 304 before the view builds its response.
+
+Each function returns None when the request would not get a 200 (wrong role,
+no permission), so errors are never turned into 304s.
+"""
+import hashlib
+import time
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.utils import timezone
+
+from .boarding import get_qr_secret
+from .live_state import can_track_bus, get_bus_state
+from .models import BoardingLog, Notification
+
+User = get_user_model()
+
+# The driver dashboard still hands older apps a fresh signed QR token, which they rotate every 30 seconds
+QR_ROTATION_SECONDS = 30
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def bus_fingerprint(state):
+    """What the dashboards show about a bus, taken from the live cache (no queries on a hit)."""
+    if state is None:
+        return None
+    phase = 'morning'
+    if timezone.localtime().time() >= state['evening_trip_start_time']:
+        phase = 'evening'
+    # States cached before destination was added lack it until they expire
+    return (state['bus_id'], state['bus_number'], state['number_plate'], state.get('destination'), state['active_trip_id'], phase)
+
+
+def latest_notification_id(user):
+    return Notification.objects.filter(user=user).aggregate(latest=Max('id'))['latest']
+
+
+def bus_location_etag(request, bus_id):
+    state = get_bus_state(bus_id)
+    if state is None or not can_track_bus(request.user, state):
+        return None
+    return make_etag('bus', bus_id, state['active_trip_id'], state['last_update'], state['latitude'], state['longitude'])
+
+
+def bus_location_last_modified(request, bus_id):
+    state = get_bus_state(bus_id)
+    if state is None or not can_track_bus(request.user, state):
+        return None
+    return state['last_update']
+
+
+def student_dashboard_etag(request):
+    user = request.user
+    if not user.is_student:
+        return None
+
+    state = get_bus_state(user.bus_id) if user.bus_id else None
+    latest_log = BoardingLog.objects.filter(student=user).aggregate(latest=Max('id'))['latest']
+    return make_etag(
+        'student', user.id, timezone.localdate(), bus_fingerprint(state),
+        latest_log, latest_notification_id(user), user.unread_notifications,
+    )
+
+
+def parent_dashboard_etag(request):
+    user = request.user
+    if not user.is_parent:
+        return None
+
+    children = list(user.children.order_by('id').values_list('id', 'bus_id', 'username', 'first_name', 'last_name'))
+    buses = tuple(
+        bus_fingerprint(get_bus_state(bus_id))
+        for bus_id in sorted({child[1] for child in children if child[1]})
+    )
+    latest_log = BoardingLog.objects.filter(student__parent=user).aggregate(latest=Max('id'))['latest']
+    return make_etag(
+        'parent', user.id, timezone.localdate(), tuple(children), buses,
+        latest_log, latest_notification_id(user), user.unread_notifications,
+    )
+
+
+def driver_dashboard_etag(request):
+    user = request.user
+    if not user.is_driver:
+        return None
+    if not user.bus_id:
+        return make_etag('driver', user.id, None)
+
+    state = get_bus_state(user.bus_id)
+    # The names the roster shows, so renaming a student is a change too
+    roster = tuple(
+        User.objects.filter(bus_id=user.bus_id, is_student=True).order_by('id')
+        .values_list('id', 'username', 'first_name', 'last_name')
+    )
+    latest_log = BoardingLog.objects.filter(bus_id=user.bus_id).aggregate(latest=Max('id'))['latest']
+    return make_etag(
+        'driver', user.id, timezone.localdate(), bus_fingerprint(state),
+        roster, latest_log, get_qr_secret(user.bus_id),
+        int(time.time() // QR_ROTATION_SECONDS),
+    )
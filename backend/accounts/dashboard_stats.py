@@ -0,0 +1,130 @@
+"""
+Figures for the superuser and management dashboards (DashboardStatsView). Each scope is
+counted with one conditional aggregate per table, and the result is kept in the live cache for
+DASHBOARD_STATS_TIMEOUT seconds when it is shared between workers (a few seconds otherwise).
+Saving or deleting a user, bus or complaint drops the cached figures of the whole system and of
+the management user it belongs to (and belonged to, if it moved); bulk writes call
+invalidate_dashboard_stats themselves.
+"""
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .live_state import live_cache, live_cache_timeout
+from .models import Bus, Complaint, User
+
+DASHBOARD_STATS_TIMEOUT = 60
+
+# Mock revenue: $120 per user
+REVENUE_PER_USER = 120
+
+OPEN_COMPLAINT_STATUSES = ('submitted', 'in_action')
+
+
+def dashboard_stats_key(manager_id):
+    return f'stats:dashboard:{manager_id or "all"}'
+
+
+def system_stats():
+    """Figures of the whole system, for superusers."""
+    users = User.objects.aggregate(
+        total_users=Count('id'),
+        active_users=Count('id', filter=Q(is_active=True)),
+        # Institutions are management users; verified once activated
+        verified_institutions=Count('id', filter=Q(is_management=True, is_active=True)),
+        pending_institutions=Count('id', filter=Q(is_management=True, is_active=False)),
+    )
+    breakdown = (
+        User.objects.filter(is_management=True, is_active=True)
+        .annotate(active_users=Count('managed_members', filter=Q(managed_members__is_active=True)))
+        .values('id', 'username', 'email', 'active_users')
+        .order_by('id')
+    )
+    return {
+        **users,
+        'management_users': users['verified_institutions'] + users['pending_institutions'],
+        'total_buses': Bus.objects.count(),
+        'management_breakdown': list(breakdown),
+        'open_complaints': Complaint.objects.filter(status__in=OPEN_COMPLAINT_STATUSES).count(),
+    }
+
+
+def management_stats(manager_id):
+    """Figures of the members and buses of one management user."""
+    users = User.objects.filter(managed_by_id=manager_id).aggregate(
+        total_users=Count('id'),
+        active_users=Count('id', filter=Q(is_active=True)),
+    )
+    return {
+        **users,
+        'management_users': 0,
+        'verified_institutions': 0,
+        'pending_institutions': 0,
+        'total_buses': Bus.objects.filter(management_id=manager_id).count(),
+        'management_breakdown': [],
+        'open_complaints': Complaint.objects.filter(
+            user__managed_by_id=manager_id, status__in=OPEN_COMPLAINT_STATUSES
+        ).count(),
+    }
+
+
+def get_dashboard_stats(user):
+    """Dashboard figures for a superuser (manager_id None) or a management user, cached."""
+    manager_id = None if user.is_superuser else user.id
+    cache = live_cache()
+    stats = cache.get(dashboard_stats_key(manager_id))
+    if stats is None:
+        stats = system_stats() if manager_id is None else management_stats(manager_id)
+        stats['revenue'] = stats['total_users'] * REVENUE_PER_USER
+        cache.set(dashboard_stats_key(manager_id), stats, live_cache_timeout(DASHBOARD_STATS_TIMEOUT))
+    return stats
+
+
+def invalidate_dashboard_stats(*manager_ids):
+    """Drop the cached figures of the whole system and of the given management users."""
+    live_cache().delete_many([dashboard_stats_key(None)] + [
+        dashboard_stats_key(manager_id) for manager_id in manager_ids if manager_id
+    ])
+
+
+def affects_stats(kwargs, counted_fields):
+    """False for saves limited to fields the figures don't depend on, such as a bus position."""
+    update_fields = kwargs.get('update_fields')
+    return update_fields is None or not counted_fields.isdisjoint(update_fields)
+
+
+def previous_value(instance, field):
+    """The value of `field` (an attname) in the database, before this save of `instance`."""
+    if instance.pk is None:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(pre_save, sender=User)
+def remember_manager(sender, instance, **kwargs):
+    # A member moved to another management user leaves the previous one's figures stale too
+    instance._previous_managed_by_id = previous_value(instance, 'managed_by_id') if affects_stats(kwargs, {'managed_by'}) else None
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    if affects_stats(kwargs, {'is_active', 'is_management', 'managed_by'}):
+        invalidate_dashboard_stats(instance.managed_by_id, getattr(instance, '_previous_managed_by_id', None))
+
+
+@receiver(pre_save, sender=Bus)
+def remember_management(sender, instance, **kwargs):
+    instance._previous_management_id = previous_value(instance, 'management_id') if affects_stats(kwargs, {'management'}) else None
+
+
+@receiver([post_save, post_delete], sender=Bus)
+def bus_changed(sender, instance, **kwargs):
+    if affects_stats(kwargs, {'management'}):
+        invalidate_dashboard_stats(instance.management_id, getattr(instance, '_previous_management_id', None))
+
+
+@receiver([post_save, post_delete], sender=Complaint)
+def complaint_changed(sender, instance, **kwargs):
+    if affects_stats(kwargs, {'status', 'user'}):
+        managed_by_id = User.objects.filter(id=instance.user_id).values_list('managed_by_id', flat=True).first()
+        invalidate_dashboard_stats(managed_by_id)
@@ -0,0 +1,50 @@
+"""
+Leader lease kept in a database row, so that work meant to run once per cluster (the
+background scheduler) runs in exactly one process even though every worker starts it.
+"""
+import os
+import socket
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SchedulerLease
+
+
+def holder_id():
+    # Computed on each call: gunicorn workers fork after the app may have been loaded
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(name, holder, seconds):
+    """
+    Take or renew the lease for `seconds`. Succeeds if it is free, expired, or already held by `holder`.
+    Returns whether `holder` now holds the lease.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=seconds)
+
+    # A single conditional UPDATE, so two workers racing for an expired lease cannot both win
+    renewed = SchedulerLease.objects.filter(name=name).filter(
+        Q(holder=holder) | Q(expires_at__lte=now)
+    ).update(holder=holder, expires_at=expires_at)
+    if renewed:
+        return True
+
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=name, holder=holder, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        # Someone else holds it
+        return False
+
+
+def holds_lease(name, holder):
+    return SchedulerLease.objects.filter(name=name, holder=holder, expires_at__gt=timezone.now()).exists()
+
+
+def release_lease(name, holder):
+    SchedulerLease.objects.filter(name=name, holder=holder).delete()
@@ -0,0 +1,162 @@
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import Bus, Trip, User
+
+# Cache alias configured in settings.CACHES (locmem by default, Redis when LIVE_CACHE_URL is set)
+LIVE_CACHE_ALIAS = 'live'
+
+# A parent's children rarely change bus, so their bus ids can be cached for longer (shared cache only)
+PARENT_BUSES_TIMEOUT = 300
+
+# Fields of a child that decide which buses their parent may track
+PARENT_BUS_FIELDS = {'parent', 'parent_id', 'bus', 'bus_id'}
+
+
+def live_cache():
+    return caches[LIVE_CACHE_ALIAS]
+
+
+def live_cache_timeout(timeout):
+    """
+    `timeout` if every worker shares the live cache, so a write's invalidation reaches them all.
+    In process memory (no LIVE_CACHE_URL) only the writing worker's copy is dropped, so entries
+    keep the alias's short default and other workers catch up within seconds.
+    """
+    return DEFAULT_TIMEOUT if isinstance(live_cache(), LocMemCache) else timeout
+
+
+def bus_state_key(bus_id):
+    return f'live:bus:{bus_id}'
+
+
+def parent_buses_key(user_id):
+    return f'live:parent:{user_id}:buses'
+
+
+def state_from_bus(bus, active_trip_id):
+    return {
+        'bus_id': bus.id,
+        'bus_number': bus.bus_number,
+        'number_plate': bus.number_plate,
+        'destination': bus.destination,
+        'evening_trip_start_time': bus.evening_trip_start_time,
+        'management_id': bus.management_id,
+        'latitude': bus.latitude,
+        'longitude': bus.longitude,
+        'last_update': bus.last_update,
+        'active_trip_id': active_trip_id,
+    }
+
+
+def load_bus_state(bus_id):
+    """Build the live state of a bus from the database. Returns None if the bus does not exist."""
+    bus = Bus.objects.filter(pk=bus_id).only(
+        'id', 'bus_number', 'number_plate', 'destination', 'evening_trip_start_time',
+        'management_id', 'latitude', 'longitude', 'last_update'
+    ).first()
+    if bus is None:
+        return None
+    active_trip_id = Trip.objects.filter(bus_id=bus_id, is_active=True).values_list('id', flat=True).first()
+    return state_from_bus(bus, active_trip_id)
+
+
+def get_bus_state(bus_id):
+    """
+    Return the live state of a bus: position, last update and active trip.
+    Served from the live cache, falling back to the database on a miss.
+    """
+    cache = live_cache()
+    state = cache.get(bus_state_key(bus_id))
+    if state is None:
+        state = load_bus_state(bus_id)
+        if state is not None:
+            cache.set(bus_state_key(bus_id), state)
+    return state
+
+
+def set_bus_state(bus, active_trip_id):
+    """Write the full state of a bus, e.g. when a trip starts or ends, and notify stream subscribers."""
+    from .live_stream import publish_bus_update
+    state = state_from_bus(bus, active_trip_id)
+    live_cache().set(bus_state_key(bus.id), state)
+    publish_bus_update(bus.id, state)
+
+
+def update_bus_state(bus_id, **changes):
+    """
+    Apply changes (e.g. a new position) to a cached bus state and notify stream subscribers.
+    If the bus is not cached there is nothing to update; the next read loads it.
+    """
+    from .live_stream import publish_bus_update
+    publish_bus_update(bus_id, changes)
+
+    cache = live_cache()
+    state = cache.get(bus_state_key(bus_id))
+    if state is None:
+        return
+    state.update(changes)
+    cache.set(bus_state_key(bus_id), state)
+
+
+def invalidate_bus_state(bus_id):
+    live_cache().delete(bus_state_key(bus_id))
+
+
+def get_parent_bus_ids(user):
+    """Ids of the buses a parent's children are assigned to."""
+    cache = live_cache()
+    bus_ids = cache.get(parent_buses_key(user.id))
+    if bus_ids is None:
+        bus_ids = set(user.children.exclude(bus__isnull=True).values_list('bus_id', flat=True))
+        cache.set(parent_buses_key(user.id), bus_ids, live_cache_timeout(PARENT_BUSES_TIMEOUT))
+    return bus_ids
+
+
+def invalidate_parent_buses(*user_ids):
+    live_cache().delete_many([parent_buses_key(user_id) for user_id in user_ids if user_id])
+
+
+def changes_parent_buses(instance, kwargs):
+    """False for saves that can't change a parent's buses: not of a child, or limited to other fields."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and PARENT_BUS_FIELDS.isdisjoint(update_fields):
+        return False
+    return instance.is_student or instance.parent_id is not None
+
+
+@receiver(pre_save, sender=User)
+def remember_parent(sender, instance, **kwargs):
+    # A re-parented child's previous parent loses that bus too
+    instance._previous_parent_id = None
+    if instance.pk and changes_parent_buses(instance, kwargs):
+        instance._previous_parent_id = User.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def child_saved(sender, instance, **kwargs):
+    if changes_parent_buses(instance, kwargs):
+        invalidate_parent_buses(instance.parent_id, getattr(instance, '_previous_parent_id', None))
+
+
+@receiver(post_delete, sender=User)
+def child_deleted(sender, instance, **kwargs):
+    invalidate_parent_buses(instance.parent_id)
+
+
+def can_track_bus(user, state):
+    """Same rules as BusLocationView always had, evaluated against the cached state."""
+    if user.is_superuser:
+        return True
+    elif user.is_management:
+        return state['management_id'] == user.id
+    elif user.is_driver:
+        return user.bus_id == state['bus_id']
+    elif user.is_student or user.is_teacher:
+        return user.bus_id == state['bus_id']
+    elif user.is_parent:
+        # Check if any child is assigned to this bus
+        return state['bus_id'] in get_parent_bus_ids(user)
+    return False
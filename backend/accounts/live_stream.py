@@ -0,0 +1,181 @@
+"""
+Server-Sent Events stream of live bus positions.
+
+Parents, students and staff subscribe to a bus and get an event each time the
+bus's live state changes, instead of polling trip/bus-location/<bus_id>/.
+Updates are fanned out in-process through one subscriber group per bus; the
+shared live cache is re-checked periodically so that fixes accepted by another
+worker still reach every subscriber.
+
+The stream is an async view, so serve the project through backend/asgi.py,
+e.g. gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker
+Under WSGI each stream would hold a whole worker for up to STREAM_MAX_SECONDS, so
+requests that don't come through ASGI are refused and clients keep polling.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .live_state import can_track_bus, get_bus_state
+
+# How often a subscriber re-checks the shared live cache for fixes accepted by other workers
+STREAM_POLL_SECONDS = 5
+
+# Comment line sent on idle streams so proxies do not drop the connection
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Streams are closed after this long; EventSource clients reconnect automatically
+STREAM_MAX_SECONDS = 600
+
+# Reconnect delay suggested to the client, in milliseconds
+STREAM_RETRY_MS = 3000
+
+# Pending updates kept per subscriber; older ones are dropped for slow clients
+SUBSCRIBER_QUEUE_SIZE = 50
+
+PUBLIC_FIELDS = ('latitude', 'longitude', 'last_update', 'is_active_trip')
+
+_groups = defaultdict(set)
+_groups_lock = threading.Lock()
+
+
+class Subscription:
+    """One connected client, bound to the event loop serving its stream."""
+
+    def __init__(self, bus_id):
+        self.bus_id = bus_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, changes):
+        # Runs on self.loop
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(changes)
+
+    def __enter__(self):
+        with _groups_lock:
+            _groups[self.bus_id].add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        with _groups_lock:
+            group = _groups.get(self.bus_id)
+            if group is not None:
+                group.discard(self)
+                if not group:
+                    del _groups[self.bus_id]
+
+
+def publish_bus_update(bus_id, changes):
+    """
+    Push changed live-state fields to every subscriber of the bus in this process.
+    Safe to call from synchronous views running in any thread.
+    """
+    with _groups_lock:
+        subscribers = list(_groups.get(bus_id, ()))
+    for subscription in subscribers:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, dict(changes))
+        except RuntimeError:
+            # The subscriber's event loop has already shut down
+            pass
+
+
+def public_state(state):
+    """Fields of the live state sent to clients, same shape as BusLocationView."""
+    public = {
+        'latitude': state.get('latitude'),
+        'longitude': state.get('longitude'),
+        'last_update': state.get('last_update'),
+    }
+    if 'active_trip_id' in state:
+        public['is_active_trip'] = state['active_trip_id'] is not None
+    return public
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def authenticate(request):
+    """Authenticate the JWT in the Authorization header, like the DRF views do."""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    return result[0] if result else None
+
+
+async def stream_bus_state(bus_id, state):
+    sent = public_state(state)
+    started = last_sent = time.monotonic()
+
+    # Join the bus's group before sending the snapshot so no update falls in between
+    with Subscription(bus_id) as subscription:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        yield format_event('snapshot', {'bus_id': bus_id, 'bus_number': state['bus_number'], **sent})
+
+        while time.monotonic() - started < STREAM_MAX_SECONDS:
+            try:
+                changes = await asyncio.wait_for(subscription.queue.get(), STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                # Nothing published in this process; the fix may have landed on another worker
+                latest = await sync_to_async(get_bus_state)(bus_id)
+                changes = latest or {}
+
+            update = public_state(changes)
+            delta = {
+                field: update[field]
+                for field in PUBLIC_FIELDS
+                if field in update and update[field] != sent.get(field)
+            }
+            if delta:
+                sent.update(delta)
+                last_sent = time.monotonic()
+                yield format_event('update', {'bus_id': bus_id, **delta})
+            elif time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+
+
+async def bus_location_stream(request, bus_id):
+    """
+    GET trip/bus-location/<bus_id>/stream/
+
+    Same permission rules as BusLocationView. Sends a 'snapshot' event with the
+    current state, then an 'update' event with only the changed fields each time
+    the bus reports a new fix or its trip starts or ends.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'Live streaming is not available on this server; poll trip/bus-location/<bus_id>/ instead.'},
+            status=501,
+        )
+
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+    state = await sync_to_async(get_bus_state)(bus_id)
+    if state is None:
+        return JsonResponse({'error': 'Bus not found'}, status=404)
+
+    allowed = await sync_to_async(can_track_bus)(user, state)
+    if not allowed:
+        return JsonResponse({'error': 'You do not have permission to track this bus.'}, status=403)
+
+    response = StreamingHttpResponse(stream_bus_state(bus_id, state), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,128 @@
+"""
+Bulk email delivery: one message per recipient (addresses are never shared between
+recipients), sent over a reused connection and rate limited to stay within the mail
+provider's sending limits.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils.html import escape
+
+# Replaced with each recipient's name in the subject and bodies
+NAME_PLACEHOLDER = '{name}'
+DEFAULT_NAME = 'there'
+
+
+def personalise(text, name):
+    if not text:
+        return text
+    return text.replace(NAME_PLACEHOLDER, name or DEFAULT_NAME)
+
+
+def build_message(subject, body, to, name=None, html_body=None, from_email=None):
+    message = EmailMultiAlternatives(
+        subject=personalise(subject, name),
+        body=personalise(body, name),
+        from_email=from_email,
+        to=to,
+    )
+    if html_body:
+        # The HTML body is already rendered, so the name has to be escaped here
+        message.attach_alternative(personalise(html_body, escape(name) if name else None), "text/html")
+    return message
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` messages per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide limiter, or None if EMAIL_MAX_PER_SECOND is not set."""
+    global _rate_limiter
+    rate = settings.EMAIL_MAX_PER_SECOND
+    if not rate:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None or _rate_limiter.rate != rate:
+            _rate_limiter = RateLimiter(rate)
+    return _rate_limiter
+
+
+class BulkMailer:
+    """
+    Sends messages one at a time over a reused connection, reconnecting every
+    EMAIL_MAX_PER_CONNECTION messages (providers drop long-lived SMTP sessions). Use it as a
+    context manager so the connection is closed at the end.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.sent_on_connection = 0
+        self.open_error = None
+        self.limiter = get_rate_limiter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.sent_on_connection = 0
+
+    def send(self, message):
+        """Send one message. Raises if it was not sent."""
+        if self.open_error is not None:
+            # The server could not be reached; don't wait on it again for every message
+            raise self.open_error
+        if self.connection is not None and self.sent_on_connection >= settings.EMAIL_MAX_PER_CONNECTION:
+            self.close()
+        if self.connection is None:
+            connection = get_connection(fail_silently=False)
+            try:
+                connection.open()
+            except Exception as e:
+                self.open_error = e
+                raise
+            self.connection = connection
+
+        if self.limiter:
+            self.limiter.acquire()
+        self.sent_on_connection += 1
+        try:
+            self.connection.send_messages([message])
+        except Exception:
+            # The session may be unusable after an error; start a fresh one for the next message
+            self.close()
+            raise
@@ -0,0 +1,131 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import User, Bus, Trip, BoardingLog
+
+# Indexes and partial constraints added for the dashboard lookups (migration 0026)
+INDEX_NAMES = [
+    'boardinglog_bus_trip_idx',
+    'boardinglog_bus_date_idx',
+    'boardinglog_student_date_idx',
+    'trip_active_start_idx',
+    'one_active_trip_per_bus',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Seeds a year of trips and boarding logs and reports p50/p99 latency of the dashboard '
+            'BoardingLog and Trip lookups with and without their indexes. Everything runs in one '
+            'transaction that is rolled back, so the database is left as it was.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--buses', type=int, default=47)
+        parser.add_argument('--students-per-bus', type=int, default=60)
+        parser.add_argument('--runs', type=int, default=200, help='Timed runs of each query.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.seed(options['days'], options['buses'], options['students_per_bus'])
+                with_indexes = self.measure(options['runs'])
+                with connection.cursor() as cursor:
+                    for name in INDEX_NAMES:
+                        cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+                without_indexes = self.measure(options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"{'query':<28}{'before p50':>12}{'before p99':>12}{'after p50':>12}{'after p99':>12}  (ms)")
+        for name, after in with_indexes.items():
+            before = without_indexes[name]
+            self.stdout.write(f"{name:<28}{before[0]:>12.3f}{before[1]:>12.3f}{after[0]:>12.3f}{after[1]:>12.3f}")
+
+    def seed(self, days, bus_count, students_per_bus):
+        started = time.monotonic()
+        management = User.objects.create(username='bench-management', email='bench-management@bench.test', is_management=True)
+        driver = User.objects.create(username='bench-driver', email='bench-driver@bench.test', is_driver=True, managed_by=management)
+        self.buses = Bus.objects.bulk_create([
+            Bus(bus_number=f'BENCH-{i}', number_plate=f'BENCH-{i}', management=management)
+            for i in range(bus_count)
+        ])
+        students = User.objects.bulk_create([
+            User(username=f'bench-student-{bus.id}-{i}', email=f'bench-student-{bus.id}-{i}@bench.test', password='!', is_student=True, managed_by=management, bus=bus)
+            for bus in self.buses for i in range(students_per_bus)
+        ])
+        self.students_by_bus = {bus.id: [s for s in students if s.bus_id == bus.id] for bus in self.buses}
+        self.students = students
+
+        # start_time and date are auto_now_add, so each day's rows are backdated after insert
+        today = timezone.localdate()
+        self.days = [today - timedelta(days=n) for n in range(days)]
+        log_count = 0
+        for day in reversed(self.days):
+            is_today = day == today
+            trips = []
+            for trip_type, hour in (('morning', 8), ('evening', 16)):
+                trips += Trip.objects.bulk_create([
+                    Trip(bus=bus, driver=driver, trip_type=trip_type, is_active=is_today and trip_type == 'evening')
+                    for bus in self.buses
+                ])
+                Trip.objects.filter(id__in=[t.id for t in trips[-bus_count:]]).update(
+                    start_time=timezone.make_aware(datetime.combine(day, datetime.min.time()).replace(hour=hour))
+                )
+
+            logs = [
+                BoardingLog(student=student, bus_id=trip.bus_id, trip=trip)
+                for trip in trips
+                for student in self.students_by_bus[trip.bus_id]
+                if self.random.random() < 0.95
+            ]
+            BoardingLog.objects.bulk_create(logs, batch_size=5000)
+            BoardingLog.objects.filter(trip_id__in=[t.id for t in trips]).update(date=day)
+            log_count += len(logs)
+
+        self.trips = list(Trip.objects.filter(bus__in=self.buses).values_list('id', 'bus_id'))
+        self.stdout.write(f"Seeded {len(self.trips)} trips and {log_count} boarding logs in {time.monotonic() - started:.0f}s")
+
+    def measure(self, runs):
+        today = timezone.localdate()
+        day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+        day_end = day_start + timedelta(days=1)
+        queries = {
+            'log by student, trip': lambda: BoardingLog.objects.filter(
+                student=self.random.choice(self.students), trip_id=self.random.choice(self.trips)[0]).exists(),
+            'log by bus, trip': lambda: BoardingLog.objects.filter(
+                bus_id=self.random.choice(self.trips)[1], trip_id=self.random.choice(self.trips)[0]).count(),
+            'log by bus, date': lambda: BoardingLog.objects.filter(
+                bus=self.random.choice(self.buses), date=self.random.choice(self.days)).count(),
+            'log by student, date, type': lambda: BoardingLog.objects.filter(
+                student=self.random.choice(self.students), date=self.random.choice(self.days),
+                trip__trip_type='morning').exists(),
+            'trip by bus, active': lambda: Trip.objects.filter(
+                bus=self.random.choice(self.buses), is_active=True).first(),
+            'trip by day, active': lambda: Trip.objects.filter(
+                start_time__gte=day_start, start_time__lt=day_end, is_active=True).order_by('start_time').first(),
+        }
+
+        results = {}
+        for name, query in queries.items():
+            query() # warm up
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                query()
+                timings.append((time.perf_counter() - started) * 1000)
+            percentiles = statistics.quantiles(timings, n=100)
+            results[name] = (statistics.median(timings), percentiles[98])
+        return results
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from accounts.push import check_push_receipts
+
+class Command(BaseCommand):
+    help = 'Fetches Expo push receipts for sent notifications and clears push tokens of devices that are no longer registered.'
+
+    def handle(self, *args, **options):
+        checked, pruned = check_push_receipts()
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} push receipts. Cleared {pruned} dead push tokens."))
@@ -0,0 +1,56 @@
+import csv
+import math
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from accounts.member_import import IMPORT_CHUNK_SIZE, MemberImport, read_rows
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = ('Registers the teachers, drivers and students (with their parents) listed in a CSV or '
+            'JSON file for a management user, as ImportMembersView does but without its row limit. '
+            'Credential emails are queued in the outbox.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header line, or JSON list of members.')
+        parser.add_argument('--manager', required=True, help='Username of the management user (or superuser) importing.')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Default: from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        manager = User.objects.filter(Q(is_management=True) | Q(is_superuser=True), username=options['manager']).first()
+        if manager is None:
+            raise CommandError(f"No management user or superuser named {options['manager']}")
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        format = options['format'] or ('json' if options['path'].lower().endswith('.json') else 'csv')
+        if not os.path.exists(options['path']):
+            raise CommandError(f"No such file: {options['path']}")
+
+        importer = MemberImport(manager, options['chunk_size'])
+        read_error = None
+        with open(options['path'], encoding='utf-8-sig', newline='') as file:
+            try:
+                importer.run(read_rows(file, format))
+            except (ValueError, csv.Error) as e:
+                # Rows are read as they are imported, so earlier chunks may already be in
+                read_error = e
+
+        report = importer.report()
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']} ({error['username'] or '-'}): {'; '.join(error['errors'])}")
+        style = self.style.SUCCESS if not report['failed'] and not read_error else self.style.WARNING
+        self.stdout.write(style(f"Created {report['created']} members. {report['failed']} rows failed."))
+        quota = settings.EMAIL_DAILY_QUOTA
+        if quota and report['emails_queued'] > quota:
+            days = math.ceil(report['emails_queued'] / quota)
+            self.stdout.write(self.style.WARNING(
+                f"Queued {report['emails_queued']} credential emails; with EMAIL_DAILY_QUOTA={quota} they take up to {days} days to go out."
+            ))
+        if read_error:
+            read = len(importer.results)
+            raise CommandError(f'Could not read the file past row {read}: {read_error}. Rows after {read} were not imported.')
@@ -0,0 +1,95 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.boarding import bus_qr_token
+from accounts.models import User, Bus, Trip, BoardingLog
+from accounts.trip_stats import start_trip_stats
+
+
+class Command(BaseCommand):
+    help = ('Fires concurrent QR boarding scans at a running server (sharing this database) and reports '
+            'latency and outcomes. Creates its own bus, trip and students and deletes them afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--students', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=2,
+                            help='Scans per student, fired concurrently; all but one must come back as already boarded.')
+
+    def handle(self, *args, **options):
+        prefix = f'loadtest-{uuid.uuid4().hex[:8]}'
+        bus = Bus.objects.create(bus_number=prefix, number_plate=prefix)
+        users = []
+        try:
+            driver = User.objects.create(username=f'{prefix}-driver', email=f'{prefix}-driver@loadtest.invalid', is_driver=True, bus=bus)
+            users.append(driver)
+            students = User.objects.bulk_create([
+                User(username=f'{prefix}-student-{i}', email=f'{prefix}-student-{i}@loadtest.invalid', password='!', is_student=True, bus=bus)
+                for i in range(options['students'])
+            ])
+            users += students
+            trip = Trip.objects.create(bus=bus, driver=driver)
+            start_trip_stats(trip)
+
+            self.run_scans(bus, students, options)
+            self.verify_boardings(trip, students)
+        finally:
+            bus.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def run_scans(self, bus, students, options):
+        url = options['base_url'].rstrip('/') + reverse('student_board')
+        qr_token = bus_qr_token(bus)
+        access_tokens = {student.id: str(AccessToken.for_user(student)) for student in students}
+        scans = [student for student in students for _ in range(options['repeat'])]
+        random.shuffle(scans)
+
+        sessions = threading.local()
+
+        def scan(student):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                response = sessions.session.post(
+                    url,
+                    json={'qr_token': qr_token, 'latitude': 10.0, 'longitude': 20.0},
+                    headers={'Authorization': f'Bearer {access_tokens[student.id]}'},
+                    timeout=30,
+                )
+                outcome = response.status_code
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            return outcome, (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(scan, scans))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(ms for _, ms in results)
+        percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        outcomes = {}
+        for outcome, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        self.stdout.write(f"{len(results)} scans in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s), concurrency {options['concurrency']}")
+        self.stdout.write(f"Latency ms: p50 {percentiles[49]:.1f}  p95 {percentiles[94]:.1f}  p99 {percentiles[98]:.1f}  max {timings[-1]:.1f}")
+        self.stdout.write("Outcomes: " + ", ".join(f"{outcome}: {count}" for outcome, count in sorted(outcomes.items(), key=str)))
+
+    def verify_boardings(self, trip, students):
+        logs = BoardingLog.objects.filter(trip=trip).count()
+        trip.refresh_from_db()
+        if logs != len(students) or trip.boarded_count != len(students):
+            raise CommandError(f"Expected {len(students)} boardings, found {logs} logs and a counter of {trip.boarded_count}")
+        self.stdout.write(self.style.SUCCESS(f"{logs} students boarded exactly once; trip counter matches."))
@@ -1,122 +1,154 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from accounts.models import User, Bus, Trip, BoardingLog
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from accounts.models import User, BoardingLog, MissingStudentAlert
+from accounts.alert_schedule import alert_times
+from accounts.attendance import excused
+from accounts.outbox import enqueue_email
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
-from datetime import timedelta
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+from operator import attrgetter
 
 class Command(BaseCommand):
     help = 'Sends email to parents and teachers of students who have not boarded the bus by the designated time.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--at',
+            help='Check the alerts due at this local minute (ISO format, e.g. 2026-10-17T09:00) instead of now. '
+                 'The scheduler passes the minute it was due for, so a late run still checks the right one.'
+        )
+
     def handle(self, *args, **options):
-        now = timezone.localtime()
+        if options.get('at'):
+            now = datetime.fromisoformat(options['at'])
+            if timezone.is_naive(now):
+                now = timezone.make_aware(now)
+            now = timezone.localtime(now)
+        else:
+            now = timezone.localtime()
         current_time = now.time()
         
         managements = User.objects.filter(is_management=True, is_active=True)
         emails_sent = 0
 
         for mgmt in managements:
-            morning_time = mgmt.morning_arrival_time
-            evening_time = mgmt.evening_departure_time
-            
-            # Morning trigger (exact match of hour and minute)
-            is_morning_trigger = (current_time.hour == morning_time.hour and current_time.minute == morning_time.minute)
-            
-            # Evening trigger (3 minutes before departure)
-            evening_dt = timezone.datetime.combine(now.date(), evening_time)
-            evening_trigger_time = (evening_dt - timedelta(minutes=3)).time()
-            is_evening_trigger = (current_time.hour == evening_trigger_time.hour and current_time.minute == evening_trigger_time.minute)
-
-            if not (is_morning_trigger or is_evening_trigger):
+            # Morning trigger at arrival time, evening trigger 3 minutes before departure (hour and minute match)
+            due_trip_types = [
+                trip_type
+                for trip_type, alert_time in alert_times(mgmt.morning_arrival_time, mgmt.evening_departure_time)
+                if (current_time.hour, current_time.minute) == (alert_time.hour, alert_time.minute)
+            ]
+            if not due_trip_types:
                 continue
 
-            trip_type = 'morning' if is_morning_trigger else 'evening'
-            self.stdout.write(f"Trigger matched for organization: {mgmt.organization_name or mgmt.username} ({trip_type} trip)")
-
-            # Find all active students managed by this management
-            students = User.objects.filter(managed_by=mgmt, is_student=True, is_active=True)
-            missing_students_by_bus = {}
-
-            for student in students:
-                if not student.bus:
-                    continue
-                
-                # Check if boarded today for this trip type
-                boarded = BoardingLog.objects.filter(
-                    student=student, 
-                    date=now.date(),
-                    trip__trip_type=trip_type
-                ).exists()
-
-                if not boarded:
-                    bus_id = student.bus.id
-                    if bus_id not in missing_students_by_bus:
-                        missing_students_by_bus[bus_id] = []
-                    missing_students_by_bus[bus_id].append(student)
-
-            # Send emails per bus
-            for bus_id, missing_students in missing_students_by_bus.items():
-                if not missing_students:
-                    continue
-
-                bus = Bus.objects.get(id=bus_id)
-                # Find teachers assigned to this bus
-                teachers = User.objects.filter(managed_by=mgmt, is_teacher=True, bus=bus, is_active=True)
-                teacher_emails = [t.email for t in teachers if t.email]
-                
-                # Find parents
-                parent_emails = []
-                for student in missing_students:
-                    if student.parent and student.parent.email:
-                        parent_emails.append(student.parent.email)
-                
-                # Find driver to mention (optional but helpful context, we just need bus_number)
-                
-                subject = f"Alert: Missing Students for {bus.bus_number} ({trip_type.capitalize()} Trip)"
-                
-                # Prepare context for the template
-                context_students = []
-                for student in missing_students:
-                    parent_contact = student.parent.phone if student.parent and student.parent.phone else "Not provided"
-                    context_students.append({
-                        'username': student.username,
-                        'parent_contact': parent_contact
-                    })
-                
-                context = {
-                    'bus_number': bus.bus_number,
-                    'trip_type': trip_type,
-                    'missing_students': context_students
-                }
-                
-                # Render HTML template
-                html_message = render_to_string('accounts/emails/missing_students.html', context)
-                plain_message = strip_tags(html_message)
-                
-                recipients = list(set(teacher_emails + parent_emails))
-                
-                if not recipients:
-                    self.stdout.write(f"No valid email recipients found for bus {bus.bus_number}. Skipping.")
-                    continue
-                
-                try:
-                    # Send multi-alternative email (HTML + Plain text fallback)
-                    email = EmailMultiAlternatives(
-                        subject=subject,
-                        body=plain_message,
-                        from_email='admin@schoolapp.com',
-                        to=recipients
-                    )
-                    email.attach_alternative(html_message, "text/html")
-                    email.send(fail_silently=False)
-                    
-                    self.stdout.write(self.style.SUCCESS(f"Successfully sent alert to {len(recipients)} recipients for bus {bus.bus_number}"))
-                    emails_sent += 1
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Failed to send email for bus {bus.bus_number}: {e}"))
+            # Morning and evening alerts can fall on the same minute; each is checked
+            for trip_type in due_trip_types:
+                self.stdout.write(f"Trigger matched for organization: {mgmt.organization_name or mgmt.username} ({trip_type} trip)")
+
+                # Claim the alert and queue its emails together: a repeated or overlapping run for the
+                # same minute sends nothing, and a crashed run leaves the alert unclaimed
+                with transaction.atomic():
+                    _, created = MissingStudentAlert.objects.get_or_create(management=mgmt, date=now.date(), trip_type=trip_type)
+                    if not created:
+                        self.stdout.write(f"Alert already sent for {mgmt.organization_name or mgmt.username} ({trip_type} trip). Skipping.")
+                        continue
+
+                    emails_sent += self.notify_missing_students(mgmt, trip_type, now.date())
 
         if emails_sent == 0:
-            self.stdout.write("Run complete. No emails were sent during this check.")
+            self.stdout.write("Run complete. No emails were queued during this check.")
         else:
-            self.stdout.write(self.style.SUCCESS(f"Run complete. Sent {emails_sent} alert emails."))
+            self.stdout.write(self.style.SUCCESS(f"Run complete. Queued {emails_sent} alert emails."))
+
+    def notify_missing_students(self, mgmt, trip_type, date):
+        """
+        Email the parents and teachers of every bus with students of this organisation
+        who have not boarded a trip of this type on the given date. Returns the number of emails queued.
+        """
+        # Anti-join: active students with a bus, no boarding log for this trip and not marked
+        # absent or on leave for it, grouped by bus
+        boarded = BoardingLog.objects.filter(student=OuterRef('pk'), date=date, trip__trip_type=trip_type)
+        missing_students = (
+            User.objects.filter(managed_by=mgmt, is_student=True, is_active=True, bus__isnull=False)
+            .exclude(Exists(boarded))
+            .exclude(excused(date, trip_type))
+            .select_related('bus', 'parent')
+            .order_by('bus_id', 'id')
+        )
+        missing_students_by_bus = []
+        for _, group in groupby(missing_students, key=attrgetter('bus_id')):
+            students = list(group)
+            missing_students_by_bus.append((students[0].bus, students))
+        if not missing_students_by_bus:
+            return 0
+
+        # Find teachers assigned to these buses
+        teacher_emails_by_bus = defaultdict(list)
+        teachers = User.objects.filter(
+            managed_by=mgmt, is_teacher=True, is_active=True,
+            bus_id__in=[bus.id for bus, _ in missing_students_by_bus]
+        ).exclude(email='').values_list('bus_id', 'email', 'first_name', 'last_name', 'username')
+        for bus_id, email, first_name, last_name, username in teachers:
+            teacher_emails_by_bus[bus_id].append((email, f"{first_name} {last_name}".strip() or username))
+
+        emails_sent = 0
+
+        # Queue emails per bus
+        for bus, missing_students in missing_students_by_bus:
+            teacher_emails = teacher_emails_by_bus[bus.id]
+
+            # Find parents
+            parent_emails = []
+            for student in missing_students:
+                if student.parent and student.parent.email:
+                    parent_emails.append((student.parent.email, student.parent.get_full_name() or student.parent.username))
+
+            subject = f"Alert: Missing Students for {bus.bus_number} ({trip_type.capitalize()} Trip)"
+
+            # Prepare context for the template
+            context_students = []
+            for student in missing_students:
+                parent_contact = student.parent.phone if student.parent and student.parent.phone else "Not provided"
+                context_students.append({
+                    'username': student.username,
+                    'parent_contact': parent_contact
+                })
+
+            context = {
+                'bus_number': bus.bus_number,
+                'trip_type': trip_type,
+                'missing_students': context_students
+            }
+
+            # Render HTML template
+            html_message = render_to_string('accounts/emails/missing_students.html', context)
+            plain_message = strip_tags(html_message)
+
+            recipients = list(dict(parent_emails + teacher_emails).items()) # One entry per address
+
+            if not recipients:
+                self.stdout.write(f"No valid email recipients found for bus {bus.bus_number}. Skipping.")
+                continue
+
+            try:
+                # Queue multi-alternative email (HTML + Plain text fallback); the outbox worker sends it
+                enqueue_email(
+                    subject=subject,
+                    body=plain_message,
+                    to=recipients,
+                    html_body=html_message,
+                    from_email='admin@schoolapp.com',
+                    urgent=True,
+                )
+
+                self.stdout.write(self.style.SUCCESS(f"Queued alert to {len(recipients)} recipients for bus {bus.bus_number}"))
+                emails_sent += 1
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Failed to queue email for bus {bus.bus_number}: {e}"))
+
+        return emails_sent
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from accounts.outbox import POLL_SECONDS, drain_outbox
+import time
+
+class Command(BaseCommand):
+    help = 'Sends queued emails and push notifications from the outbox, retrying failed ones with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help=f'Keep running, checking the outbox every {POLL_SECONDS} seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox()
+            if sent or failed or not options['loop']:
+                self.stdout.write(f"Outbox: sent {sent} messages, {failed} failed attempts.")
+            if not options['loop']:
+                return
+            time.sleep(POLL_SECONDS)
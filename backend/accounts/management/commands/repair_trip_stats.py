@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from accounts.models import Trip
+from accounts.trip_stats import repair_trip_stats
+from datetime import timedelta
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-trip boarding counters from the boarding logs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1, help='Repair trips started in the last N days (default: today only).')
+        parser.add_argument('--all', action='store_true', help='Repair every trip.')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.all()
+        if not options['all']:
+            today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+            trips = trips.filter(start_time__gte=today_start - timedelta(days=options['days'] - 1))
+
+        # Batches keep the prefetch and IN lists bounded on --all
+        checked = repaired = 0
+        trip_ids = list(trips.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(trip_ids), 500):
+            batch = trip_ids[start:start + 500]
+            repaired += repair_trip_stats(Trip.objects.filter(id__in=batch))
+            checked += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} trips. Repaired {repaired} with stale counters."))
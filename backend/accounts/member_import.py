@@ -0,0 +1,315 @@
+"""
+Bulk import of teachers, drivers and students (with their parents) from CSV or JSON, for
+onboarding a whole institution at once. Rows are read lazily and handled IMPORT_CHUNK_SIZE at a
+time:
+- one query each for the usernames and emails already taken;
+- grades and buses resolved from maps loaded once;
+- passwords hashed in a thread pool, outside the transaction;
+- parents, then members, inserted with bulk_create, and credential emails queued in the outbox.
+  They are bulk mail: OTPs and alerts go out ahead of them, and EMAIL_DAILY_QUOTA can spread
+  them over several days. The outbox clears each one once it is sent.
+
+Every row gets a result, so one bad row doesn't hold up the rest; a rejected row writes nothing.
+Rows have the fields RegisterMemberView takes: role (teacher, driver or student), username,
+email, phone, class_in_charge and bus, plus parent_name and parent_email for students.
+class_in_charge is a grade id or "10 - A"; bus is a bus id or bus number. Students listing the
+same parent_email share one parent account.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.utils.crypto import get_random_string
+
+from .dashboard_stats import invalidate_dashboard_stats
+from .live_state import invalidate_parent_buses
+from .models import Bus, Grade, User
+from .outbox import enqueue_emails
+
+IMPORT_CHUNK_SIZE = 500
+
+IMPORT_ROLES = ('teacher', 'driver', 'student')
+
+
+def read_rows(file, format):
+    """Rows of an uploaded or opened file: CSV with a header line, read as it goes, or a JSON list."""
+    if format == 'csv':
+        if isinstance(file.read(0), bytes):
+            file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        return csv.DictReader(file)
+    rows = json.load(file)
+    if not isinstance(rows, list):
+        raise ValueError('JSON import must be a list of members')
+    return rows
+
+
+def hash_passwords(passwords):
+    """make_password for many passwords; the hashing releases the GIL, so threads use every core."""
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        return list(pool.map(make_password, passwords))
+
+
+def is_email(value):
+    try:
+        validate_email(value)
+    except ValidationError:
+        return False
+    return True
+
+
+def lookup_key(value):
+    """How grades ("10 - A") and bus numbers are matched: case and spaces don't matter."""
+    return value.lower().replace(' ', '')
+
+
+def clean(row, key):
+    value = row.get(key)
+    return str(value).strip() if value is not None else ''
+
+
+def member_credentials_email(role, username, password, address):
+    return ('Account Created', f'Your {role} account has been created.\nUsername: {username}\nPassword: {password}', address)
+
+
+def parent_credentials_email(parent_name, parent_password, username, password, address):
+    body = f"""
+    Hello {parent_name},
+
+    Your parent account has been created.
+    Username: {parent_name}
+    Password: {parent_password}
+
+    Your Child's ({username}) Login Details:
+    Username: {username}
+    Password: {password}
+
+    Please login to manage your child's activities.
+    """
+    return ('Parent & Student Account Created', body, address)
+
+
+def child_credentials_email(parent_name, username, password, address):
+    body = f"""
+    Hello {parent_name},
+
+    An account has been created for your child.
+
+    Your Child's ({username}) Login Details:
+    Username: {username}
+    Password: {password}
+    """
+    return ('Student Account Created', body, address)
+
+
+class MemberImport:
+    """One import run by a management user or superuser; call run(rows) once."""
+
+    def __init__(self, manager, chunk_size=IMPORT_CHUNK_SIZE):
+        self.manager = manager
+        self.managed_by = manager if manager.is_management else None
+        self.chunk_size = chunk_size
+
+        grades = list(Grade.objects.all())
+        self.grades = {str(grade.id): grade.id for grade in grades}
+        self.grades.update({lookup_key(f'{grade.name}-{grade.section}'): grade.id for grade in grades})
+        buses = Bus.objects.all() if manager.is_superuser else Bus.objects.filter(management=manager)
+        self.buses = {}
+        for bus_id, bus_number in buses.values_list('id', 'bus_number'):
+            self.buses[str(bus_id)] = bus_id
+            self.buses.setdefault(lookup_key(bus_number), bus_id)
+
+        # Seen earlier in the file: usernames and emails taken, parents created (email -> (id, name))
+        self.usernames = set()
+        self.emails = set()
+        self.parents = {}
+        self.results = []
+        self.emails_queued = 0
+
+    def run(self, rows):
+        """
+        Import every row and return the report. If reading the rows fails partway, the chunks
+        before it stay imported and report() tells what they were.
+        """
+        rows = iter(rows)
+        start = 1
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(start, chunk)
+                start += len(chunk)
+        finally:
+            if any(result['status'] == 'created' for result in self.results):
+                # bulk_create skips the signals that drop cached dashboard figures
+                invalidate_dashboard_stats(self.manager.id if self.managed_by else None)
+        return self.report()
+
+    def report(self):
+        """
+        {"created": n, "failed": n, "emails_queued": n, "errors": [{"row", "username", "errors"}]} for
+        the rows handled so far, numbered from 1 in file order (the CSV header is not a row).
+        """
+        errors = [
+            {'row': result['row'], 'username': result['username'], 'errors': result['errors']}
+            for result in self.results if result['status'] == 'failed'
+        ]
+        return {
+            'created': len(self.results) - len(errors),
+            'failed': len(errors),
+            'emails_queued': self.emails_queued,
+            'errors': errors,
+        }
+
+    def resolve(self, mapping, value, label, errors):
+        if not value:
+            return None
+        if lookup_key(value) not in mapping:
+            errors.append(f'Unknown {label}: {value}')
+            return None
+        return mapping[lookup_key(value)]
+
+    def validate(self, row, taken_usernames, taken_emails, existing_parents):
+        """The member (and parent) to create for a row, or the list of what is wrong with it."""
+        if not isinstance(row, dict):
+            return None, ['Row is not an object']
+        errors = []
+        role = clean(row, 'role').lower()
+        username, email = clean(row, 'username'), clean(row, 'email')
+        if role not in IMPORT_ROLES:
+            errors.append(f"role must be one of {', '.join(IMPORT_ROLES)}")
+        if not username or not email:
+            errors.append('username and email are required')
+        if email and not is_email(email):
+            errors.append(f'Invalid email: {email}')
+        if username in self.usernames or username in taken_usernames:
+            errors.append(f'Username {username} is taken')
+        if email in self.emails or email in taken_emails:
+            errors.append(f'Email {email} is taken')
+
+        member = {'role': role, 'username': username, 'email': email, 'phone': clean(row, 'phone') or None}
+        member['bus_id'] = self.resolve(self.buses, clean(row, 'bus'), 'bus', errors)
+        if role in ('teacher', 'student'):
+            member['class_in_charge_id'] = self.resolve(self.grades, clean(row, 'class_in_charge'), 'class', errors)
+
+        if role == 'student':
+            parent_name, parent_email = clean(row, 'parent_name'), clean(row, 'parent_email')
+            member['parent_email'] = parent_email
+            if not parent_name or not parent_email:
+                errors.append('Parent details required for students')
+            elif parent_email in self.parents or parent_email in existing_parents:
+                pass  # A sibling's parent, from this file or an earlier import
+            elif not is_email(parent_email):
+                errors.append(f'Invalid parent email: {parent_email}')
+            elif parent_email in self.emails or parent_email in taken_emails or parent_email == email:
+                errors.append(f'Parent email {parent_email} belongs to another user')
+            elif parent_name in self.usernames or parent_name in taken_usernames or parent_name == username:
+                errors.append(f'Parent username {parent_name} is taken')
+            else:
+                member['new_parent'] = parent_name
+        return (None, errors) if errors else (member, [])
+
+    def import_chunk(self, start, chunk):
+        usernames, emails = set(), set()
+        for row in chunk:
+            if isinstance(row, dict):
+                usernames.update({clean(row, 'username'), clean(row, 'parent_name')})
+                emails.update({clean(row, 'email'), clean(row, 'parent_email')})
+        taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        taken_emails, existing_parents = set(), {}
+        for user_id, user_email, username, is_parent, managed_by_id in User.objects.filter(email__in=emails).values_list(
+            'id', 'email', 'username', 'is_parent', 'managed_by_id'
+        ):
+            taken_emails.add(user_email)
+            if is_parent and managed_by_id == (self.managed_by.id if self.managed_by else None):
+                existing_parents[user_email] = (user_id, username)
+
+        members, new_parents = [], {}
+        for index, row in enumerate(chunk, start):
+            member, errors = self.validate(row, taken_usernames, taken_emails, existing_parents)
+            result = {'row': index, 'username': clean(row, 'username') if isinstance(row, dict) else None}
+            self.results.append(result)
+            if errors:
+                result.update(status='failed', errors=errors)
+                continue
+            result['status'] = 'created'
+            members.append((result, member))
+            self.usernames.add(member['username'])
+            self.emails.add(member['email'])
+            if 'new_parent' in member:
+                new_parents.setdefault(member['parent_email'], member['new_parent'])
+                self.parents[member['parent_email']] = None  # Created below
+                self.usernames.add(member['new_parent'])
+                self.emails.add(member['parent_email'])
+        if not members:
+            return
+
+        member_passwords = [get_random_string(length=10) for _ in members]
+        parent_passwords = {parent_email: get_random_string(length=10) for parent_email in new_parents}
+        hashes = hash_passwords(member_passwords + list(parent_passwords.values()))
+        parent_hashes = dict(zip(parent_passwords, hashes[len(members):]))
+
+        try:
+            with transaction.atomic():
+                parents = User.objects.bulk_create([
+                    User(username=parent_name, email=parent_email, password=parent_hashes[parent_email], is_parent=True, managed_by=self.managed_by)
+                    for parent_email, parent_name in new_parents.items()
+                ], batch_size=self.chunk_size)
+                for parent in parents:
+                    self.parents[parent.email] = (parent.id, parent.username)
+
+                users, emails_out = [], []
+                for (result, member), password, password_hash in zip(members, member_passwords, hashes):
+                    parent_id = None
+                    emails_out.append(member_credentials_email(member['role'], member['username'], password, member['email']))
+                    if member['role'] == 'student':
+                        parent_email = member['parent_email']
+                        parent_id, parent_name = self.parents.get(parent_email) or existing_parents[parent_email]
+                        if parent_email in parent_passwords:
+                            # The parent's first child in this import carries the parent's own credentials
+                            emails_out.append(parent_credentials_email(
+                                parent_name, parent_passwords.pop(parent_email), member['username'], password, parent_email
+                            ))
+                        else:
+                            emails_out.append(child_credentials_email(parent_name, member['username'], password, parent_email))
+                    users.append(User(
+                        username=member['username'],
+                        email=member['email'],
+                        password=password_hash,
+                        phone=member['phone'],
+                        is_teacher=member['role'] == 'teacher',
+                        is_driver=member['role'] == 'driver',
+                        is_student=member['role'] == 'student',
+                        bus_id=member['bus_id'],
+                        class_in_charge_id=member.get('class_in_charge_id'),
+                        parent_id=parent_id,
+                        managed_by=self.managed_by,
+                    ))
+                User.objects.bulk_create(users, batch_size=self.chunk_size)
+                enqueue_emails(emails_out)
+        except IntegrityError:
+            # Someone registered one of these usernames or emails meanwhile; nothing of the chunk was kept
+            for result, member in members:
+                result.update(status='failed', errors=['Conflicted with a concurrent registration; import this row again'])
+                self.usernames.discard(member['username'])
+                self.emails.discard(member['email'])
+            for parent_email, parent_name in new_parents.items():
+                self.parents.pop(parent_email, None)
+                self.usernames.discard(parent_name)
+                self.emails.discard(parent_email)
+        else:
+            self.emails_queued += len(emails_out)
+            # bulk_create skips the signal that drops the cached buses of parents who already had children
+            invalidate_parent_buses(*{user.parent_id for user in users})
+
+
+def import_members(manager, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import member rows for a management user (or superuser). See the module docstring."""
+    return MemberImport(manager, chunk_size).run(rows)
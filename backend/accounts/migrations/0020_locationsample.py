@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0019_alter_user_email_alter_user_username"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LocationSample",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ts", models.DateTimeField()),
+                ("latitude", models.FloatField()),
+                ("longitude", models.FloatField()),
+                ("speed", models.FloatField(blank=True, null=True)),
+                ("heading", models.FloatField(blank=True, null=True)),
+                ("accuracy", models.FloatField(blank=True, null=True)),
+                (
+                    "trip",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="location_samples",
+                        to="accounts.trip",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["trip", "ts"], name="accounts_lo_trip_id_21e8a4_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0020_locationsample"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="locationsample",
+            name="accounts_lo_trip_id_21e8a4_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="locationsample",
+            constraint=models.UniqueConstraint(
+                fields=("trip", "ts"), name="unique_location_sample_per_trip_ts"
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:47
+
+from django.db import migrations, models
+
+
+def end_duplicate_active_trips(apps, schema_editor):
+    # Keep only the latest active trip per bus so the one-active-trip constraint can be added
+    Trip = apps.get_model("accounts", "Trip")
+    latest_active = (
+        Trip.objects.filter(bus=models.OuterRef("bus"), is_active=True).order_by("-start_time", "-id").values("id")[:1]
+    )
+    Trip.objects.filter(is_active=True).exclude(id=models.Subquery(latest_active)).update(
+        is_active=False, end_time=models.F("start_time")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0025_outboundmessage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="boardinglog",
+            index=models.Index(fields=["bus", "trip"], name="boardinglog_bus_trip_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="boardinglog",
+            index=models.Index(fields=["bus", "date"], name="boardinglog_bus_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="boardinglog",
+            index=models.Index(
+                fields=["student", "date"], name="boardinglog_student_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                fields=["is_active", "start_time"], name="trip_active_start_idx"
+            ),
+        ),
+        migrations.RunPython(end_duplicate_active_trips, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="trip",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_active", True)),
+                fields=("bus",),
+                name="one_active_trip_per_bus",
+            ),
+        ),
+    ]
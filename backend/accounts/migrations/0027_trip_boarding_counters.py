@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0026_boarding_trip_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="boarded_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="expected_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="TripGradeCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("boarded_count", models.PositiveIntegerField(default=0)),
+                ("expected_count", models.PositiveIntegerField(default=0)),
+                (
+                    "grade",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trip_counts",
+                        to="accounts.grade",
+                    ),
+                ),
+                (
+                    "trip",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="grade_counts",
+                        to="accounts.trip",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("trip", "grade"), name="unique_trip_grade_count"
+                    )
+                ],
+            },
+        ),
+    ]
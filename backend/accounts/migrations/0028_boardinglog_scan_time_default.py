@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0027_trip_boarding_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="boardinglog",
+            name="date",
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterField(
+            model_name="boardinglog",
+            name="scan_time",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:13
+
+import accounts.models
+from django.db import migrations, models
+
+
+def give_each_bus_its_own_secret(apps, schema_editor):
+    # AddField evaluates the default once, so existing buses would all share one secret
+    Bus = apps.get_model("accounts", "Bus")
+    for bus in Bus.objects.only("id"):
+        Bus.objects.filter(id=bus.id).update(qr_secret=accounts.models.generate_qr_secret())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0028_boardinglog_scan_time_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bus",
+            name="qr_secret",
+            field=models.CharField(
+                default=accounts.models.generate_qr_secret, max_length=32
+            ),
+        ),
+        migrations.RunPython(give_each_bus_its_own_secret, migrations.RunPython.noop),
+    ]
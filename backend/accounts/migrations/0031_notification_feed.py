@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:30
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_unread_notifications(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Notification = apps.get_model("accounts", "Notification")
+    unread = (
+        Notification.objects.filter(user=models.OuterRef("pk"), is_read=False)
+        .values("user").annotate(unread=models.Count("id")).values("unread")
+    )
+    User.objects.update(unread_notifications=Coalesce(models.Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0030_dailyattendance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="unread_notifications",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["user", "created_at"], name="notification_user_created_idx"
+            ),
+        ),
+        migrations.RunPython(count_unread_notifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def clear_finished_payloads(apps, schema_editor):
+    # Messages already sent or given up on still hold initial passwords and OTPs
+    OutboundMessage = apps.get_model("accounts", "OutboundMessage")
+    OutboundMessage.objects.filter(status="sent").update(payload={})
+    for message in OutboundMessage.objects.filter(status="failed"):
+        message.payload = {key: message.payload[key] for key in ("to", "subject") if key in message.payload}
+        message.save(update_fields=["payload"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0031_notification_feed"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_finished_payloads, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,12 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+import base64
+import secrets
+
+def generate_qr_secret():
+    """A random 160-bit secret, base32 encoded as authenticator apps expect."""
+    return base64.b32encode(secrets.token_bytes(20)).decode()
 
 class Bus(models.Model):
     bus_number = models.CharField(max_length=20)
@@ -19,6 +26,9 @@ class Bus(models.Model):
     morning_trip_end_time = models.TimeField(default='12:00:00') # Trips before this are "Morning"
     evening_trip_start_time = models.TimeField(default='12:00:00') # Trips after this are "Evening"
 
+    # Shared with the driver's app, which derives the rotating boarding QR code from it
+    qr_secret = models.CharField(max_length=32, default=generate_qr_secret)
+
     def __str__(self):
         return f"{self.bus_number}"
 
@@ -48,6 +58,9 @@ class User(AbstractUser):
     
     # Push Notification Token
     push_token = models.CharField(max_length=255, blank=True, null=True)
+
+    # Unread Notification rows, kept up to date by accounts.notifications
+    unread_notifications = models.PositiveIntegerField(default=0)
     
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='children')
     managed_by = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='managed_members')
@@ -83,6 +96,12 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # A user's latest notifications (dashboards, feed)
+            models.Index(fields=['user', 'created_at'], name='notification_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
@@ -93,6 +112,19 @@ class Trip(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     trip_type = models.CharField(max_length=20, choices=[('morning', 'Morning'), ('evening', 'Evening')], default='morning')
+    # Maintained by accounts/trip_stats.py so dashboards don't count logs
+    boarded_count = models.PositiveIntegerField(default=0)
+    expected_count = models.PositiveIntegerField(default=0) # students on the bus when the trip started
+
+    class Meta:
+        constraints = [
+            # A bus runs one trip at a time; also serves the (bus, is_active=True) lookups
+            models.UniqueConstraint(fields=['bus'], condition=models.Q(is_active=True), name='one_active_trip_per_bus'),
+        ]
+        indexes = [
+            # Today's active/completed trips (start_time range + is_active)
+            models.Index(fields=['is_active', 'start_time'], name='trip_active_start_idx'),
+        ]
     
     def __str__(self):
         return f"Trip {self.id} - {self.bus.bus_number} ({self.trip_type})"
@@ -101,17 +133,141 @@ class BoardingLog(models.Model):
     student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='boarding_logs')
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='boarding_logs')
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='boarding_logs', null=True, blank=True)
-    scan_time = models.DateTimeField(auto_now_add=True)
-    date = models.DateField(auto_now_add=True)
+    # When the QR code was scanned; earlier than the insert for scans synced after being offline
+    scan_time = models.DateTimeField(default=timezone.now)
+    date = models.DateField(default=timezone.localdate)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
 
     class Meta:
         unique_together = ('student', 'trip') # Student can board only once per trip
+        indexes = [
+            models.Index(fields=['bus', 'trip'], name='boardinglog_bus_trip_idx'),
+            models.Index(fields=['bus', 'date'], name='boardinglog_bus_date_idx'),
+            # Has this student boarded today (and which trip type)
+            models.Index(fields=['student', 'date'], name='boardinglog_student_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.username} boarded {self.bus.bus_number} at {self.scan_time}"
 
+class TripGradeCount(models.Model):
+    # Boarding counters of one grade (class) on one trip, maintained like Trip.boarded_count
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='grade_counts')
+    grade = models.ForeignKey(Grade, on_delete=models.CASCADE, related_name='trip_counts')
+    boarded_count = models.PositiveIntegerField(default=0)
+    expected_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'grade'], name='unique_trip_grade_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.grade} on trip {self.trip_id}: {self.boarded_count}/{self.expected_count}"
+
+class LocationSample(models.Model):
+    # Append-only GPS breadcrumbs for a trip. Bus.latitude/longitude only keeps the latest fix.
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='location_samples')
+    ts = models.DateTimeField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    speed = models.FloatField(null=True, blank=True) # m/s as reported by the device
+    heading = models.FloatField(null=True, blank=True) # degrees from north
+    accuracy = models.FloatField(null=True, blank=True) # metres
+
+    class Meta:
+        constraints = [
+            # One fix per trip per timestamp, so replayed batches can be inserted idempotently
+            models.UniqueConstraint(fields=['trip', 'ts'], name='unique_location_sample_per_trip_ts'),
+        ]
+
+    def __str__(self):
+        return f"Trip {self.trip_id} @ {self.ts}: {self.latitude}, {self.longitude}"
+
+class DailyAttendance(models.Model):
+    # A teacher's mark for a student's trip on a day. Absent and on-leave students are not
+    # expected on the bus, so the missing-student alert leaves them out.
+    STATUS_CHOICES = [('present', 'Present'), ('absent', 'Absent'), ('leave', 'Leave'), ('late', 'Late')]
+    EXCUSED_STATUSES = ('absent', 'leave')
+
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance')
+    date = models.DateField()
+    trip_type = models.CharField(max_length=20, choices=[('morning', 'Morning'), ('evening', 'Evening')])
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    marked_by = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Also the (student, date, trip_type) index the alert's anti-join and the upsert use
+            models.UniqueConstraint(fields=['student', 'date', 'trip_type'], name='unique_daily_attendance'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.username} {self.status} on {self.date} ({self.trip_type})"
+
+class MissingStudentAlert(models.Model):
+    # One row per organisation, day and trip once its missing-student alert has gone out,
+    # so a late, repeated or concurrent run of the job never emails twice
+    management = models.ForeignKey(User, on_delete=models.CASCADE, related_name='missing_student_alerts')
+    date = models.DateField()
+    trip_type = models.CharField(max_length=20, choices=[('morning', 'Morning'), ('evening', 'Evening')])
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['management', 'date', 'trip_type'], name='unique_missing_student_alert'),
+        ]
+
+    def __str__(self):
+        return f"{self.management.username} {self.trip_type} alert on {self.date}"
+
+class SchedulerLease(models.Model):
+    # Leader lease: every worker starts the background scheduler, only the current holder runs its jobs
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+
+class PushTicket(models.Model):
+    # Expo ticket of a push that was accepted, kept until its receipt says whether it was delivered
+    ticket_id = models.CharField(max_length=100, unique=True)
+    token = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.ticket_id} -> {self.token}"
+
+class OutboundMessage(models.Model):
+    # Durable outbox: requests queue emails and pushes here and the outbox worker sends them, with retries
+    channel = models.CharField(max_length=10, choices=[('email', 'Email'), ('push', 'Push')])
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=[
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed')
+    ], default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default='') # worker batch currently sending it
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Time-critical (OTPs, alerts): sent before other due messages and never held by EMAIL_DAILY_QUOTA
+    urgent = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # The worker's poll: pending messages that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} #{self.id} ({self.status})"
+
 class Complaint(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='complaints')
     title = models.CharField(max_length=255)
@@ -0,0 +1,93 @@
+"""
+In-app notifications (Notification rows) and each user's unread counter (User.unread_notifications).
+Rows are created and marked read through these functions, which adjust the counter with an F()
+update in the same transaction, so badges read a column instead of counting rows. Clients page
+through the feed by id, and poll it with since_id to download only what is new.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Notification, User
+
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Rows per INSERT when fanning a notification out to many users
+FAN_OUT_BATCH_SIZE = 500
+
+
+def notification_data(notification):
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'type': notification.type,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at,
+    }
+
+
+def create_notification(user, title, message, type='info'):
+    """Add a notification to a user's feed and count it as unread."""
+    with transaction.atomic():
+        notification = Notification.objects.create(user=user, title=title, message=message, type=type)
+        User.objects.filter(id=user.id).update(unread_notifications=F('unread_notifications') + 1)
+    return notification
+
+
+def create_notifications(user_ids, title, message, type='info'):
+    """
+    Add the same notification to the feed of every user in `user_ids`, e.g. a broadcast to a
+    bus's students and parents: batched inserts and one counter update, in one transaction.
+    Returns the number of notifications created.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return 0
+    with transaction.atomic():
+        Notification.objects.bulk_create(
+            [Notification(user_id=user_id, title=title, message=message, type=type) for user_id in user_ids],
+            batch_size=FAN_OUT_BATCH_SIZE,
+        )
+        User.objects.filter(id__in=user_ids).update(unread_notifications=F('unread_notifications') + 1)
+    return len(user_ids)
+
+
+def mark_read(user, ids=None):
+    """
+    Mark the user's notifications with the given ids (default: all of them) as read.
+    Returns the number that were unread. Only rows this call flipped are subtracted from the
+    counter, so overlapping calls don't count a notification twice.
+    """
+    notifications = Notification.objects.filter(user=user, is_read=False)
+    if ids is not None:
+        notifications = notifications.filter(id__in=ids)
+    with transaction.atomic():
+        marked = notifications.update(is_read=True)
+        if marked:
+            User.objects.filter(id=user.id).update(unread_notifications=Greatest(F('unread_notifications') - marked, 0))
+    return marked
+
+
+def notification_feed(user, before=None, since_id=None, limit=FEED_PAGE_SIZE):
+    """
+    One page of a user's notifications and the cursor of the next page (None on the last).
+    By default newest first, older than `before`; with `since_id`, oldest first, newer than it,
+    so a client that polls with the highest id it has only downloads new notifications.
+    """
+    notifications = Notification.objects.filter(user=user)
+    if since_id is not None:
+        notifications = notifications.filter(id__gt=since_id).order_by('id')
+    else:
+        if before is not None:
+            notifications = notifications.filter(id__lt=before)
+        notifications = notifications.order_by('-id')
+
+    # One row more than the page tells whether there is a next page
+    page = list(notifications[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1].id
+    return [notification_data(notification) for notification in page], next_cursor
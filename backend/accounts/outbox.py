@@ -0,0 +1,220 @@
+"""
+Outbound notification queue. Views enqueue emails and pushes as OutboundMessage rows and
+return; the outbox worker (a thread in each server process, or the process_outbox command)
+sends them, retrying failures with exponential backoff. Payloads hold initial passwords and
+OTPs, so they are cleared once a message is sent or given up on.
+"""
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .mailer import BulkMailer, build_message
+from .models import OutboundMessage
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 30 # 30 s, 1 min, 2 min, 4 min, 8 min between attempts
+RETRY_MAX_SECONDS = 3600
+# A claimed message whose worker died is picked up again after this long
+CLAIM_TIMEOUT = timedelta(minutes=5)
+# The worker wakes as soon as a message is queued; this poll only picks up retries and other workers' leftovers
+POLL_SECONDS = 10
+
+_wake = threading.Event()
+
+
+def enqueue(channel, payload, urgent=False):
+    message = OutboundMessage.objects.create(channel=channel, payload=payload, urgent=urgent)
+    transaction.on_commit(_wake.set)
+    return message
+
+
+def enqueue_email(subject, body, to, html_body=None, from_email=None, urgent=False):
+    """
+    Queue one email per recipient, so no recipient sees the others' addresses and each is retried
+    on its own. `to` holds addresses or (address, name) pairs; '{name}' in the subject and bodies
+    is replaced with the recipient's name. Mark OTPs and alerts `urgent`: they are sent first and
+    never held back by the daily quota.
+    """
+    recipients = {}
+    for recipient in to:
+        address, name = recipient if isinstance(recipient, (tuple, list)) else (recipient, None)
+        if address and address not in recipients:
+            recipients[address] = name
+
+    messages = OutboundMessage.objects.bulk_create([
+        OutboundMessage(channel='email', payload={
+            'subject': subject,
+            'body': body,
+            'html_body': html_body,
+            'from_email': from_email,
+            'to': [address],
+            'name': name,
+        }, urgent=urgent)
+        for address, name in recipients.items()
+    ])
+    transaction.on_commit(_wake.set)
+    return messages
+
+
+def enqueue_emails(emails):
+    """
+    Queue many different emails in one insert, e.g. each new member's own credentials.
+    `emails` holds (subject, body, address) triples.
+    """
+    messages = OutboundMessage.objects.bulk_create([
+        OutboundMessage(channel='email', payload={
+            'subject': subject,
+            'body': body,
+            'html_body': None,
+            'from_email': None,
+            'to': [address],
+            'name': None,
+        })
+        for subject, body, address in emails
+    ])
+    transaction.on_commit(_wake.set)
+    return messages
+
+
+def enqueue_push(tokens, title, message, data=None, urgent=False):
+    return enqueue('push', {
+        'tokens': list(tokens),
+        'title': title,
+        'message': message,
+        'data': data,
+    }, urgent=urgent)
+
+
+def claim_due_messages(limit=BATCH_SIZE):
+    """
+    Claim up to `limit` due messages for this caller, so no other worker sends them meanwhile.
+    Urgent ones come first, so an OTP doesn't wait behind a backlog of bulk mail.
+    """
+    now = timezone.now()
+    due_ids = list(
+        OutboundMessage.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('-urgent', 'next_attempt_at')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not due_ids:
+        return []
+
+    # Conditional UPDATE: a message another worker claimed in the meantime is no longer due
+    claim = uuid.uuid4().hex
+    OutboundMessage.objects.filter(id__in=due_ids, status='pending', next_attempt_at__lte=now).update(
+        claimed_by=claim, next_attempt_at=now + CLAIM_TIMEOUT
+    )
+    return list(OutboundMessage.objects.filter(claimed_by=claim).order_by('-urgent', 'id'))
+
+
+def deliver(message, mailer):
+    """Send one message. Raises if it was not delivered."""
+    payload = message.payload
+    if message.channel == 'email':
+        mailer.send(build_message(
+            subject=payload['subject'],
+            body=payload['body'],
+            to=payload['to'],
+            name=payload.get('name'),
+            html_body=payload.get('html_body'),
+            from_email=payload.get('from_email'),
+        ))
+    elif message.channel == 'push':
+        from .utils import send_push_notification
+        if not send_push_notification(payload['tokens'], payload['title'], payload['message'], payload.get('data')):
+            raise RuntimeError("Expo accepted none of the push messages")
+    else:
+        raise ValueError(f"Unknown channel {message.channel}")
+
+
+def email_quota_left():
+    """How many more emails may be sent today under EMAIL_DAILY_QUOTA, or None if there is no quota."""
+    if not settings.EMAIL_DAILY_QUOTA:
+        return None
+    today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    sent_today = OutboundMessage.objects.filter(channel='email', status='sent', sent_at__gte=today_start).count()
+    return max(settings.EMAIL_DAILY_QUOTA - sent_today, 0)
+
+
+def defer_to_tomorrow(messages):
+    tomorrow = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    OutboundMessage.objects.filter(id__in=[m.id for m in messages]).update(claimed_by='', next_attempt_at=tomorrow)
+
+
+def redacted(payload):
+    """What is kept of a message given up on: who it was for, not what it said."""
+    return {key: payload[key] for key in ('to', 'subject') if key in payload}
+
+
+def record_failure(message, error):
+    message.attempts += 1
+    message.last_error = str(error)
+    message.claimed_by = ''
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'failed'
+        message.payload = redacted(message.payload)
+    else:
+        delay = min(RETRY_BASE_SECONDS * 2 ** (message.attempts - 1), RETRY_MAX_SECONDS)
+        message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    message.save(update_fields=['attempts', 'last_error', 'claimed_by', 'status', 'next_attempt_at', 'payload'])
+
+
+def drain_outbox(limit=BATCH_SIZE):
+    """Send every message that is due. Returns (sent, failed attempts)."""
+    sent = failed = 0
+    # Emails of every batch go out over the same connection
+    with BulkMailer() as mailer:
+        while True:
+            batch = claim_due_messages(limit)
+            if not batch:
+                return sent, failed
+
+            emails = [m for m in batch if m.channel == 'email']
+            quota_left = email_quota_left() if emails else None
+            if quota_left is not None:
+                # Over the provider's daily limit: hold bulk mail until tomorrow without counting an
+                # attempt. Urgent emails still go out, and use up the quota first.
+                bulk = [m for m in emails if not m.urgent]
+                allowed = max(quota_left - (len(emails) - len(bulk)), 0)
+                held = bulk[allowed:]
+                if held:
+                    defer_to_tomorrow(held)
+                    batch = [m for m in batch if m not in held]
+
+            delivered = []
+            for message in batch:
+                try:
+                    deliver(message, mailer)
+                except Exception as e:
+                    print(f"Outbox: {message.channel} #{message.id} failed (attempt {message.attempts + 1}): {e}")
+                    record_failure(message, e)
+                    failed += 1
+                    continue
+                delivered.append(message.id)
+
+            # One UPDATE for the whole batch rather than one per message; the content isn't kept
+            OutboundMessage.objects.filter(id__in=delivered).update(
+                status='sent', sent_at=timezone.now(), attempts=F('attempts') + 1, claimed_by='', payload={}
+            )
+            sent += len(delivered)
+
+
+def run_outbox_worker():
+    while True:
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+        close_old_connections()
+        try:
+            drain_outbox()
+        except Exception as e:
+            print(f"Error draining outbox: {e}")
+
+
+def start_outbox_worker():
+    threading.Thread(target=run_outbox_worker, name="outbox-worker", daemon=True).start()
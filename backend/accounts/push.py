@@ -0,0 +1,144 @@
+"""
+Expo push client. One pooled HTTP session per process; messages go out in chunks of
+100 (Expo's per-request limit) on a few threads, gzipped. Tokens Expo reports as no
+longer registered, on the ticket or later on the receipt, are cleared from their users.
+"""
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import PushTicket, User
+
+# Expo accepts at most 100 messages per send request and 1,000 ids per receipts request
+SEND_CHUNK_SIZE = 100
+RECEIPTS_CHUNK_SIZE = 1000
+MAX_CONCURRENT_REQUESTS = 4
+REQUEST_TIMEOUT = (5, 15) # connect, read (seconds)
+
+# Receipts are ready about 15 minutes after sending and Expo keeps them for a day
+RECEIPT_DELAY = timedelta(minutes=15)
+RECEIPT_EXPIRY = timedelta(days=1)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                "accept": "application/json",
+                "accept-encoding": "gzip, deflate",
+                "content-type": "application/json",
+                "content-encoding": "gzip",
+            })
+            if settings.EXPO_ACCESS_TOKEN:
+                session.headers["authorization"] = f"Bearer {settings.EXPO_ACCESS_TOKEN}"
+            _session = session
+    return _session
+
+
+def post_json(url, payload):
+    body = gzip.compress(json.dumps(payload).encode())
+    response = get_session().post(url, data=body, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def is_device_not_registered(ticket_or_receipt):
+    return (ticket_or_receipt.get('details') or {}).get('error') == 'DeviceNotRegistered'
+
+
+def send_chunk(messages):
+    """Send up to SEND_CHUNK_SIZE messages. Returns one ticket per message; a failed request gives error tickets."""
+    try:
+        tickets = post_json(settings.EXPO_PUSH_URL, messages).get('data', [])
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error sending push notification: {e}")
+        return [{'status': 'error', 'message': str(e)} for _ in messages]
+    # A single message may be answered with a bare ticket object
+    if isinstance(tickets, dict):
+        tickets = [tickets]
+    return tickets
+
+
+def send_push_messages(messages):
+    """
+    Send Expo push messages (dicts with 'to', 'title', 'body', ...). Returns one ticket per message.
+    Accepted tickets are stored for check_push_receipts.
+    """
+    if not messages:
+        return []
+
+    chunks = chunked(messages, SEND_CHUNK_SIZE)
+    if len(chunks) == 1:
+        results = [send_chunk(chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(chunks))) as executor:
+            results = list(executor.map(send_chunk, chunks))
+    tickets = [ticket for result in results for ticket in result]
+
+    accepted = []
+    dead_tokens = set()
+    for message, ticket in zip(messages, tickets):
+        if ticket.get('status') == 'ok':
+            accepted.append(PushTicket(ticket_id=ticket['id'], token=message['to']))
+        elif is_device_not_registered(ticket):
+            dead_tokens.add(message['to'])
+        else:
+            print(f"Push to {message['to']} failed: {ticket.get('message')}")
+
+    PushTicket.objects.bulk_create(accepted, ignore_conflicts=True)
+    prune_push_tokens(dead_tokens)
+    return tickets
+
+
+def prune_push_tokens(tokens):
+    """Clear these push tokens from their users. Returns the number of distinct tokens."""
+    tokens = {token for token in tokens if token}
+    if tokens:
+        User.objects.filter(push_token__in=tokens).update(push_token=None)
+    return len(tokens)
+
+
+def check_push_receipts():
+    """
+    Fetch receipts for stored tickets old enough to have one and clear the tokens of devices that
+    are no longer registered. Returns (receipts checked, tokens pruned).
+    """
+    now = timezone.now()
+    PushTicket.objects.filter(created_at__lt=now - RECEIPT_EXPIRY).delete()
+    tickets = dict(PushTicket.objects.filter(created_at__lte=now - RECEIPT_DELAY).values_list('ticket_id', 'token'))
+
+    checked = []
+    dead_tokens = set()
+    for ids in chunked(list(tickets), RECEIPTS_CHUNK_SIZE):
+        try:
+            receipts = post_json(settings.EXPO_RECEIPTS_URL, {'ids': ids}).get('data', {})
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching push receipts: {e}")
+            continue
+        # Receipts that are not ready yet are simply missing; their tickets are checked again next time
+        for ticket_id, receipt in receipts.items():
+            checked.append(ticket_id)
+            if is_device_not_registered(receipt):
+                dead_tokens.add(tickets.get(ticket_id))
+
+    PushTicket.objects.filter(ticket_id__in=checked).delete()
+    return len(checked), prune_push_tokens(dead_tokens)
@@ -1,29 +1,141 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from django_apscheduler.jobstores import DjangoJobStore, register_events
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from django_apscheduler.jobstores import DjangoJobStore
+from django_apscheduler import util
 from django.core.management import call_command
+from django.db import close_old_connections
+from django.utils import timezone
+from datetime import timedelta
+from .alert_schedule import alert_times_between, load_schedule_index, next_alert_time
+from .lease import acquire_lease, holder_id, holds_lease, release_lease
+import atexit
 import sys
+import threading
 
+NOTIFY_JOB_ID = "notify_unboarded_students_job"
+PUSH_RECEIPTS_JOB_ID = "check_push_receipts_job"
+PUSH_RECEIPTS_INTERVAL_MINUTES = 15
+
+# A fire that starts late (restart, busy worker) still runs if it is at most this late.
+# The alert itself is recorded per organisation and trip, so catching up never emails twice.
+MISFIRE_GRACE_SECONDS = 300
+
+# Every worker competes for this lease; only the holder runs the scheduler.
+# The holder renews it every LEASE_RENEW_SECONDS; if it dies, another worker takes over within LEASE_SECONDS.
+LEASE_NAME = "accounts.scheduler"
+LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = 20
+
+scheduler = None
+schedule_index = {}
+stop_event = threading.Event()
+
+class AlertScheduleTrigger(BaseTrigger):
+    """Fires at every organisation's alert minute, from a snapshot of their alert times."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        # Continue from the last fire rather than the clock, so drift cannot skip or repeat a minute.
+        # A new trigger looks back over the grace period, so an alert missed while down (or just moved) still goes out.
+        after = previous_fire_time or now - timedelta(seconds=MISFIRE_GRACE_SECONDS)
+        return next_alert_time(self.index, after)
+
+    def __str__(self):
+        return f"alert schedule of {len(self.index)} organisations"
+
+@util.close_old_connections
 def notify_job():
+    # The lease may have lapsed (e.g. a long GC pause) and been taken over since this run was scheduled
+    if not holds_lease(LEASE_NAME, holder_id()):
+        print("Skipping notify job: this worker no longer holds the scheduler lease.")
+        return
+
+    # Runs are coalesced, so check every alert minute that came due within the grace period.
+    # A minute that was already handled sends nothing.
+    now = timezone.now()
+    for at in alert_times_between(load_schedule_index(), now - timedelta(seconds=MISFIRE_GRACE_SECONDS), now):
+        try:
+            call_command('notify_unboarded_students', at=at.isoformat())
+        except Exception as e:
+            print(f"Error running scheduled notify job: {e}")
+
+@util.close_old_connections
+def push_receipts_job():
+    # Same check as notify_job: a worker that lost the lease would fetch receipts alongside the new leader
+    if not holds_lease(LEASE_NAME, holder_id()):
+        print("Skipping push receipts job: this worker no longer holds the scheduler lease.")
+        return
+
     try:
-        call_command('notify_unboarded_students')
+        call_command('check_push_receipts')
     except Exception as e:
-        print(f"Error running scheduled notify job: {e}")
+        print(f"Error running scheduled push receipts job: {e}")
 
-def start_scheduler():
-    from apscheduler.triggers.interval import IntervalTrigger
-    scheduler = BackgroundScheduler()
-    # If using DjangoJobStore is preferred for persistence, but for simple interval checking memory is fine:
-    # scheduler.add_jobstore(DjangoJobStore(), "default")
-    
-    # Run the notify unboarded students job every 60 seconds
+def refresh_schedule():
+    """Reload every organisation's alert times and sleep until the earliest one."""
+    global schedule_index
+    schedule_index = load_schedule_index()
+    # One persistent job (not a chain of one-off jobs), so its recorded runs are kept
     scheduler.add_job(
         notify_job,
-        trigger=IntervalTrigger(seconds=60),
-        id="notify_unboarded_students_job",
+        trigger=AlertScheduleTrigger(schedule_index),
+        id=NOTIFY_JOB_ID,
         max_instances=1,
+        coalesce=True,
         replace_existing=True,
+        misfire_grace_time=MISFIRE_GRACE_SECONDS,
     )
-    
-    # register_events(scheduler)
+
+def start_leading():
+    global scheduler
+    # Jobs live in the database (DjangoJobStore), which also records every run with its duration
+    scheduler = BackgroundScheduler()
+    scheduler.add_jobstore(DjangoJobStore(), "default")
     scheduler.start()
-    print("Background Scheduler Started. Checking for missing students every 60 seconds.", file=sys.stdout)
+    refresh_schedule()
+    scheduler.add_job(
+        push_receipts_job,
+        trigger=IntervalTrigger(minutes=PUSH_RECEIPTS_INTERVAL_MINUTES),
+        id=PUSH_RECEIPTS_JOB_ID,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
+    print(f"Background Scheduler Started on {holder_id()}. Next missing-students check is at the earliest organisation alert time.", file=sys.stdout)
+
+def stop_leading():
+    global scheduler
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+        scheduler = None
+        print(f"Background Scheduler Stopped on {holder_id()}.", file=sys.stdout)
+
+def run_lease_loop():
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            is_leader = acquire_lease(LEASE_NAME, holder_id(), LEASE_SECONDS)
+            if is_leader and scheduler is None:
+                start_leading()
+            elif not is_leader:
+                stop_leading()
+            elif load_schedule_index() != schedule_index:
+                # An organisation's alert times changed (on any worker); wake at the new earliest one
+                refresh_schedule()
+        except Exception as e:
+            print(f"Error renewing scheduler lease: {e}")
+        stop_event.wait(LEASE_RENEW_SECONDS)
+
+def stop_scheduler():
+    stop_event.set()
+    if scheduler is not None:
+        stop_leading()
+        release_lease(LEASE_NAME, holder_id())
+
+def start_scheduler():
+    # Every worker calls this; the lease thread decides which one actually runs the jobs
+    threading.Thread(target=run_lease_loop, name="scheduler-lease", daemon=True).start()
+    atexit.register(stop_scheduler)
@@ -0,0 +1,176 @@
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.signing import TimestampSigner, b62_encode
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.utils import timezone
+from .models import User, Bus, Trip, BoardingLog
+from .boarding import QR_CODE_STEP, QR_TOKEN_MAX_AGE, bus_qr_token, get_qr_secret, qr_code, record_boarding, used_qr_codes
+from .live_state import live_cache, set_bus_state
+import datetime
+import time
+
+class QRBoardingFastPathTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+        self.student = User.objects.create_user(username='student', password=None, email='student@test.com', is_student=True, bus=self.bus)
+        self.trip = Trip.objects.create(bus=self.bus, driver=self.driver)
+        set_bus_state(self.bus, self.trip.id)
+        get_qr_secret(self.bus.id)
+        used_qr_codes.clear()
+
+        self.client.force_authenticate(user=self.student)
+        self.url = reverse('student_board')
+
+    def scan(self, token=None):
+        return self.client.post(self.url, {'qr_token': token or bus_qr_token(self.bus), 'latitude': 10.0, 'longitude': 20.0})
+
+    def test_scan_is_a_single_insert(self):
+        # Savepoint, insert, trip counter, release: bus, trip and QR secret come from the live cache
+        with self.assertNumQueries(4):
+            response = self.scan()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['bus'], 'BUS-01')
+
+        log = BoardingLog.objects.get()
+        self.assertEqual((log.trip_id, log.bus_id, log.latitude), (self.trip.id, self.bus.id, 10.0))
+
+    def test_duplicate_scan_is_rejected_by_the_constraint(self):
+        self.assertTrue(record_boarding(self.student, self.bus.id, self.trip.id))
+        # As if a concurrent request got in between: no exists() check, the insert itself fails
+        self.assertFalse(record_boarding(self.student, self.bus.id, self.trip.id))
+
+        response = self.scan()
+        self.assertEqual(response.data['status'], 'already_boarded')
+        self.assertEqual(BoardingLog.objects.count(), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.boarded_count, 1)
+
+    def test_rfc6238_code(self):
+        # SHA1 test vector of RFC 6238 (T = 59 s, 8 digits)
+        self.assertEqual(qr_code('GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ', 59 // QR_CODE_STEP), '94287082')
+
+    def test_code_is_accepted_one_step_either_side(self):
+        now = time.time()
+        self.assertEqual(self.scan(bus_qr_token(self.bus, now + QR_CODE_STEP)).status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(user=User.objects.create_user(username='late', password=None, email='late@test.com', is_student=True))
+        self.assertEqual(self.scan(bus_qr_token(self.bus, now - QR_CODE_STEP)).status_code, status.HTTP_201_CREATED)
+
+        self.assertIn('expired', self.scan(bus_qr_token(self.bus, now - 3 * QR_CODE_STEP)).data['error'])
+        other_bus = Bus.objects.create(bus_number="BUS-02", number_plate="KA02")
+        self.assertEqual(self.scan(f'{self.bus.id}:{bus_qr_token(other_bus).split(":")[1]}').data['error'], 'Invalid QR Code.')
+        self.assertEqual(self.scan(f'{self.bus.id}:12345').data['error'], 'Invalid QR Code.')
+        self.assertEqual(BoardingLog.objects.count(), 2)
+
+    def test_rescanning_a_code_skips_the_database(self):
+        token = bus_qr_token(self.bus)
+        self.assertEqual(self.scan(token).status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(0):
+            response = self.scan(token)
+        self.assertEqual(response.data['status'], 'already_boarded')
+
+    def test_legacy_signed_token(self):
+        self.assertEqual(self.scan(TimestampSigner().sign(self.bus.id)).status_code, status.HTTP_201_CREATED)
+
+    def test_expired_and_tampered_tokens(self):
+        signer = TimestampSigner()
+        value = f'{self.bus.id}:{b62_encode(int(time.time()) - QR_TOKEN_MAX_AGE - 5)}'
+        expired = f'{value}:{signer.signature(value)}'
+
+        self.assertIn('expired', self.scan(expired).data['error'])
+        self.assertEqual(self.scan(signer.sign(self.bus.id) + 'junk').data['error'], 'Invalid QR Code.')
+        self.assertEqual(self.scan('not-a-token').data['error'], 'Invalid QR Code.')
+        self.assertFalse(BoardingLog.objects.exists())
+
+    def test_cached_no_trip_is_rechecked(self):
+        # Another process started the trip after this one cached "no active trip"
+        set_bus_state(self.bus, None)
+        self.assertEqual(self.scan().status_code, status.HTTP_201_CREATED)
+
+        # Really no active trip
+        Trip.objects.update(is_active=False)
+        set_bus_state(self.bus, None)
+        self.client.force_authenticate(user=User.objects.create_user(username='late', password=None, email='late@test.com', is_student=True))
+        self.assertEqual(self.scan().status_code, status.HTTP_400_BAD_REQUEST)
+
+def token_signed_at(bus_id, signed_at):
+    """A QR token as the driver's app showed it at `signed_at`."""
+    value = f'{bus_id}:{b62_encode(int(signed_at.timestamp()))}'
+    return f'{value}:{TimestampSigner().signature(value)}'
+
+class BoardingSyncTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+        self.students = [
+            User.objects.create_user(username=f'student{i}', password=None, email=f'student{i}@test.com', is_student=True, bus=self.bus)
+            for i in range(40)
+        ]
+
+        # A trip that ran through a dead zone 10 to 2 minutes ago
+        self.now = timezone.now()
+        self.trip = Trip.objects.create(bus=self.bus, driver=self.driver, is_active=False)
+        Trip.objects.filter(id=self.trip.id).update(
+            start_time=self.now - datetime.timedelta(minutes=10), end_time=self.now - datetime.timedelta(minutes=2)
+        )
+        self.scanned_at = self.now - datetime.timedelta(minutes=5)
+        self.token = token_signed_at(self.bus.id, self.scanned_at)
+        self.url = reverse('student_board_sync')
+
+    def sync(self, user, scans):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(self.url, {'scans': scans}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result['status'] for result in response.data['results']]
+
+    def scan(self, i, **changes):
+        scan = {'id': i, 'qr_token': self.token, 'scanned_at': self.scanned_at.isoformat(), 'latitude': 10.0, 'longitude': 20.0}
+        scan.update(changes)
+        return scan
+
+    def test_student_sync_validates_each_scan_at_capture_time(self):
+        student = self.students[0]
+        late = self.scanned_at + datetime.timedelta(seconds=QR_TOKEN_MAX_AGE + 5)
+        statuses = self.sync(student, [
+            self.scan(1),
+            self.scan(2, scanned_at=late.isoformat()),
+            self.scan(3, qr_token=self.token + 'junk'),
+            self.scan(4, scanned_at=(self.now - datetime.timedelta(minutes=20)).isoformat(),
+                      qr_token=token_signed_at(self.bus.id, self.now - datetime.timedelta(minutes=20))),
+            self.scan(5),
+        ])
+        self.assertEqual(statuses, ['boarded', 'expired', 'invalid', 'rejected', 'already_boarded'])
+
+        # Logged against the trip that was running, at the time of the scan
+        log = BoardingLog.objects.get()
+        self.assertEqual((log.student_id, log.trip_id), (student.id, self.trip.id))
+        self.assertEqual(log.scan_time, self.scanned_at)
+        self.assertEqual(log.date, timezone.localdate(self.scanned_at))
+
+        # Replaying the batch changes nothing
+        self.assertEqual(self.sync(student, [self.scan(1)]), ['already_boarded'])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.boarded_count, 1)
+
+    def test_driver_syncs_a_bus_load_in_constant_queries(self):
+        other_bus = Bus.objects.create(bus_number="BUS-02", number_plate="KA02")
+        outsider = User.objects.create_user(username='outsider', password=None, email='outsider@test.com', is_student=True, bus=other_bus)
+
+        self.client.force_authenticate(user=self.driver)
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.url, {'scans': [self.scan(i, student_id=s.id) for i, s in enumerate(self.students[:5])]}, format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.url, {'scans': [self.scan(i, student_id=s.id) for i, s in enumerate(self.students[5:])]}, format='json')
+        self.assertEqual(len(small), len(large))
+
+        self.assertEqual(self.sync(self.driver, [self.scan(0, student_id=outsider.id)]), ['rejected'])
+        self.assertEqual(BoardingLog.objects.filter(trip=self.trip).count(), 40)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.boarded_count, 40)
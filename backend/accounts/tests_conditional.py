@@ -0,0 +1,121 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User, Bus, Trip, BoardingLog, Notification
+from .live_state import invalidate_bus_state, live_cache
+import datetime
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+
+        self.bus = Bus.objects.create(
+            bus_number="BUS-01",
+            number_plate="KA01AB1234",
+            morning_trip_end_time=datetime.time(12, 0, 0),
+            evening_trip_start_time=datetime.time(12, 0, 0)
+        )
+
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True)
+        self.driver.bus = self.bus
+        self.driver.save()
+
+        self.parent = User.objects.create_user(username='parent', password='password123', email='parent@test.com', is_parent=True)
+        self.student = User.objects.create_user(username='student', password='password123', email='student@test.com', is_student=True)
+        self.student.bus = self.bus
+        self.student.parent = self.parent
+        self.student.save()
+
+    def get(self, user, url, **headers):
+        self.client.force_authenticate(user=user)
+        return self.client.get(url, headers=headers)
+
+    def assertRevalidates(self, user, url):
+        """A repeat poll with the returned ETag is answered with 304. Returns the ETag."""
+        response = self.get(user, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.get(user, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def test_bus_location_etag_changes_with_new_fix(self):
+        url = reverse('bus_location', args=[self.bus.id])
+        etag = self.assertRevalidates(self.parent, url)
+
+        Trip.objects.create(bus=self.bus, driver=self.driver)
+        self.client.force_authenticate(user=self.driver)
+        self.client.post(reverse('update_location'), {'latitude': 10.5, 'longitude': 76.2})
+
+        response = self.get(self.parent, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['latitude'], 10.5)
+
+        # If-Modified-Since with the returned Last-Modified also revalidates
+        response = self.get(self.parent, url, **{'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_bus_location_forbidden_is_never_304(self):
+        other_parent = User.objects.create_user(username='other_parent', password='password123', email='other@test.com', is_parent=True)
+        url = reverse('bus_location', args=[self.bus.id])
+        etag = self.assertRevalidates(self.parent, url)
+
+        response = self.get(other_parent, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_student_dashboard_etag_changes_with_notification(self):
+        url = reverse('student_dashboard')
+        etag = self.assertRevalidates(self.student, url)
+
+        Notification.objects.create(user=self.student, title='Delay', message='Bus is late')
+
+        response = self.get(self.student, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['notifications'][0]['title'], 'Delay')
+
+    def test_parent_dashboard_etag_changes_with_boarding(self):
+        url = reverse('parent_dashboard')
+        etag = self.assertRevalidates(self.parent, url)
+
+        trip = Trip.objects.create(bus=self.bus, driver=self.driver)
+        live_cache().clear()
+        BoardingLog.objects.create(student=self.student, bus=self.bus, trip=trip)
+
+        response = self.get(self.parent, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['children'][0]['boarding']['status'], 'Boarded')
+
+    def test_driver_dashboard_etag_changes_with_boarding(self):
+        url = reverse('driver_dashboard_stats')
+        etag = self.assertRevalidates(self.driver, url)
+
+        BoardingLog.objects.create(student=self.student, bus=self.bus)
+
+        response = self.get(self.driver, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['boarding']['boarded'], 1)
+
+    def test_driver_dashboard_etag_changes_with_names_and_destination(self):
+        # The evening route shows the destination
+        self.bus.evening_trip_start_time = datetime.time(0, 0)
+        self.bus.save()
+        invalidate_bus_state(self.bus.id)
+        url = reverse('driver_dashboard_stats')
+        etag = self.assertRevalidates(self.driver, url)
+
+        User.objects.filter(id=self.student.id).update(first_name='Asha')
+        response = self.get(self.driver, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['students'][0]['name'], 'Asha')
+
+        etag = response['ETag']
+        self.bus.destination = 'Depot'
+        self.bus.save()
+        invalidate_bus_state(self.bus.id)
+        response = self.get(self.driver, url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['route']['end'], 'Depot')
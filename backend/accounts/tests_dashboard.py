@@ -0,0 +1,195 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User, Bus, Trip, BoardingLog, Complaint
+from .live_state import live_cache
+import datetime
+
+def create_bus(number):
+    return Bus.objects.create(
+        bus_number=number,
+        number_plate=f"KA01{number}",
+        morning_trip_end_time=datetime.time(12, 0, 0),
+        evening_trip_start_time=datetime.time(12, 0, 0)
+    )
+
+class DriverDashboardRosterTest(TestCase):
+    SEATS = 60
+
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+
+        self.bus = create_bus("BUS-01")
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+
+        self.students = [
+            User.objects.create_user(
+                username=f'student{i}', password=None, email=f'student{i}@test.com',
+                first_name=f'First{i}' if i % 2 else '', last_name=f'Last{i}' if i % 3 else '',
+                is_student=True, bus=self.bus,
+            )
+            for i in range(self.SEATS)
+        ]
+        self.trip = Trip.objects.create(bus=self.bus, driver=self.driver)
+
+        # A third of the bus has boarded this trip; one student also rode an earlier trip
+        for student in self.students[::3]:
+            BoardingLog.objects.create(student=student, bus=self.bus, trip=self.trip)
+        old_trip = Trip.objects.create(bus=self.bus, driver=self.driver, is_active=False)
+        BoardingLog.objects.create(student=self.students[1], bus=self.bus, trip=old_trip)
+
+        self.client.force_authenticate(user=self.driver)
+        self.url = reverse('driver_dashboard_stats')
+
+    def test_roster_is_built_in_constant_queries(self):
+        # Warm the live bus state once, as a polling driver would
+        self.client.get(self.url)
+
+        # ETag validator (2) + active trip and the roster itself (2), regardless of bus size
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(response.data['boarding'], {'boarded': 20, 'expected': self.SEATS})
+        self.assertEqual(len(response.data['students']), self.SEATS)
+
+    def test_roster_rows(self):
+        response = self.client.get(self.url)
+        rows = {row['id']: row for row in response.data['students']}
+
+        boarded = rows[self.students[0].id]
+        self.assertEqual(boarded['status'], 'Boarded')
+        self.assertNotEqual(boarded['time'], '-')
+        # No first name and no last name: falls back to the username
+        self.assertEqual(boarded['name'], 'student0')
+
+        # Boarded an earlier trip only
+        pending = rows[self.students[1].id]
+        self.assertEqual(pending['status'], 'Pending')
+        self.assertEqual(pending['time'], '-')
+        self.assertEqual(pending['name'], 'First1 Last1')
+
+        self.assertEqual(rows[self.students[3].id]['name'], 'First3')
+
+class ParentDashboardQueriesTest(TestCase):
+    CHILDREN = 4
+
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+
+        self.parent = User.objects.create_user(username='parent', password='password123', email='parent@test.com', is_parent=True)
+        self.buses = [create_bus(f"BUS-0{i}") for i in range(2)]
+        self.drivers = [
+            User.objects.create_user(username=f'driver{i}', password='password123', email=f'driver{i}@test.com',
+                                     first_name=f'Driver{i}', is_driver=True, bus=bus)
+            for i, bus in enumerate(self.buses)
+        ]
+        self.children = [
+            User.objects.create_user(
+                username=f'child{i}', password=None, email=f'child{i}@test.com',
+                is_student=True, parent=self.parent, bus=self.buses[i % 2] if i < self.CHILDREN - 1 else None,
+            )
+            for i in range(self.CHILDREN)
+        ]
+
+        # Only the first bus is out on a trip, and only the first child has boarded it
+        self.trip = Trip.objects.create(bus=self.buses[0], driver=self.drivers[0])
+        BoardingLog.objects.create(student=self.children[0], bus=self.buses[0], trip=self.trip)
+
+        self.client.force_authenticate(user=self.parent)
+        self.url = reverse('parent_dashboard')
+
+    def test_dashboard_is_built_in_constant_queries(self):
+        self.client.get(self.url)
+
+        # ETag validator (3) + children with buses, active trips, boarding logs and notifications (4)
+        with self.assertNumQueries(7):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        children = {child['id']: child for child in response.data['children']}
+        self.assertTrue(response.data['any_boarded'])
+
+        on_trip = children[self.children[0].id]
+        self.assertEqual(on_trip['bus']['driver_name'], 'Driver0')
+        self.assertEqual(on_trip['trip']['status'], 'Ongoing')
+        self.assertEqual(on_trip['boarding']['status'], 'Boarded')
+
+        same_bus = children[self.children[2].id]
+        self.assertEqual(same_bus['trip']['status'], 'Ongoing')
+        self.assertEqual(same_bus['boarding']['status'], 'Not Boarded')
+
+        idle_bus = children[self.children[1].id]
+        self.assertEqual(idle_bus['bus']['driver_name'], 'N/A')
+        self.assertEqual(idle_bus['trip']['status'], 'Scheduled')
+
+        self.assertIsNone(children[self.children[3].id]['bus'])
+
+class ManagementDashboardStatsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+        self.admin = User.objects.create_superuser(username='admin', password='password123', email='admin@test.com')
+        self.managers = [
+            User.objects.create_user(username=f'manager{i}', password='password123', email=f'manager{i}@test.com', is_management=True)
+            for i in range(3)
+        ]
+        User.objects.filter(id=self.managers[2].id).update(is_active=False)
+        self.members = [
+            User.objects.create_user(username=f'member{i}', password=None, email=f'member{i}@test.com', is_student=True, managed_by=self.managers[i % 2])
+            for i in range(5)
+        ]
+        User.objects.filter(id=self.members[0].id).update(is_active=False)
+        Bus.objects.create(bus_number='BUS-01', management=self.managers[0])
+        Complaint.objects.create(user=self.members[0], title='Late', description='Bus was late')
+        Complaint.objects.create(user=self.members[1], title='Rude', description='Driver was rude', status='resolved')
+        live_cache().clear()
+        self.url = reverse('dashboard_stats')
+
+    def get(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_system_stats_in_constant_queries(self):
+        # Users, per-institution breakdown, buses and complaints, however many institutions there are
+        with self.assertNumQueries(4):
+            stats = self.get(self.admin)
+        self.assertEqual(
+            {key: stats[key] for key in ('total_users', 'active_users', 'verified_institutions', 'pending_institutions', 'management_users', 'total_buses', 'open_complaints')},
+            {'total_users': 9, 'active_users': 7, 'verified_institutions': 2, 'pending_institutions': 1, 'management_users': 3, 'total_buses': 1, 'open_complaints': 1},
+        )
+        self.assertEqual([(row['username'], row['active_users']) for row in stats['management_breakdown']], [('manager0', 2), ('manager1', 2)])
+
+        # Served from the cache until something changes
+        with self.assertNumQueries(0):
+            self.get(self.admin)
+        Complaint.objects.get(user=self.members[0]).delete()
+        self.assertEqual(self.get(self.admin)['open_complaints'], 0)
+        User.objects.create_user(username='new', password=None, email='new@test.com', managed_by=self.managers[0])
+        self.assertEqual(self.get(self.admin)['total_users'], 10)
+
+    def test_management_stats_are_scoped_and_invalidated(self):
+        stats = self.get(self.managers[0])
+        self.assertEqual((stats['total_users'], stats['active_users'], stats['total_buses'], stats['open_complaints']), (3, 2, 1, 1))
+        self.assertEqual(self.get(self.managers[1])['open_complaints'], 0)
+
+        complaint = Complaint.objects.get(user=self.members[0])
+        complaint.status = 'resolved'
+        complaint.save()
+        self.assertEqual(self.get(self.managers[0])['open_complaints'], 0)
+
+        # A member or bus moved to another management user updates both
+        self.assertEqual(self.get(self.managers[1])['total_users'], 2)
+        member = self.members[0]
+        member.managed_by = self.managers[1]
+        member.save()
+        bus = Bus.objects.get(management=self.managers[0])
+        bus.management = self.managers[1]
+        bus.save()
+        self.assertEqual((self.get(self.managers[0])['total_users'], self.get(self.managers[0])['total_buses']), (2, 0))
+        self.assertEqual((self.get(self.managers[1])['total_users'], self.get(self.managers[1])['total_buses']), (3, 1))
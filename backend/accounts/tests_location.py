@@ -0,0 +1,136 @@
+from django.test import TestCase
+from datetime import timedelta
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User, Bus, Trip, LocationSample
+
+class UpdateLocationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True)
+        self.driver.bus = self.bus
+        self.driver.save()
+
+        self.client.force_authenticate(user=self.driver)
+        self.url = reverse('update_location')
+
+    def test_requires_active_trip(self):
+        response = self.client.post(self.url, {'latitude': 10.5, 'longitude': 76.2})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LocationSample.objects.count(), 0)
+
+    def test_appends_sample_and_moves_latest_position(self):
+        trip = Trip.objects.create(bus=self.bus, driver=self.driver)
+
+        self.client.post(self.url, {'latitude': 10.5, 'longitude': 76.2, 'speed': 8.3, 'heading': 90})
+        response = self.client.post(self.url, {'latitude': 10.6, 'longitude': 76.3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # History is kept, not overwritten
+        samples = LocationSample.objects.filter(trip=trip).order_by('ts')
+        self.assertEqual(samples.count(), 2)
+        self.assertEqual(samples[0].speed, 8.3)
+        self.assertEqual(samples[0].heading, 90)
+        self.assertIsNone(samples[1].speed)
+
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.latitude, 10.6)
+        self.assertEqual(self.bus.longitude, 76.3)
+        self.assertEqual(self.bus.last_update, samples[1].ts)
+
+    def test_rejects_out_of_range_coordinates(self):
+        Trip.objects.create(bus=self.bus, driver=self.driver)
+
+        response = self.client.post(self.url, {'latitude': 123.0, 'longitude': 76.2})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LocationSample.objects.count(), 0)
+
+    def test_end_trip_clears_latest_position(self):
+        Trip.objects.create(bus=self.bus, driver=self.driver)
+        self.client.post(self.url, {'latitude': 10.5, 'longitude': 76.2})
+
+        response = self.client.post(reverse('end_trip'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.bus.refresh_from_db()
+        self.assertIsNone(self.bus.latitude)
+        self.assertIsNone(self.bus.last_update)
+        # Breadcrumbs survive the end of the trip
+        self.assertEqual(LocationSample.objects.count(), 1)
+
+class UpdateLocationBatchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True)
+        self.driver.bus = self.bus
+        self.driver.save()
+
+        self.trip = Trip.objects.create(bus=self.bus, driver=self.driver)
+        self.start = self.trip.start_time
+
+        self.client.force_authenticate(user=self.driver)
+        self.url = reverse('update_location_batch')
+
+    def fix(self, seconds, latitude=10.5, longitude=76.2):
+        return {
+            'timestamp': (self.start + timedelta(seconds=seconds)).isoformat(),
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+
+    def test_inserts_all_fixes_and_moves_to_newest(self):
+        fixes = [self.fix(5), self.fix(10, 10.6), self.fix(15, 10.7)]
+        response = self.client.post(self.url, {'fixes': fixes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 3)
+
+        self.assertEqual(LocationSample.objects.filter(trip=self.trip).count(), 3)
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.latitude, 10.7)
+        self.assertEqual(self.bus.last_update, self.start + timedelta(seconds=15))
+
+    def test_replayed_batch_is_deduplicated(self):
+        fixes = [self.fix(5), self.fix(10)]
+        self.client.post(self.url, {'fixes': fixes}, format='json')
+
+        response = self.client.post(self.url, {'fixes': fixes + [self.fix(10), self.fix(20)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['duplicates'], 3)
+        self.assertEqual(LocationSample.objects.filter(trip=self.trip).count(), 3)
+
+    def test_older_replay_does_not_rewind_latest_position(self):
+        self.client.post(self.url, {'fixes': [self.fix(60, 11.0)]}, format='json')
+        self.client.post(self.url, {'fixes': [self.fix(30, 10.0)]}, format='json')
+
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.latitude, 11.0)
+        self.assertEqual(LocationSample.objects.filter(trip=self.trip).count(), 2)
+
+    def test_rejects_non_monotonic_batch(self):
+        response = self.client.post(self.url, {'fixes': [self.fix(10), self.fix(5)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LocationSample.objects.count(), 0)
+
+    def test_rejects_future_fix(self):
+        response = self.client.post(self.url, {'fixes': [self.fix(3600)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_accepts_epoch_milliseconds_and_skips_fixes_before_trip(self):
+        before = int((self.start - timedelta(minutes=5)).timestamp() * 1000)
+        after = int((self.start + timedelta(seconds=1)).timestamp() * 1000)
+        fixes = [
+            {'timestamp': before, 'latitude': 10.0, 'longitude': 76.0},
+            {'timestamp': after, 'latitude': 10.1, 'longitude': 76.1},
+        ]
+        response = self.client.post(self.url, {'fixes': fixes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['stale'], 1)
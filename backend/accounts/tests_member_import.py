@@ -0,0 +1,181 @@
+import io
+import json
+from tempfile import TemporaryDirectory
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from .member_import import import_members
+from .outbox import claim_due_messages, drain_outbox, enqueue_email
+from .models import Bus, Grade, OutboundMessage, User
+from .views_management import MAX_IMPORT_ROWS
+
+CSV_HEADER = 'role,username,email,phone,class_in_charge,bus,parent_name,parent_email\n'
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MemberImportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.manager = User.objects.create_user(username='manager', password='password123', email='manager@test.com', is_management=True)
+        self.other_manager = User.objects.create_user(username='other', password='password123', email='other@test.com', is_management=True)
+        self.grade = Grade.objects.create(name='10', section='A')
+        self.bus = Bus.objects.create(bus_number='KL-07 12', management=self.manager)
+        self.other_bus = Bus.objects.create(bus_number='OTHER-1', management=self.other_manager)
+        User.objects.create_user(username='taken', password='password123', email='taken@test.com', managed_by=self.manager)
+        self.url = reverse('import_members')
+
+    def upload(self, text, name='members.csv', user=None):
+        self.client.force_authenticate(user=user or self.manager)
+        file = SimpleUploadedFile(name, text.encode(), content_type='text/csv' if name.endswith('.csv') else 'application/json')
+        return self.client.post(self.url, {'file': file}, format='multipart')
+
+    def test_csv_import_with_per_row_errors(self):
+        response = self.upload(CSV_HEADER + (
+            'teacher,t1,t1@school.test,555,10 - A,,,\n'
+            'driver,d1,d1@school.test,,,kl-07 12,,\n'
+            'student,s1,s1@school.test,,10-A,KL-07 12,p1,p1@school.test\n'
+            'student,s2,s2@school.test,,10-A,KL-07 12,p1,p1@school.test\n'
+            'student,s3,s3@school.test,,,,,\n'
+            'teacher,taken,t2@school.test,,,,,\n'
+            'teacher,t3,t1@school.test,,,,,\n'
+            'driver,d2,d2@school.test,,,OTHER-1,,\n'
+            'teacher,t4,t4@school.test,,11 - B,,,\n'
+            'pilot,x1,x1@school.test,,,,,\n'
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['failed']), (4, 6))
+        self.assertEqual(response.data['emails_queued'], 6)
+        self.assertEqual([error['row'] for error in response.data['errors']], [5, 6, 7, 8, 9, 10])
+        self.assertIn('Parent details required for students', response.data['errors'][0]['errors'])
+        self.assertIn('Username taken is taken', response.data['errors'][1]['errors'])
+        self.assertIn('Email t1@school.test is taken', response.data['errors'][2]['errors'])
+        # Another management user's bus isn't visible to this import
+        self.assertIn('Unknown bus: OTHER-1', response.data['errors'][3]['errors'])
+        self.assertIn('Unknown class: 11 - B', response.data['errors'][4]['errors'])
+
+        teacher = User.objects.get(username='t1')
+        self.assertTrue(teacher.is_teacher)
+        self.assertEqual((teacher.class_in_charge, teacher.phone, teacher.managed_by), (self.grade, '555', self.manager))
+        self.assertTrue(teacher.has_usable_password())
+        self.assertEqual(User.objects.get(username='d1').bus, self.bus)
+
+        # Siblings share one parent account
+        parent = User.objects.get(username='p1')
+        self.assertTrue(parent.is_parent)
+        self.assertEqual(parent.managed_by, self.manager)
+        self.assertEqual(set(parent.children.values_list('username', flat=True)), {'s1', 's2'})
+        self.assertFalse(User.objects.filter(username__in=['s3', 't3', 'd2', 't4', 'x1']).exists())
+
+        # Each member gets their credentials; the parent gets theirs with the first child's, then the second child's
+        subjects = sorted((message.payload['to'][0], message.payload['subject']) for message in OutboundMessage.objects.all())
+        self.assertEqual(subjects, [
+            ('d1@school.test', 'Account Created'),
+            ('p1@school.test', 'Parent & Student Account Created'),
+            ('p1@school.test', 'Student Account Created'),
+            ('s1@school.test', 'Account Created'),
+            ('s2@school.test', 'Account Created'),
+            ('t1@school.test', 'Account Created'),
+        ])
+
+    def test_credentials_are_bulk_mail(self):
+        rows = [{'role': 'teacher', 'username': f't{i}', 'email': f't{i}@school.test'} for i in range(3)]
+        self.assertEqual(import_members(self.manager, rows)['emails_queued'], 3)
+
+        # An OTP queued after a large import doesn't wait behind its credentials
+        [otp] = enqueue_email('Password Reset OTP', 'Your OTP', ['otp@test.com'], urgent=True)
+        self.assertEqual([message.id for message in claim_due_messages(limit=1)], [otp.id])
+
+        # Sent credentials aren't kept in the outbox
+        OutboundMessage.objects.update(claimed_by='', next_attempt_at=timezone.now())
+        self.assertEqual(drain_outbox(), (4, 0))
+        self.assertFalse(OutboundMessage.objects.exclude(payload={}).exists())
+
+    def test_json_body_and_existing_parent(self):
+        self.client.force_authenticate(user=self.manager)
+        members = [{'role': 'student', 'username': 's1', 'email': 's1@school.test', 'parent_name': 'p1', 'parent_email': 'p1@school.test'}]
+        self.assertEqual(self.client.post(self.url, {'members': members}, format='json').data['created'], 1)
+
+        # A later import adds a sibling to the same parent
+        members = [{'role': 'student', 'username': 's2', 'email': 's2@school.test', 'parent_name': 'p1', 'parent_email': 'p1@school.test'}]
+        response = self.upload(json.dumps(members), name='members.json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(User.objects.get(username='s2').parent, User.objects.get(username='p1'))
+        self.assertEqual(User.objects.filter(is_parent=True).count(), 1)
+
+    def test_existing_parent_can_track_imported_childs_bus(self):
+        parent = User.objects.create_user(username='p1', password=None, email='p1@school.test', is_parent=True, managed_by=self.manager)
+        self.client.force_authenticate(user=parent)
+        url = reverse('bus_location', args=[self.bus.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        import_members(self.manager, [{'role': 'student', 'username': 's1', 'email': 's1@school.test', 'bus': 'KL-07 12', 'parent_name': 'p1', 'parent_email': 'p1@school.test'}])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_queries_do_not_grow_with_rows(self):
+        def import_queries(prefix, count):
+            rows = [
+                {'role': 'student', 'username': f'{prefix}{i}', 'email': f'{prefix}{i}@school.test', 'class_in_charge': '10-A',
+                 'bus': 'KL-07 12', 'parent_name': f'{prefix}p{i}', 'parent_email': f'{prefix}p{i}@school.test'}
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(import_members(self.manager, rows)['created'], count)
+            # SQLite's parameter limit splits bulk inserts into more statements; everything else is fixed
+            return len([query for query in queries if not query['sql'].startswith('INSERT')])
+
+        self.assertEqual(import_queries('a', 2), import_queries('b', 40))
+
+    def test_rejects_bad_requests(self):
+        teacher = User.objects.create_user(username='teacher', password='password123', email='teacher@test.com', is_teacher=True)
+        self.assertEqual(self.upload(CSV_HEADER, user=teacher).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.upload('{"role": "teacher"}', name='members.json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.upload('not json', name='members.json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=self.manager)
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Too many rows to hash within one request: nothing is imported
+        members = [{'role': 'teacher', 'username': f't{i}', 'email': f't{i}@school.test'} for i in range(MAX_IMPORT_ROWS + 1)]
+        response = self.client.post(self.url, {'members': members}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('import_members command', response.data['error'])
+        self.assertFalse(User.objects.filter(username='t0').exists())
+
+    def test_management_command(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with TemporaryDirectory() as directory:
+            path = f'{directory}/members.csv'
+            with open(path, 'w') as file:
+                file.write(CSV_HEADER + 'teacher,t1,t1@school.test,,,,,\nteacher,taken,t2@school.test,,,,,\n')
+            call_command('import_members', path, manager='manager', stdout=stdout, stderr=stderr)
+        self.assertIn('Created 1 members. 1 rows failed.', stdout.getvalue())
+        self.assertIn('Row 2 (taken): Username taken is taken', stderr.getvalue())
+        self.assertEqual(User.objects.get(username='t1').managed_by, self.manager)
+
+    def test_management_command_reports_rows_before_a_read_error(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with TemporaryDirectory() as directory:
+            path = f'{directory}/members.csv'
+            # Text is decoded a block at a time; blank lines (skipped) keep the bad one out of the first row's block
+            for name, bad_line in (('decode', b'teacher,t\xff,x@school.test,,,,,\n'), ('csv', b'teacher,t9,"' + b'x' * 200000 + b'",,,,,\n')):
+                with open(path, 'wb') as file:
+                    file.write(CSV_HEADER.encode() + f'teacher,{name}1,{name}1@school.test,,,,,\n'.encode() + b'\n' * 20000 + bad_line)
+                with self.assertRaisesMessage(CommandError, 'Rows after 1 were not imported'):
+                    call_command('import_members', path, manager='manager', chunk_size=1, stdout=stdout, stderr=stderr)
+                self.assertTrue(User.objects.filter(username=f'{name}1').exists())
+            self.assertIn('Created 1 members. 0 rows failed.', stdout.getvalue())
+
+            with override_settings(EMAIL_DAILY_QUOTA=1):
+                with open(path, 'w') as file:
+                    file.write(CSV_HEADER + 'teacher,q1,q1@school.test,,,,,\nteacher,q2,q2@school.test,,,,,\n')
+                call_command('import_members', path, manager='manager', stdout=stdout, stderr=stderr)
+            self.assertIn('with EMAIL_DAILY_QUOTA=1 they take up to 2 days', stdout.getvalue())
+
+            with self.assertRaisesMessage(CommandError, '--chunk-size must be at least 1'):
+                call_command('import_members', path, manager='manager', chunk_size=0, stdout=stdout, stderr=stderr)
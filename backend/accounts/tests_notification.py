@@ -0,0 +1,107 @@
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User, Bus, Notification
+from .notifications import create_notification
+
+class NotificationFeedTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='parent', password='password123', email='parent@test.com', is_parent=True)
+        self.other = User.objects.create_user(username='other', password='password123', email='other@test.com', is_parent=True)
+        self.notifications = [create_notification(self.user, f'Alert {i}', 'Bus is late') for i in range(25)]
+        create_notification(self.other, 'Not yours', 'Bus is late')
+        self.user.refresh_from_db()
+        self.client.force_authenticate(user=self.user)
+
+    def feed(self, **params):
+        response = self.client.get(reverse('notification_feed'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def mark_read(self, data):
+        response = self.client.post(reverse('notification_mark_read'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_pages_newest_first_then_polls_only_new(self):
+        first = self.feed(limit=10)
+        self.assertEqual([n['title'] for n in first['results']], [f'Alert {i}' for i in range(24, 14, -1)])
+        self.assertEqual(first['unread_count'], 25)
+
+        seen = [n['id'] for n in first['results']]
+        cursor = first['next']
+        while cursor:
+            page = self.feed(limit=10, before=cursor)
+            seen += [n['id'] for n in page['results']]
+            cursor = page['next']
+        self.assertEqual(seen, [n.id for n in reversed(self.notifications)])
+
+        # Polling with the highest id seen downloads only what arrived since
+        create_notification(self.user, 'New 1', 'Trip started')
+        create_notification(self.user, 'New 2', 'Trip ended')
+        with self.assertNumQueries(1):
+            update = self.feed(since_id=seen[0])
+        self.assertEqual([n['title'] for n in update['results']], ['New 1', 'New 2'])
+        self.assertIsNone(update['next'])
+        self.assertEqual(self.feed(since_id=update['results'][-1]['id'])['results'], [])
+
+    def test_mark_read_keeps_the_counter_in_step(self):
+        ids = [n.id for n in self.notifications[:5]]
+        self.assertEqual(self.mark_read({'ids': ids}), {'marked': 5, 'unread_count': 20})
+        # Already read, or someone else's: nothing changes
+        other_id = Notification.objects.get(user=self.other).id
+        self.assertEqual(self.mark_read({'ids': ids + [other_id]}), {'marked': 0, 'unread_count': 20})
+        self.assertEqual(self.mark_read({'all': True}), {'marked': 20, 'unread_count': 0})
+
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.unread_notifications, 1)
+        self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+        self.assertEqual(self.client.post(reverse('notification_mark_read'), {'ids': 'all'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+class BroadcastFanOutTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+        self.client.force_authenticate(user=self.driver)
+
+    def add_students(self, start, count):
+        parents = User.objects.bulk_create([
+            User(username=f'parent{i}', email=f'parent{i}@test.com', password='!', is_parent=True) for i in range(start, start + count)
+        ])
+        # Siblings share a parent
+        return User.objects.bulk_create([
+            User(username=f'student{i}', email=f'student{i}@test.com', password='!', is_student=True, bus=self.bus, parent=parents[(i - start) // 2 * 2])
+            for i in range(start, start + count)
+        ])
+
+    def broadcast(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('driver_broadcast'), {'type': 'Delay', 'message': 'Running 10 minutes late', 'phone': '123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in queries]
+
+    def test_a_bus_of_100_students_is_fanned_out_in_batches(self):
+        self.add_students(0, 10)
+        small = self.broadcast()
+        students = self.add_students(10, 100)
+        large = self.broadcast()
+        # Only the number of INSERT batches may grow (SQLite caps the parameters per statement)
+        lookups = lambda queries: [sql for sql in queries if not sql.startswith('INSERT')]
+        self.assertEqual(len(lookups(small)), len(lookups(large)))
+        self.assertLessEqual(sum(sql.startswith('INSERT INTO "accounts_notification"') for sql in large), 3)
+
+        # Every student and parent on the bus got their own unread copy; parents of siblings only one
+        parent_ids = {student.parent_id for student in students}
+        self.assertEqual(len(parent_ids), 50)
+        self.assertEqual(Notification.objects.filter(title='Transport Alert: Delay', user__in=[s.id for s in students] + list(parent_ids)).count(), 150)
+        self.assertEqual(User.objects.filter(id__in=parent_ids, unread_notifications=1).count(), 50)
+
+        self.client.force_authenticate(user=User.objects.get(id=students[0].id))
+        feed = self.client.get(reverse('notification_feed')).data
+        self.assertEqual(feed['results'][0]['message'], 'Running 10 minutes late')
+        self.assertEqual(feed['unread_count'], 1)
@@ -0,0 +1,171 @@
+from django.test import TestCase
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+from unittest import mock
+from io import StringIO
+from .models import User, Bus, Trip, BoardingLog, DailyAttendance, MissingStudentAlert, SchedulerLease
+from .alert_schedule import alert_times_between, load_schedule_index, next_alert_time
+from .lease import acquire_lease, holds_lease, release_lease
+from .outbox import drain_outbox
+import datetime
+
+class NotifyUnboardedStudentsTest(TestCase):
+    def setUp(self):
+        # Pin the clock to the organisation's morning trigger minute
+        self.now = timezone.localtime().replace(hour=9, minute=0, second=5, microsecond=0)
+        self.mgmt = User.objects.create_user(
+            username='mgmt', password='password123', email='mgmt@test.com', is_management=True,
+            morning_arrival_time=datetime.time(9, 0), evening_departure_time=datetime.time(16, 0),
+        )
+        # Another organisation whose trigger is not due
+        User.objects.create_user(
+            username='other', password='password123', email='other@test.com', is_management=True,
+            morning_arrival_time=datetime.time(8, 30),
+        )
+
+        self.buses = [
+            Bus.objects.create(bus_number=f"BUS-0{i}", number_plate=f"KA01{i}", management=self.mgmt)
+            for i in range(2)
+        ]
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, managed_by=self.mgmt)
+        self.teacher = User.objects.create_user(username='teacher', password='password123', email='teacher@test.com', is_teacher=True, managed_by=self.mgmt, bus=self.buses[0])
+
+        self.students = []
+        for i in range(6):
+            parent = User.objects.create_user(username=f'parent{i}', password='password123', email=f'parent{i}@test.com', is_parent=True, managed_by=self.mgmt)
+            self.students.append(User.objects.create_user(
+                username=f'student{i}', password=None, email=f'student{i}@test.com',
+                is_student=True, managed_by=self.mgmt, parent=parent, bus=self.buses[i % 2],
+            ))
+        # A student without a bus is never reported
+        User.objects.create_user(username='walker', password=None, email='walker@test.com', is_student=True, managed_by=self.mgmt)
+
+        # Everyone on the second bus boarded the morning trip
+        trip = Trip.objects.create(bus=self.buses[1], driver=self.driver, trip_type='morning')
+        for student in self.students[1::2]:
+            BoardingLog.objects.create(student=student, bus=self.buses[1], trip=trip)
+        # date is auto_now_add; align it with the pinned local date
+        BoardingLog.objects.update(date=self.now.date())
+
+    def run_command(self):
+        with mock.patch('django.utils.timezone.localtime', return_value=self.now):
+            call_command('notify_unboarded_students', stdout=StringIO())
+
+    def test_emails_parents_and_teachers_of_missing_students(self):
+        self.run_command()
+        # The command only queues the alert
+        self.assertEqual(len(mail.outbox), 0)
+        drain_outbox()
+
+        # One message per recipient, greeting them by name
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(
+            {address for message in mail.outbox for address in message.to},
+            {'teacher@test.com', 'parent0@test.com', 'parent2@test.com', 'parent4@test.com'}
+        )
+        for message in mail.outbox:
+            self.assertEqual(len(message.to), 1)
+            self.assertIn('BUS-00', message.subject)
+            self.assertIn(f"Hello {message.to[0].split('@')[0]},", message.body)
+            for student in self.students[::2]:
+                self.assertIn(student.username, message.body)
+
+    def test_students_excused_by_their_teacher_are_left_out(self):
+        DailyAttendance.objects.create(student=self.students[0], date=self.now.date(), trip_type='morning', status='leave')
+        # Late students are still expected on the bus; evening marks don't excuse the morning trip
+        DailyAttendance.objects.create(student=self.students[2], date=self.now.date(), trip_type='morning', status='late')
+        DailyAttendance.objects.create(student=self.students[4], date=self.now.date(), trip_type='evening', status='absent')
+        self.run_command()
+        drain_outbox()
+
+        self.assertEqual(
+            {address for message in mail.outbox for address in message.to},
+            {'teacher@test.com', 'parent2@test.com', 'parent4@test.com'}
+        )
+        for message in mail.outbox:
+            self.assertNotIn('student0', message.body)
+
+    def test_morning_and_evening_alerts_on_the_same_minute(self):
+        # The evening alert goes out 3 minutes before departure: 09:00 too
+        User.objects.filter(id=self.mgmt.id).update(evening_departure_time=datetime.time(9, 3))
+        self.run_command()
+
+        self.assertEqual(
+            set(MissingStudentAlert.objects.filter(management=self.mgmt).values_list('trip_type', flat=True)),
+            {'morning', 'evening'},
+        )
+        drain_outbox()
+        subjects = {message.subject for message in mail.outbox}
+        self.assertIn('Alert: Missing Students for BUS-00 (Morning Trip)', subjects)
+        # Nobody has boarded an evening trip, so both buses are reported
+        self.assertIn('Alert: Missing Students for BUS-01 (Evening Trip)', subjects)
+
+    def test_queries_do_not_grow_with_students(self):
+        # Management users (1) + claiming the alert (4, get_or_create in a savepoint)
+        # + missing students with bus and parent (1) + teachers (1) + queueing the emails (1),
+        # all in one transaction (2)
+        with self.assertNumQueries(10):
+            self.run_command()
+
+    def test_alert_at_minute_is_sent_once(self):
+        # The scheduler passes the minute it was due for; the wall clock does not matter
+        at = self.now.replace(second=0).isoformat()
+        call_command('notify_unboarded_students', at=at, stdout=StringIO())
+        call_command('notify_unboarded_students', at=at, stdout=StringIO())
+        drain_outbox()
+
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertTrue(MissingStudentAlert.objects.filter(management=self.mgmt, date=self.now.date(), trip_type='morning').exists())
+
+    def test_next_alert_time(self):
+        index = load_schedule_index()
+        at = lambda hour, minute, days=0: self.now.replace(hour=hour, minute=minute, second=0) + datetime.timedelta(days=days)
+
+        # Earliest organisation first, then the evening alert 3 minutes before departure
+        self.assertEqual(next_alert_time(index, at(8, 0)), at(8, 30))
+        self.assertEqual(next_alert_time(index, at(8, 30)), at(9, 0))
+        self.assertEqual(next_alert_time(index, at(9, 0)), at(15, 57))
+        # After the last alert of the day it rolls over to tomorrow morning
+        self.assertEqual(next_alert_time(index, at(15, 57)), at(8, 30, days=1))
+        self.assertIsNone(next_alert_time({}, at(8, 0)))
+
+        # A late run catches up on every alert minute it slept through, once each
+        self.assertEqual(list(alert_times_between(index, at(8, 0), at(9, 5))), [at(8, 30), at(9, 0)])
+        self.assertEqual(list(alert_times_between(index, at(9, 0), at(9, 5))), [])
+
+class SchedulerLeaseTest(TestCase):
+    def test_only_one_holder_until_expiry(self):
+        self.assertTrue(acquire_lease('scheduler', 'worker-1', 60))
+        self.assertFalse(acquire_lease('scheduler', 'worker-2', 60))
+        # The holder renews its own lease
+        self.assertTrue(acquire_lease('scheduler', 'worker-1', 60))
+        self.assertTrue(holds_lease('scheduler', 'worker-1'))
+        self.assertFalse(holds_lease('scheduler', 'worker-2'))
+
+        # Once it expires without renewal, another worker takes over
+        SchedulerLease.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(acquire_lease('scheduler', 'worker-2', 60))
+        self.assertFalse(holds_lease('scheduler', 'worker-1'))
+
+    def test_release(self):
+        acquire_lease('scheduler', 'worker-1', 60)
+        release_lease('scheduler', 'worker-2')
+        self.assertFalse(acquire_lease('scheduler', 'worker-2', 60))
+
+        release_lease('scheduler', 'worker-1')
+        self.assertTrue(acquire_lease('scheduler', 'worker-2', 60))
+
+    def test_jobs_only_run_on_the_lease_holder(self):
+        from . import scheduler
+        acquire_lease(scheduler.LEASE_NAME, 'another-worker', 60)
+        with mock.patch('accounts.scheduler.call_command') as command, mock.patch('builtins.print'):
+            scheduler.notify_job()
+            scheduler.push_receipts_job()
+        command.assert_not_called()
+
+        release_lease(scheduler.LEASE_NAME, 'another-worker')
+        acquire_lease(scheduler.LEASE_NAME, scheduler.holder_id(), 60)
+        with mock.patch('accounts.scheduler.call_command') as command:
+            scheduler.push_receipts_job()
+        command.assert_called_once_with('check_push_receipts')
@@ -0,0 +1,157 @@
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core import mail
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from unittest import mock
+from .models import User, Bus, OutboundMessage
+from .outbox import BATCH_SIZE, MAX_ATTEMPTS, claim_due_messages, drain_outbox, enqueue_email, enqueue_push
+import datetime
+
+class OutboxTest(TestCase):
+    def test_drain_sends_and_marks_messages(self):
+        enqueue_email('Hello', 'Body', ['a@test.com'], html_body='<p>Body</p>')
+        enqueue_push(['tok'], 'Title', 'Body')
+        with mock.patch('accounts.utils.send_push_notification', return_value=True) as push:
+            self.assertEqual(drain_outbox(), (2, 0))
+
+        push.assert_called_once_with(['tok'], 'Title', 'Body', None)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>Body</p>')
+        self.assertEqual(OutboundMessage.objects.filter(status='sent').count(), 2)
+        # Sent messages don't keep their content (credentials, OTPs)
+        self.assertFalse(OutboundMessage.objects.exclude(payload={}).exists())
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        [message] = enqueue_email('Hello', 'Body', ['a@test.com'])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP down')):
+            self.assertEqual(drain_outbox(), (0, 1))
+            message.refresh_from_db()
+            self.assertEqual(message.status, 'pending')
+            self.assertEqual(message.attempts, 1)
+            self.assertEqual(message.last_error, 'SMTP down')
+            first_delay = message.next_attempt_at - timezone.now()
+            self.assertGreater(first_delay, datetime.timedelta(seconds=20))
+
+            # Not due yet, so nothing is retried
+            self.assertEqual(drain_outbox(), (0, 0))
+
+            for attempt in range(2, MAX_ATTEMPTS + 1):
+                OutboundMessage.objects.update(next_attempt_at=timezone.now())
+                drain_outbox()
+                message.refresh_from_db()
+                if attempt == 2:
+                    # Backoff doubles
+                    self.assertGreater(message.next_attempt_at - timezone.now(), first_delay)
+
+        self.assertEqual(message.status, 'failed')
+        self.assertEqual(message.attempts, MAX_ATTEMPTS)
+        self.assertEqual(message.payload, {'subject': 'Hello', 'to': ['a@test.com']})
+
+    def test_claimed_messages_are_not_claimed_twice(self):
+        for i in range(3):
+            enqueue_email('Hello', 'Body', [f'{i}@test.com'])
+
+        first = claim_due_messages(limit=2)
+        second = claim_due_messages(limit=2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({m.id for m in first} & {m.id for m in second})
+        self.assertEqual(claim_due_messages(), [])
+
+    def test_one_personalised_message_per_recipient(self):
+        enqueue_email('Hi {name}', 'Dear {name},', [('a@test.com', 'Asha'), 'b@test.com', ('a@test.com', 'Other')])
+        self.assertEqual(drain_outbox(), (2, 0))
+
+        sent = {message.to[0]: message for message in mail.outbox}
+        self.assertEqual(sent['a@test.com'].to, ['a@test.com'])
+        self.assertEqual(sent['a@test.com'].subject, 'Hi Asha')
+        self.assertEqual(sent['b@test.com'].body, 'Dear there,')
+
+    def test_name_is_escaped_in_html_body(self):
+        enqueue_email('Hi {name}', 'Dear {name},', [('a@test.com', '<b>Asha</b>')], html_body='<p>Dear {name},</p>')
+        drain_outbox()
+        self.assertEqual(mail.outbox[0].body, 'Dear <b>Asha</b>,')
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>Dear &lt;b&gt;Asha&lt;/b&gt;,</p>')
+
+    @override_settings(EMAIL_DAILY_QUOTA=3)
+    def test_emails_over_daily_quota_wait_for_tomorrow(self):
+        enqueue_email('Hello', 'Body', [f'{i}@test.com' for i in range(5)])
+        self.assertEqual(drain_outbox(), (3, 0))
+
+        held = OutboundMessage.objects.filter(status='pending')
+        self.assertEqual(held.count(), 2)
+        tomorrow = timezone.localtime().date() + datetime.timedelta(days=1)
+        for message in held:
+            self.assertEqual(message.attempts, 0)
+            self.assertEqual(timezone.localtime(message.next_attempt_at).date(), tomorrow)
+
+        # Over the quota, an OTP still goes out today
+        enqueue_email('Password Reset OTP', 'Your OTP', ['otp@test.com'], urgent=True)
+        self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(mail.outbox[-1].to, ['otp@test.com'])
+
+    def test_urgent_messages_are_claimed_first(self):
+        enqueue_email('Hello', 'Body', [f'{i}@test.com' for i in range(3)])
+        OutboundMessage.objects.update(next_attempt_at=timezone.now() - datetime.timedelta(hours=1))
+        [otp] = enqueue_email('Password Reset OTP', 'Your OTP', ['otp@test.com'], urgent=True)
+        self.assertEqual([m.id for m in claim_due_messages(limit=1)], [otp.id])
+
+    @override_settings(EMAIL_MAX_PER_SECOND=0, EMAIL_DAILY_QUOTA=0, EMAIL_MAX_PER_CONNECTION=100)
+    def test_bulk_send_reuses_connections(self):
+        enqueue_email('Hello {name}', 'Body', [(f'{i}@test.com', f'User {i}') for i in range(5000)])
+
+        connections = []
+        real_get_connection = mail.get_connection
+        def get_connection(*args, **kwargs):
+            connections.append(real_get_connection(*args, **kwargs))
+            return connections[-1]
+
+        with mock.patch('accounts.mailer.get_connection', side_effect=get_connection), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(drain_outbox(), (5000, 0))
+
+        self.assertEqual(len(mail.outbox), 5000)
+        self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+        # One connection per 100 messages
+        self.assertEqual(len(connections), 50)
+        # Claiming (3) and marking sent (1) per batch, plus the final empty claim: nothing per message
+        self.assertEqual(len(queries), 5000 // BATCH_SIZE * 4 + 1)
+
+class DriverBroadcastQueueTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+        self.client.force_authenticate(user=self.driver)
+        self.url = reverse('driver_broadcast')
+
+    def add_students(self, start, count):
+        for i in range(start, start + count):
+            parent = User.objects.create_user(username=f'parent{i}', password=None, email=f'parent{i}@test.com', is_parent=True, push_token=f'ExponentPushToken[p{i}]')
+            User.objects.create_user(username=f'student{i}', password=None, email=f'student{i}@test.com', is_student=True, bus=self.bus, parent=parent)
+
+    def broadcast(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'type': 'Delay', 'message': 'Running 10 minutes late', 'phone': '123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_broadcast_only_queues_and_does_not_grow_with_recipients(self):
+        self.add_students(0, 3)
+        small = self.broadcast()
+        self.add_students(3, 30)
+        large = self.broadcast()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(mail.outbox), 0)
+        # One email per student and parent: 6 for the first broadcast, 66 for the second
+        self.assertEqual(OutboundMessage.objects.filter(channel='email').count(), 72)
+        self.assertEqual(OutboundMessage.objects.filter(channel='push').count(), 2)
+
+        latest_push = OutboundMessage.objects.filter(channel='push').latest('id')
+        self.assertEqual(len(latest_push.payload['tokens']), 33)
@@ -0,0 +1,100 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .models import User, PushTicket
+from .push import check_push_receipts
+from .utils import send_push_notification
+import datetime
+import gzip
+import json
+import socket
+import threading
+
+class StubExpoHandler(BaseHTTPRequestHandler):
+    """Answers like Expo: tokens containing 'dead' are not registered, tickets ending in '-gone' get a failed receipt."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        self.server.requests.append((self.path, payload))
+
+        if self.path == '/send':
+            data = [
+                {'status': 'error', 'message': 'not registered', 'details': {'error': 'DeviceNotRegistered'}}
+                if 'dead' in message['to'] else {'status': 'ok', 'id': f"ticket-{message['to']}"}
+                for message in payload
+            ]
+        else:
+            data = {
+                ticket_id: {'status': 'error', 'details': {'error': 'DeviceNotRegistered'}}
+                if ticket_id.endswith('-gone') else {'status': 'ok'}
+                for ticket_id in payload['ids']
+            }
+
+        response = json.dumps({'data': data}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+class ExpoPushClientTest(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubExpoHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        base_url = f'http://127.0.0.1:{self.server.server_port}'
+        settings_override = override_settings(EXPO_PUSH_URL=f'{base_url}/send', EXPO_RECEIPTS_URL=f'{base_url}/receipts')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_user(self, token):
+        return User.objects.create_user(username=token, password=None, email=f'{token}@test.com', push_token=token)
+
+    def test_broadcast_is_chunked_and_prunes_unregistered_tokens(self):
+        tokens = [f'token-{i}' for i in range(250)]
+        dead = self.create_user('dead-token')
+
+        self.assertTrue(send_push_notification(tokens + ['dead-token', 'token-0', ''], 'Alert', 'Bus is late'))
+
+        # 251 distinct tokens in chunks of at most 100, gzipped
+        sizes = sorted(len(payload) for path, payload in self.server.requests)
+        self.assertEqual(sizes, [51, 100, 100])
+        self.assertEqual(PushTicket.objects.count(), 250)
+
+        dead.refresh_from_db()
+        self.assertIsNone(dead.push_token)
+
+    def test_failed_request_returns_false(self):
+        # Nothing listens on a port that was just closed
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            closed_port = closed.getsockname()[1]
+        with override_settings(EXPO_PUSH_URL=f'http://127.0.0.1:{closed_port}/send'):
+            self.assertFalse(send_push_notification(['token-1'], 'Alert', 'Bus is late'))
+        self.assertFalse(PushTicket.objects.exists())
+
+    def test_receipts_prune_dead_tokens(self):
+        gone = self.create_user('token-gone')
+        alive = self.create_user('token-alive')
+        send_push_notification(['token-gone', 'token-alive'], 'Alert', 'Bus is late')
+
+        # Receipts are not fetched until they are likely to be ready
+        self.assertEqual(check_push_receipts(), (0, 0))
+
+        PushTicket.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=20))
+        self.assertEqual(check_push_receipts(), (2, 1))
+        self.assertFalse(PushTicket.objects.exists())
+
+        gone.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertIsNone(gone.push_token)
+        self.assertEqual(alive.push_token, 'token-alive')
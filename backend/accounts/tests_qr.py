@@ -23,16 +23,18 @@ class DynamicQRTests(TestCase):
         self.client.force_authenticate(user=self.driver_user)
 
     def test_generate_qr_token(self):
-        """Test that the driver dashboard returns a signed QR token"""
+        """Test that the driver dashboard returns a signed QR token, and the bus QR secret newer apps derive codes from"""
         url = reverse('driver_dashboard_stats')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('qr_token', response.data)
-        
+
         qr_token = response.data['qr_token']
         signer = TimestampSigner()
         bus_id = signer.unsign(qr_token)
         self.assertEqual(int(bus_id), self.bus.id)
+        self.assertEqual(response.data['qr']['secret'], self.bus.qr_secret)
+        self.assertEqual(response.data['qr']['period'], 30)
 
     def test_verify_qr_token_success(self):
         """Test that a valid QR token allows boarding"""
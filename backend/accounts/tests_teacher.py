@@ -0,0 +1,111 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User, Bus, Grade, Trip, BoardingLog, DailyAttendance
+import datetime
+
+class TeacherStudentListTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.grade = Grade.objects.create(name='10', section='A')
+        self.teacher = User.objects.create_user(username='teacher', password='password123', email='teacher@test.com', is_teacher=True, class_in_charge=self.grade)
+        self.buses = [Bus.objects.create(bus_number=f'BUS-0{i}', number_plate=f'KA0{i}') for i in range(3)]
+        self.drivers = [
+            User.objects.create_user(username=f'driver{i}', password='password123', email=f'driver{i}@test.com', is_driver=True, bus=bus)
+            for i, bus in enumerate(self.buses)
+        ]
+        # The class rides the first two buses; the third carries another class
+        self.trips = [Trip.objects.create(bus=bus, driver=driver) for bus, driver in zip(self.buses, self.drivers)]
+        self.client.force_authenticate(user=self.teacher)
+        self.url = reverse('teacher_student_list')
+
+    def add_students(self, count, bus, grade=None):
+        start = User.objects.count()
+        return [
+            User.objects.create_user(username=f'student{start + i}', password=None, email=f'student{start + i}@test.com', is_student=True, bus=bus, class_in_charge=grade or self.grade)
+            for i in range(count)
+        ]
+
+    def statuses(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {row['id']: row['status'] for row in response.data}
+
+    def test_each_student_is_checked_against_their_own_bus(self):
+        first, second = self.add_students(1, self.buses[0])[0], self.add_students(1, self.buses[1])[0]
+        no_bus = self.add_students(1, None)[0]
+        BoardingLog.objects.create(student=first, bus=self.buses[0], trip=self.trips[0])
+        BoardingLog.objects.create(student=second, bus=self.buses[1], trip=self.trips[1])
+
+        self.assertEqual(self.statuses(), {first.id: 'Boarded', second.id: 'Boarded', no_bus.id: 'Not Boarded'})
+
+        # Once their bus's trip ends, its logs no longer count as boarded
+        Trip.objects.filter(id=self.trips[1].id).update(is_active=False)
+        self.assertEqual(self.statuses()[second.id], 'Not Boarded')
+
+    def test_list_is_built_in_constant_queries(self):
+        self.add_students(2, self.buses[0])
+        self.add_students(3, self.buses[2], Grade.objects.create(name='10', section='B'))
+        with self.assertNumQueries(1):
+            self.statuses()
+        for student in self.add_students(40, self.buses[1]):
+            BoardingLog.objects.create(student=student, bus=self.buses[1], trip=self.trips[1])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.statuses()), 42)
+
+class TeacherAttendanceTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.grade = Grade.objects.create(name='10', section='A')
+        self.teacher = User.objects.create_user(username='teacher', password='password123', email='teacher@test.com', is_teacher=True, class_in_charge=self.grade)
+        self.students = [
+            User.objects.create_user(username=f'student{i}', password=None, email=f'student{i}@test.com', is_student=True, class_in_charge=self.grade)
+            for i in range(40)
+        ]
+        self.outsider = User.objects.create_user(username='outsider', password=None, email='outsider@test.com', is_student=True)
+        self.client.force_authenticate(user=self.teacher)
+        self.url = reverse('teacher_update_student_status')
+
+    def post(self, data):
+        return self.client.post(self.url, data, format='json')
+
+    def test_whole_class_is_marked_in_one_upsert(self):
+        marks = [{'student_id': student.id, 'status': 'Absent' if i < 3 else 'Present'} for i, student in enumerate(self.students)]
+        # Class check, upsert
+        with self.assertNumQueries(2):
+            response = self.post({'marks': marks, 'trip_type': 'morning'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['marked'], 40)
+
+        # Marking again replaces the earlier mark; without a trip type both trips are marked
+        self.post({'student_id': self.students[0].id, 'status': 'Leave'})
+        self.assertEqual(
+            dict(DailyAttendance.objects.filter(student=self.students[0]).values_list('trip_type', 'status')),
+            {'morning': 'leave', 'evening': 'leave'},
+        )
+        self.assertEqual(DailyAttendance.objects.count(), 41)
+
+        response = self.client.get(reverse('teacher_student_list'))
+        statuses = {row['id']: row['status'] for row in response.data}
+        self.assertEqual((statuses[self.students[0].id], statuses[self.students[1].id], statuses[self.students[3].id]), ('Leave', 'Absent', 'Present'))
+
+    def test_invalid_marks_write_nothing(self):
+        for data in (
+            {'marks': [{'student_id': self.students[0].id, 'status': 'Absent'}, {'student_id': self.outsider.id, 'status': 'Absent'}]},
+            {'student_id': self.students[0].id, 'status': 'Sleeping'},
+            {'student_id': self.students[0].id, 'status': 'Absent', 'trip_type': 'night'},
+            {'student_id': self.students[0].id, 'status': 'Absent', 'date': '2026-02-30'},
+            {'student_id': 'x', 'status': 'Absent'},
+            {'marks': []},
+        ):
+            self.assertEqual(self.post(data).status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertFalse(DailyAttendance.objects.exists())
+
+        self.post({'student_id': self.students[0].id, 'status': 'late', 'date': '2026-10-16'})
+        self.assertEqual(DailyAttendance.objects.get(trip_type='morning').date, datetime.date(2026, 10, 16))
+
+    def test_form_post_with_string_id(self):
+        response = self.client.post(self.url, {'student_id': str(self.students[0].id), 'status': 'Absent', 'trip_type': 'morning'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DailyAttendance.objects.get().status, 'absent')
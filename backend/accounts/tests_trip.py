@@ -1,12 +1,20 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models import User, Bus, Grade, Trip
+from .live_state import PARENT_BUSES_TIMEOUT, live_cache, live_cache_timeout, update_bus_state
 from django.urls import reverse
+from asgiref.sync import sync_to_async
+import asyncio
+import datetime
+import json
 
 class BusLocationAccessTest(TestCase):
     def setUp(self):
         self.client = APIClient()
+        live_cache().clear()
         
         # Create Bus
         self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
@@ -71,3 +79,148 @@ class BusLocationAccessTest(TestCase):
         self.client.force_authenticate(user=self.management_user)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class BusLocationCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        live_cache().clear()
+
+        self.bus = Bus.objects.create(
+            bus_number="BUS-01",
+            number_plate="KA01AB1234",
+            morning_trip_end_time=datetime.time(12, 0, 0),
+            evening_trip_start_time=datetime.time(12, 0, 0)
+        )
+
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True)
+        self.driver.bus = self.bus
+        self.driver.save()
+
+        self.parent = User.objects.create_user(username='parent', password='password123', email='parent@test.com', is_parent=True)
+        self.student = User.objects.create_user(username='student', password='password123', email='student@test.com', is_student=True)
+        self.student.bus = self.bus
+        self.student.parent = self.parent
+        self.student.save()
+
+        self.url = reverse('bus_location', args=[self.bus.id])
+
+    def poll(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.get(self.url)
+
+    def test_warm_poll_needs_no_queries(self):
+        self.poll(self.parent)
+        with self.assertNumQueries(0):
+            response = self.poll(self.parent)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_trip_and_location_updates_are_visible(self):
+        response = self.poll(self.student)
+        self.assertFalse(response.data['is_active_trip'])
+
+        self.client.force_authenticate(user=self.driver)
+        self.client.post(reverse('start_trip'))
+        self.client.post(reverse('update_location'), {'latitude': 10.5, 'longitude': 76.2})
+
+        response = self.poll(self.student)
+        self.assertTrue(response.data['is_active_trip'])
+        self.assertEqual(response.data['latitude'], 10.5)
+        self.assertIsNotNone(response.data['last_update'])
+
+        self.client.force_authenticate(user=self.driver)
+        self.client.post(reverse('end_trip'))
+
+        response = self.poll(self.student)
+        self.assertFalse(response.data['is_active_trip'])
+        self.assertIsNone(response.data['latitude'])
+
+    def test_parent_access_follows_children_at_once(self):
+        other_bus = Bus.objects.create(bus_number="BUS-02", number_plate="KA01AB5678")
+        other_url = reverse('bus_location', args=[other_bus.id])
+        self.client.force_authenticate(user=self.parent)
+        self.assertEqual(self.client.get(other_url).status_code, status.HTTP_403_FORBIDDEN)
+
+        # A child registered on another bus
+        sibling = User.objects.create_user(username='sibling', password=None, email='sibling@test.com', is_student=True, bus=other_bus, parent=self.parent)
+        self.assertEqual(self.client.get(other_url).status_code, status.HTTP_200_OK)
+
+        # Re-parented: the previous parent loses the bus, the new one gains it
+        other_parent = User.objects.create_user(username='other_parent', password=None, email='other_parent@test.com', is_parent=True)
+        self.assertEqual(self.poll(self.parent).status_code, status.HTTP_200_OK)
+        self.student.parent = other_parent
+        self.student.save()
+        self.assertEqual(self.poll(self.parent).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.poll(other_parent).status_code, status.HTTP_200_OK)
+
+        sibling.delete()
+        self.client.force_authenticate(user=self.parent)
+        self.assertEqual(self.client.get(other_url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_parent_buses_outlive_the_alias_timeout_only_in_a_shared_cache(self):
+        # In process memory another worker can't see an invalidation, so the entry keeps the short default
+        self.assertIs(live_cache_timeout(PARENT_BUSES_TIMEOUT), DEFAULT_TIMEOUT)
+        with override_settings(CACHES={**settings.CACHES, 'live': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/9'}}):
+            self.assertEqual(live_cache_timeout(PARENT_BUSES_TIMEOUT), PARENT_BUSES_TIMEOUT)
+
+    def test_unknown_bus_is_not_found(self):
+        self.client.force_authenticate(user=self.driver)
+        response = self.client.get(reverse('bus_location', args=[self.bus.id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class BusLocationStreamTest(TestCase):
+    def setUp(self):
+        live_cache().clear()
+
+        self.bus = Bus.objects.create(bus_number="BUS-01", number_plate="KA01AB1234")
+
+        self.student = User.objects.create_user(username='student', password='password123', email='student@test.com', is_student=True)
+        self.student.bus = self.bus
+        self.student.save()
+
+        self.other_parent = User.objects.create_user(username='other_parent', password='password123', email='other_parent@test.com', is_parent=True)
+
+        self.url = reverse('bus_location_stream', args=[self.bus.id])
+
+    def auth_header(self, user):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        return {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    def test_refused_under_wsgi(self):
+        # A WSGI worker would be tied up for the whole stream; clients fall back to polling
+        response = self.client.get(self.url, headers=self.auth_header(self.student))
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertIn('poll', response.json()['error'])
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_same_permission_rules_as_polling(self):
+        headers = await sync_to_async(self.auth_header)(self.other_parent)
+        response = await self.async_client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_pushes_snapshot_then_position_deltas(self):
+        headers = await sync_to_async(self.auth_header)(self.student)
+        response = await self.async_client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = aiter(response.streaming_content)
+
+        async def next_event():
+            chunk = await asyncio.wait_for(anext(events), 2)
+            return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+        self.assertTrue((await next_event()).startswith('retry:'))
+        snapshot = await next_event()
+        self.assertIn('event: snapshot', snapshot)
+        self.assertIn('"is_active_trip": false', snapshot)
+
+        # A fix accepted for the bus reaches the subscriber with only the changed fields
+        update_bus_state(self.bus.id, latitude=10.5, longitude=76.2)
+        update = await next_event()
+        self.assertIn('event: update', update)
+        payload = json.loads(update.split('data: ', 1)[1])
+        self.assertEqual(payload, {'bus_id': self.bus.id, 'latitude': 10.5, 'longitude': 76.2})
+        await events.aclose()
@@ -1,4 +1,5 @@
 from django.test import TestCase
+from django.db import IntegrityError, transaction
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models import User, Bus, Trip, BoardingLog
@@ -169,3 +170,19 @@ class TripScheduleTest(TestCase):
 
             # Verify 2 logs exist
             self.assertEqual(BoardingLog.objects.count(), 2)
+
+    def test_one_active_trip_per_bus(self):
+        Trip.objects.create(bus=self.bus, driver=self.driver)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Trip.objects.create(bus=self.bus, driver=self.driver)
+
+        # Ended trips don't count
+        Trip.objects.create(bus=self.bus, driver=self.driver, is_active=False)
+        self.assertEqual(Trip.objects.filter(bus=self.bus, is_active=True).count(), 1)
+
+    def test_concurrent_start_is_a_conflict(self):
+        self.client.force_authenticate(user=self.driver)
+        # The other request's trip is committed between our cleanup and our insert
+        with patch('accounts.views_trip.Trip.objects.create', side_effect=IntegrityError):
+            response = self.client.post(self.start_trip_url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
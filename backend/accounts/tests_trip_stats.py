@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.signing import TimestampSigner
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.utils import timezone
+from io import StringIO
+from unittest import mock
+from .models import User, Bus, Grade, Trip, TripGradeCount, BoardingLog
+import datetime
+
+class TripStatsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.bus = Bus.objects.create(
+            bus_number="BUS-01", number_plate="KA01AB1234",
+            # Any time of day starts an evening trip
+            morning_trip_end_time=datetime.time(0, 0), evening_trip_start_time=datetime.time(0, 0),
+        )
+        self.driver = User.objects.create_user(username='driver', password='password123', email='driver@test.com', is_driver=True, bus=self.bus)
+        self.grades = [Grade.objects.create(name='10', section=section) for section in 'AB']
+        self.teacher = User.objects.create_user(username='teacher', password='password123', email='teacher@test.com', is_teacher=True, class_in_charge=self.grades[0])
+
+        # Three students of 10-A, two of 10-B and one without a grade
+        grades = [self.grades[0]] * 3 + [self.grades[1]] * 2 + [None]
+        self.students = [
+            User.objects.create_user(username=f'student{i}', password=None, email=f'student{i}@test.com', is_student=True, bus=self.bus, class_in_charge=grade)
+            for i, grade in enumerate(grades)
+        ]
+
+        self.client.force_authenticate(user=self.driver)
+        response = self.client.post(reverse('start_trip'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.trip = Trip.objects.get(id=response.data['trip_id'])
+        self.token = TimestampSigner().sign(self.bus.id)
+
+    def board(self, student):
+        self.client.force_authenticate(user=student)
+        return self.client.post(reverse('student_board'), {'qr_token': self.token})
+
+    def grade_counts(self):
+        return {
+            grade_count.grade_id: (grade_count.boarded_count, grade_count.expected_count)
+            for grade_count in TripGradeCount.objects.filter(trip=self.trip)
+        }
+
+    def test_counters_follow_scans(self):
+        self.assertEqual(self.trip.expected_count, 6)
+        self.assertEqual(self.grade_counts(), {self.grades[0].id: (0, 3), self.grades[1].id: (0, 2)})
+
+        for student in self.students[:2] + self.students[3:]:
+            self.assertEqual(self.board(student).status_code, status.HTTP_201_CREATED)
+        # Scanning twice counts once
+        self.assertEqual(self.board(self.students[0]).data['status'], 'already_boarded')
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.boarded_count, 5)
+        self.assertEqual(self.grade_counts(), {self.grades[0].id: (2, 3), self.grades[1].id: (2, 2)})
+
+    def test_teacher_dashboard_reads_grade_counter(self):
+        self.board(self.students[0])
+        self.board(self.students[3])
+
+        self.client.force_authenticate(user=self.teacher)
+        response = self.client.get(reverse('teacher_dashboard_stats'))
+        self.assertEqual(response.data['boarded'], 1)
+        self.assertEqual(response.data['total_students'], 3)
+
+    def test_teacher_dashboard_after_local_midnight(self):
+        # Just after local midnight the UTC date (Asia/Kolkata) is still yesterday's
+        midnight = timezone.make_aware(datetime.datetime.combine(timezone.localdate(), datetime.time.min))
+        Trip.objects.filter(id=self.trip.id).update(start_time=midnight + datetime.timedelta(minutes=5))
+        self.board(self.students[0])
+
+        self.client.force_authenticate(user=self.teacher)
+        now = (midnight + datetime.timedelta(minutes=10)).astimezone(datetime.timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            response = self.client.get(reverse('teacher_dashboard_stats'))
+        self.assertEqual(response.data['boarded'], 1)
+        self.assertEqual(response.data['trip_type'], self.trip.trip_type)
+
+    def test_repair_recomputes_counters_from_logs(self):
+        self.board(self.students[0])
+        # A log written without going through the counters, and a counter that drifted
+        BoardingLog.objects.create(student=self.students[3], bus=self.bus, trip=self.trip)
+        TripGradeCount.objects.filter(trip=self.trip, grade=self.grades[0]).update(boarded_count=7)
+
+        out = StringIO()
+        call_command('repair_trip_stats', stdout=out)
+        self.assertIn('Repaired 1', out.getvalue())
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.boarded_count, 2)
+        self.assertEqual(self.grade_counts(), {self.grades[0].id: (1, 3), self.grades[1].id: (1, 2)})
+
+        # Nothing left to repair
+        out = StringIO()
+        call_command('repair_trip_stats', stdout=out)
+        self.assertIn('Repaired 0', out.getvalue())
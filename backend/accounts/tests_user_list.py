@@ -0,0 +1,53 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from .models import User
+
+class UserListTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='password123', email='admin@test.com')
+        self.manager = User.objects.create_user(username='manager', password='password123', email='manager@test.com', is_management=True)
+        self.other_manager = User.objects.create_user(username='other', password='password123', email='other@test.com', is_management=True)
+        User.objects.bulk_create(
+            [User(username=f'teacher{i}', email=f'teacher{i}@school.test', is_teacher=True, managed_by=self.manager) for i in range(5)]
+            + [User(username=f'driver{i}', email=f'driver{i}@school.test', is_driver=True, managed_by=self.manager) for i in range(3)]
+            + [User(username=f'student{i}', email=f'student{i}@elsewhere.test', is_student=True, managed_by=self.other_manager) for i in range(4)]
+        )
+        User.objects.filter(username='teacher4').update(is_active=False)
+        self.url = reverse('user_list')
+
+    def get(self, user, **params):
+        self.client.force_authenticate(user=user)
+        return self.client.get(self.url, params)
+
+    def usernames(self, response):
+        return [user['username'] for user in response.data['results']]
+
+    def test_cursor_walks_every_user_once(self):
+        seen = []
+        params = {'limit': 4}
+        while True:
+            response = self.get(self.admin, **params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 4)
+            seen += [user['id'] for user in response.data['results']]
+            if response.data['next'] is None:
+                break
+            params['after'] = response.data['next']
+        self.assertEqual(seen, list(User.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_filters_and_sparse_fields(self):
+        response = self.get(self.manager, role='teacher,driver', is_active='true', fields='username')
+        self.assertEqual(self.usernames(response), [f'teacher{i}' for i in range(4)] + [f'driver{i}' for i in range(3)])
+        self.assertEqual(set(response.data['results'][0]), {'id', 'username'})
+
+        # Prefix of username or email, case-insensitive; managers only see their own members
+        self.assertEqual(self.usernames(self.get(self.manager, search='DRIVER')), ['driver0', 'driver1', 'driver2'])
+        self.assertEqual(self.usernames(self.get(self.manager, search='student')), [])
+        self.assertEqual(len(self.usernames(self.get(self.admin, search='student'))), 4)
+
+    def test_invalid_parameters(self):
+        for params in ({'limit': 0}, {'limit': 1000}, {'after': 'x'}, {'role': 'pilot'}, {'is_active': 'yes'}, {'fields': 'password'}):
+            self.assertEqual(self.get(self.admin, **params).status_code, status.HTTP_400_BAD_REQUEST, params)
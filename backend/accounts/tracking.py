@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Bus, LocationSample
+from .live_state import update_bus_state
+
+# Upper bound on fixes accepted in one batch upload (roughly 40 minutes of 5 s pings)
+MAX_BATCH_FIXES = 500
+
+# How far ahead of the server clock a device timestamp may be before we reject it
+MAX_CLOCK_SKEW = timedelta(seconds=60)
+
+
+def parse_coordinate(value, limit):
+    """
+    Convert a latitude/longitude value sent by the driver app to a float.
+    Returns None if the value is missing, not a number or out of range.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not -limit <= value <= limit:
+        return None
+    return value
+
+
+def parse_optional_float(value):
+    """Speed / heading / accuracy are optional and simply dropped if malformed."""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value):
+    """
+    Parse a fix timestamp from the driver app.
+    Accepts ISO 8601 strings or epoch numbers (seconds, or milliseconds as
+    produced by JavaScript's Date.now()). Returns an aware datetime or None.
+    """
+    if value in (None, ''):
+        return None
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        epoch = float(value)
+        if epoch > 1e11:
+            epoch /= 1000.0
+        try:
+            return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+
+    try:
+        ts = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if ts is None:
+        return None
+    if timezone.is_naive(ts):
+        ts = timezone.make_aware(ts)
+    return ts
+
+
+def build_sample(trip_id, ts, data):
+    """
+    Build an unsaved LocationSample from a fix sent by the driver app.
+    Returns None if the coordinates are invalid.
+    """
+    latitude = parse_coordinate(data.get('latitude'), 90)
+    longitude = parse_coordinate(data.get('longitude'), 180)
+    if latitude is None or longitude is None:
+        return None
+
+    return LocationSample(
+        trip_id=trip_id,
+        ts=ts,
+        latitude=latitude,
+        longitude=longitude,
+        speed=parse_optional_float(data.get('speed')),
+        heading=parse_optional_float(data.get('heading')),
+        accuracy=parse_optional_float(data.get('accuracy')),
+    )
+
+
+def record_location_samples(bus_id, samples):
+    """
+    Append the samples to the trip breadcrumb table and move the bus's
+    "latest position" pointer to the newest one.
+
+    The bus row is updated with a single UPDATE of the three location columns,
+    so we never load (or rewrite) the rest of the Bus row on the hot path.
+    Samples already stored for the same (trip, ts) are ignored, and the pointer
+    only moves forward in time, so replayed fixes never rewind the bus.
+    """
+    if not samples:
+        return None
+
+    LocationSample.objects.bulk_create(samples, ignore_conflicts=True)
+
+    latest = max(samples, key=lambda s: s.ts)
+    moved = Bus.objects.filter(
+        Q(last_update__isnull=True) | Q(last_update__lt=latest.ts),
+        pk=bus_id,
+    ).update(
+        latitude=latest.latitude,
+        longitude=latest.longitude,
+        last_update=latest.ts,
+    )
+    if moved:
+        update_bus_state(
+            bus_id,
+            latitude=latest.latitude,
+            longitude=latest.longitude,
+            last_update=latest.ts,
+        )
+    return latest
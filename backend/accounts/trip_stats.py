@@ -0,0 +1,86 @@
+"""
+Per-trip boarding counters (Trip.boarded_count/expected_count and TripGradeCount), so dashboards
+read a row instead of counting BoardingLogs. StartTripView seeds them from the bus roster, every
+new BoardingLog bumps them with an F() update in the same transaction, and the repair_trip_stats
+command recomputes them from the logs.
+"""
+from collections import Counter
+
+from django.db.models import Count, F
+
+from .models import BoardingLog, Trip, TripGradeCount, User
+
+
+def start_trip_stats(trip):
+    """Record how many students are expected on a new trip, in total and per grade."""
+    expected_by_grade = dict(
+        User.objects.filter(bus_id=trip.bus_id, is_student=True)
+        .values_list('class_in_charge')
+        .annotate(students=Count('id'))
+        .order_by()
+    )
+    trip.expected_count = sum(expected_by_grade.values())
+    Trip.objects.filter(id=trip.id).update(expected_count=trip.expected_count)
+    TripGradeCount.objects.bulk_create([
+        TripGradeCount(trip=trip, grade_id=grade_id, expected_count=students)
+        for grade_id, students in expected_by_grade.items()
+        if grade_id is not None
+    ])
+
+
+def count_boardings(trip_id, grade_ids):
+    """
+    Add newly created boarding logs to the trip's counters; `grade_ids` has one entry per log
+    (the student's grade, or None). Call it in the transaction that created the logs.
+    """
+    if not grade_ids:
+        return
+    Trip.objects.filter(id=trip_id).update(boarded_count=F('boarded_count') + len(grade_ids))
+
+    for grade_id, boarded in Counter(grade_ids).items():
+        if grade_id is None:
+            continue
+        grade_counts = TripGradeCount.objects.filter(trip_id=trip_id, grade_id=grade_id)
+        if not grade_counts.update(boarded_count=F('boarded_count') + boarded):
+            # A grade that had nobody on the bus when the trip started
+            TripGradeCount.objects.get_or_create(trip_id=trip_id, grade_id=grade_id)
+            grade_counts.update(boarded_count=F('boarded_count') + boarded)
+
+
+def repair_trip_stats(trips):
+    """
+    Recompute the boarded counters of `trips` from their logs. Expected counts are a snapshot
+    taken when the trip started and are left alone. Returns the number of trips that were off.
+    """
+    trips = list(trips.prefetch_related('grade_counts'))
+    trip_ids = [trip.id for trip in trips]
+    boarded = dict(
+        BoardingLog.objects.filter(trip_id__in=trip_ids)
+        .values_list('trip').annotate(logs=Count('id')).order_by()
+    )
+    boarded_by_grade = Counter({
+        (trip_id, grade_id): logs
+        for trip_id, grade_id, logs in BoardingLog.objects.filter(trip_id__in=trip_ids, student__class_in_charge__isnull=False)
+        .values_list('trip', 'student__class_in_charge').annotate(logs=Count('id')).order_by()
+    })
+
+    repaired = 0
+    for trip in trips:
+        off = False
+        if trip.boarded_count != boarded.get(trip.id, 0):
+            Trip.objects.filter(id=trip.id).update(boarded_count=boarded.get(trip.id, 0))
+            off = True
+
+        grade_counts = {grade_count.grade_id: grade_count for grade_count in trip.grade_counts.all()}
+        grade_ids = set(grade_counts) | {grade_id for trip_id, grade_id in boarded_by_grade if trip_id == trip.id}
+        for grade_id in grade_ids:
+            actual = boarded_by_grade[trip.id, grade_id]
+            grade_count = grade_counts.get(grade_id)
+            if grade_count is None:
+                TripGradeCount.objects.create(trip=trip, grade_id=grade_id, boarded_count=actual)
+                off = True
+            elif grade_count.boarded_count != actual:
+                TripGradeCount.objects.filter(id=grade_count.id).update(boarded_count=actual)
+                off = True
+        repaired += off
+    return repaired
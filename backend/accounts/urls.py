@@ -9,6 +9,7 @@ from .views_management import (
     DeleteUserView,
     RegisterMemberView,
     RegisterMemberView,
+    ImportMembersView,
     BusListView,
     GradeListView,
     UpdateMemberView,
@@ -19,11 +20,13 @@ from .views_management import (
     ManagementComplaintListView,
     ManagementComplaintDetailView
 )
-from .views_driver import DriverDashboardStatsView, DriverBroadcastView, StudentBoardingView
+from .views_driver import DriverDashboardStatsView, DriverBroadcastView, StudentBoardingView, BoardingSyncView
 from .views_student import StudentDashboardView, StudentComplaintView
 from .views_parent import ParentDashboardView, ParentComplaintView
-from .views_trip import StartTripView, EndTripView, UpdateLocationView, BusLocationView
+from .views_trip import StartTripView, EndTripView, UpdateLocationView, UpdateLocationBatchView, BusLocationView
+from .live_stream import bus_location_stream
 from .views_teacher import TeacherDashboardStatsView, TeacherStudentListView, TeacherAlertsView, UpdateStudentStatusView
+from .views_notification import NotificationFeedView, NotificationMarkReadView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
@@ -36,6 +39,7 @@ urlpatterns = [
     path('users/<int:pk>/delete/', DeleteUserView.as_view(), name='delete_user'),
     path('users/<int:pk>/toggle-block/', ToggleBlockUserView.as_view(), name='toggle_block_user'),
     path('register/member/', RegisterMemberView.as_view(), name='register_member'),
+    path('register/members/import/', ImportMembersView.as_view(), name='import_members'),
     path('dashboard/buses/', BusListView.as_view(), name='bus_list'),
     path('dashboard/buses/<int:pk>/', BusDetailView.as_view(), name='bus_detail'),
     path('dashboard/add-bus/', RegisterBusView.as_view(), name='add_bus'),
@@ -53,10 +57,13 @@ urlpatterns = [
     path('dashboard/driver/stats/', DriverDashboardStatsView.as_view(), name='driver_dashboard_stats'),
     path('dashboard/driver/broadcast/', DriverBroadcastView.as_view(), name='driver_broadcast'),
     path('dashboard/student/board/', StudentBoardingView.as_view(), name='student_board'),
+    path('dashboard/student/board/sync/', BoardingSyncView.as_view(), name='student_board_sync'),
     path('trip/start/', StartTripView.as_view(), name='start_trip'),
     path('trip/end/', EndTripView.as_view(), name='end_trip'),
     path('trip/update-location/', UpdateLocationView.as_view(), name='update_location'),
+    path('trip/update-location/batch/', UpdateLocationBatchView.as_view(), name='update_location_batch'),
     path('trip/bus-location/<int:bus_id>/', BusLocationView.as_view(), name='bus_location'),
+    path('trip/bus-location/<int:bus_id>/stream/', bus_location_stream, name='bus_location_stream'),
     
     # Student Endpoints
     path('student/dashboard/', StudentDashboardView.as_view(), name='student_dashboard'),
@@ -71,4 +78,8 @@ urlpatterns = [
     path('teacher/students/', TeacherStudentListView.as_view(), name='teacher_student_list'),
     path('teacher/alerts/', TeacherAlertsView.as_view(), name='teacher_alerts'),
     path('teacher/student/update-status/', UpdateStudentStatusView.as_view(), name='teacher_update_student_status'),
+
+    # Notification Endpoints (every role)
+    path('notifications/', NotificationFeedView.as_view(), name='notification_feed'),
+    path('notifications/read/', NotificationMarkReadView.as_view(), name='notification_mark_read'),
 ]
@@ -1,24 +1,16 @@
-import requests
-import json
+from .push import send_push_messages
 
 def send_push_notification(tokens, title, message, data=None):
     """
     Send push notifications to multiple Expo push tokens.
+    Returns True if Expo accepted at least one of them.
     """
-    url = "https://exp.host/--/api/v2/push/send"
-    headers = {
-        "host": "exp.host",
-        "accept": "application/json",
-        "accept-encoding": "gzip, deflate",
-        "content-type": "application/json"
-    }
-    
     # Ensure tokens is a list
     if isinstance(tokens, str):
         tokens = [tokens]
     
-    # Filter out empty tokens
-    valid_tokens = [t for t in tokens if t]
+    # Filter out empty and duplicate tokens
+    valid_tokens = list(dict.fromkeys(t for t in tokens if t))
     
     if not valid_tokens:
         return False
@@ -33,10 +25,5 @@ def send_push_notification(tokens, title, message, data=None):
             "sound": "default"
         })
 
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        print(f"Error sending push notification: {e}")
-        return False
+    tickets = send_push_messages(payload)
+    return any(ticket.get('status') == 'ok' for ticket in tickets)
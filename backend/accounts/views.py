@@ -54,7 +54,7 @@ class PasswordResetConfirmAPIView(APIView):
 
 from .models import PasswordResetOTP
 import random
-from django.core.mail import send_mail
+from .outbox import enqueue_email
 
 class SendOTPView(APIView):
     def post(self, request):
@@ -72,17 +72,11 @@ class SendOTPView(APIView):
                 defaults={'otp': otp, 'created_at': timezone.now()}
             )
             
-            # Send Email
+            # Queue Email; the outbox worker sends it (and retries) right after we respond
             try:
-                send_mail(
-                    'Password Reset OTP',
-                    f'Your OTP for password reset is: {otp}',
-                    None,
-                    [user.email],
-                    fail_silently=False,
-                )
+                enqueue_email('Password Reset OTP', f'Your OTP for password reset is: {otp}', [user.email], urgent=True)
             except Exception as e:
-                print(f"Failed to send email to {email}: {e}")
+                print(f"Failed to queue email to {email}: {e}")
                 return Response({'error': f'Failed to send email. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
             return Response({'success': True, 'message': 'OTP sent to email.'})
@@ -3,12 +3,24 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, FilteredRelation, Max, Q, Value, When
+from django.db.models.functions import Concat
 from django.utils import timezone
 from django.core.signing import TimestampSigner, BadSignature, SignatureExpired
-from .models import Bus, BoardingLog, Notification
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .models import Notification
+from .notifications import create_notification, create_notifications
+from .conditional import driver_dashboard_etag
+from .boarding import (
+    MAX_SYNC_SCANS, QR_CODE_DIGITS, QR_CODE_STEP, get_boarding_bus_state, record_boarding, sync_offline_scans,
+    used_qr_codes, verify_qr_token,
+)
 
 User = get_user_model()
 
+@method_decorator(condition(etag_func=driver_dashboard_etag), name='get')
 class DriverDashboardStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -73,43 +85,41 @@ class DriverDashboardStatsView(APIView):
                     'end': bus.destination or 'Drop-offs'
                 }
 
-        # Fetch students assigned to this bus
-        students = User.objects.filter(bus=bus, is_student=True).values('id', 'username', 'email', 'first_name', 'last_name')
-        expected_count = students.count()
-        
-        # Real Boarding Data for TODAY
-        today = timezone.localtime().date()
-        
+        # Roster: students of this bus LEFT JOINed to their boarding log, in a single query.
         # Filter logs by current trip if active, else just today
+        today = timezone.localtime().date()
         if current_trip:
-            boarding_logs = BoardingLog.objects.filter(bus=bus, trip=current_trip).select_related('student')
+            log_condition = Q(boarding_logs__bus=bus, boarding_logs__trip=current_trip)
         else:
-            # If no active trip, show nothing or maybe today's logs? 
-            # Better to show nothing for "Current Trip Status" context, but maybe historical?
-            # Let's show today's logs generally if no trip, but specific trip logs if active.
-            boarding_logs = BoardingLog.objects.filter(bus=bus, date=today).select_related('student')
+            log_condition = Q(boarding_logs__bus=bus, boarding_logs__date=today)
 
-        boarded_student_ids = set(log.student.id for log in boarding_logs)
-        boarded_map = {log.student.id: log.scan_time.strftime('%I:%M %p') for log in boarding_logs}
-        
-        boarded_count = len(boarded_student_ids)
+        roster = (
+            User.objects.filter(bus=bus, is_student=True)
+            .annotate(current_log=FilteredRelation('boarding_logs', condition=log_condition))
+            # Use First Name if available, else Username
+            .annotate(display_name=Concat(
+                Case(When(first_name='', then=F('username')), default=F('first_name')),
+                Case(When(last_name='', then=Value('')), default=Concat(Value(' '), F('last_name'))),
+            ))
+            .values('id', 'display_name')
+            .annotate(scan_time=Max('current_log__scan_time'))
+            .order_by('id')
+        )
 
         student_list = []
-        for s in students:
-            is_boarded = s['id'] in boarded_student_ids
-            scan_time = boarded_map.get(s['id'], '-')
-            
-            # Use First Name if available, else Username
-            display_name = s['first_name'] if s['first_name'] else s['username']
-            if s['last_name']:
-                display_name += f" {s['last_name']}"
+        boarded_count = 0
+        for s in roster:
+            is_boarded = s['scan_time'] is not None
+            if is_boarded:
+                boarded_count += 1
 
             student_list.append({
                 'id': s['id'],
-                'name': display_name,
+                'name': s['display_name'],
                 'status': 'Boarded' if is_boarded else 'Pending',
-                'time': scan_time
+                'time': s['scan_time'].strftime('%I:%M %p') if is_boarded else '-'
             })
+        expected_count = len(student_list)
 
         data = {
             'bus': {
@@ -118,7 +128,15 @@ class DriverDashboardStatsView(APIView):
                 'status': 'Active',
                 'plate': bus.number_plate
             },
-            'qr_token': TimestampSigner().sign(bus.id), # Generate signed token associated with bus ID
+            # Driver apps that predate TOTP codes show this; drop it once they have all updated
+            'qr_token': TimestampSigner().sign(bus.id),
+            # The app shows "<bus id>:<code>" with a TOTP code from this secret and rotates it itself
+            'qr': {
+                'secret': bus.qr_secret,
+                'algorithm': 'SHA1',
+                'digits': QR_CODE_DIGITS,
+                'period': QR_CODE_STEP,
+            },
             'trip': trip_data,
             'route': route_data,
             'boarding': {
@@ -177,48 +195,57 @@ class DriverBroadcastView(APIView):
         if not bus:
             return Response({'error': 'No bus assigned to your account.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 2. Get Students on this Bus
-        students = User.objects.filter(bus=bus, is_student=True)
+        # 2. Get Students on this Bus (with their parents, in the same query)
+        students = User.objects.filter(bus=bus, is_student=True).select_related('parent')
         
-        # 3. Collect Emails (Student + Parent)
-        recipient_list = []
-        for student in students:
-            if student.email:
-                recipient_list.append(student.email)
-            if student.parent and student.parent.email:
-                recipient_list.append(student.parent.email)
-        
-        recipient_list = list(set(recipient_list)) # Remove duplicates
-
-        if not recipient_list:
-             return Response({'message': 'No students/parents found with email addresses.'}, status=status.HTTP_200_OK)
-
-        # 4. Send Email
-        from django.core.mail import send_mail
-        from .utils import send_push_notification
-        
-        # Collect Push Tokens
+        # 3. Collect In-App Recipients, Emails (with names, for the greeting) and Push Tokens (Student + Parent)
+        in_app_ids = set()
+        recipients = {}
         push_tokens = []
         for student in students:
+            in_app_ids.add(student.id)
+            if student.email:
+                recipients.setdefault(student.email, student.get_full_name() or student.username)
             if student.push_token:
                 push_tokens.append(student.push_token)
+            if student.parent:
+                in_app_ids.add(student.parent_id)
+            if student.parent and student.parent.email:
+                recipients.setdefault(student.parent.email, student.parent.get_full_name() or student.parent.username)
             if student.parent and student.parent.push_token:
                 push_tokens.append(student.parent.push_token)
         
-        # Send Push Notification
-        if push_tokens:
-            send_push_notification(
-                tokens=push_tokens,
+        recipient_list = list(recipients.items()) # One entry per address
+
+        if not in_app_ids:
+             return Response({'message': 'No students/parents found on this bus.'}, status=status.HTTP_200_OK)
+
+        # 4. Fan the alert out to everyone's in-app feed, and queue the Push Notification and Email;
+        # the outbox worker sends them after we respond. All or nothing.
+        from .outbox import enqueue_email, enqueue_push
+
+        with transaction.atomic():
+            create_notifications(
+                in_app_ids,
                 title=f"Transport Alert: {alert_type}",
                 message=message,
-                data={'type': alert_type, 'bus_id': bus.id}
+                type='warning'
             )
 
-        try:
-            send_mail(
-                subject=f"Transport Alert: {alert_type}",
-                message=f"""
-Dear Student/Parent,
+            if push_tokens:
+                enqueue_push(
+                    tokens=push_tokens,
+                    title=f"Transport Alert: {alert_type}",
+                    message=message,
+                    data={'type': alert_type, 'bus_id': bus.id},
+                    urgent=True,
+                )
+
+            if recipient_list:
+                enqueue_email(
+                    subject=f"Transport Alert: {alert_type}",
+                    body=f"""
+Dear {{name}},
 
 This is an alert regarding Bus {bus.bus_number}.
 
@@ -230,22 +257,18 @@ Driver Contact: {phone}
 Regards,
 School Transport Team
                 """,
-                from_email=None, # Configure this in settings.py
-                recipient_list=recipient_list,
-                fail_silently=False,
+                    to=recipient_list,
+                    urgent=True,
+                )
+
+            create_notification(
+                request.user,
+                title=f"Broadcast to {len(in_app_ids)} recipients",
+                message=f"{message}",
+                type='success'
             )
-        except Exception as e:
-            print(f"Email error: {e}")
-            # Continue to save notification even if email fails
-        
-        Notification.objects.create(
-            user=request.user, 
-            title=f"Broadcast to {len(recipient_list)} recipients", 
-            message=f"{message}", 
-            type='success'
-        )
 
-        return Response({'message': f'Broadcast sent to {len(recipient_list)} recipients successfully'}, status=status.HTTP_200_OK)
+        return Response({'message': f'Broadcast sent to {len(in_app_ids)} recipients successfully'}, status=status.HTTP_200_OK)
 
 class StudentBoardingView(APIView):
     permission_classes = [IsAuthenticated]
@@ -262,49 +285,66 @@ class StudentBoardingView(APIView):
         if not qr_token:
              return Response({'error': 'QR Token is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Verify QR Token
+        # Verify QR Token (bus id and the code the driver's app derived from the bus secret)
         try:
-            # Valid for 35 seconds (slightly more than the refresh rate of 30s to account for network latency)
-            bus_id = TimestampSigner().unsign(qr_token, max_age=35) 
+            bus_id, step = verify_qr_token(qr_token)
         except SignatureExpired:
             return Response({'error': 'QR Code has expired. Please ask driver to refresh.'}, status=status.HTTP_400_BAD_REQUEST)
         except BadSignature:
             return Response({'error': 'Invalid QR Code.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Verify Bus
-        try:
-            bus = Bus.objects.get(id=bus_id)
-        except Bus.DoesNotExist:
+        # Bus and active trip from the live bus state cache
+        bus_state = get_boarding_bus_state(bus_id)
+        if bus_state is None:
              return Response({'error': 'Invalid Bus ID.'}, status=status.HTTP_404_NOT_FOUND)
-             
-        # Check for Active Trip
-        from .models import Trip
-        try:
-            current_trip = Trip.objects.get(bus=bus, is_active=True)
-        except Trip.DoesNotExist:
+        if bus_state['active_trip_id'] is None:
              return Response({'error': 'No active trip for this bus. Driver must start trip first.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # This student already scanned this very code (legacy tokens carry no step)
+        replay_key = (request.user.id, bus_id, bus_state['active_trip_id'], step)
+        if step is not None and replay_key in used_qr_codes:
+            return Response({'message': 'Already boarded for this trip.', 'status': 'already_boarded'}, status=status.HTTP_200_OK)
+
         # Check if student is assigned to this bus (Optional strict check)
-        # if request.user.bus != bus:
+        # if request.user.bus_id != bus_id:
         #     return Response({'error': 'You are not assigned to this bus.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Prevent duplicate boarding for the same TRIP
-        from .models import BoardingLog
-
-        if BoardingLog.objects.filter(student=request.user, trip=current_trip).exists():
+        # One insert; the (student, trip) unique constraint prevents duplicate boarding for the same TRIP
+        created = record_boarding(request.user, bus_id, bus_state['active_trip_id'], latitude, longitude)
+        if step is not None:
+            used_qr_codes.add(replay_key)
+        if not created:
             return Response({'message': 'Already boarded for this trip.', 'status': 'already_boarded'}, status=status.HTTP_200_OK)
 
-        # Create Log
-        BoardingLog.objects.create(
-            student=request.user,
-            bus=bus,
-            trip=current_trip,
-            latitude=latitude,
-            longitude=longitude
-        )
-
         return Response({
             'message': 'Boarding successful!', 
-            'bus': bus.bus_number,
+            'bus': bus_state['bus_number'],
             'time': timezone.localtime().strftime('%I:%M %p')
         }, status=status.HTTP_201_CREATED)
+
+class BoardingSyncView(APIView):
+    """
+    Syncs QR scans the student or driver app captured while offline, in one request.
+
+    Body: {"scans": [{"id": ..., "qr_token": ..., "scanned_at": ..., "latitude": ..., "longitude": ...,
+                      "student_id": ... (drivers only)}, ...]}
+    Returns a result per scan, in order; the app drops the scans that came back boarded or
+    already_boarded and may keep the rest for review.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not (request.user.is_student or request.user.is_driver):
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        scans = request.data.get('scans')
+        if not isinstance(scans, list) or not scans:
+            return Response({'error': 'A non-empty list of scans is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(scans) > MAX_SYNC_SCANS:
+            return Response({'error': f'At most {MAX_SYNC_SCANS} scans per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = sync_offline_scans(request.user, scans)
+        return Response({
+            'boarded': sum(result['status'] == 'boarded' for result in results),
+            'results': results,
+        }, status=status.HTTP_200_OK)
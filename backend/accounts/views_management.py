@@ -1,13 +1,20 @@
+import csv
+from itertools import islice
+
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
+from django.db.models import Q
 from django.utils.crypto import get_random_string
 
 
 from .models import Bus, Grade, Complaint
+from .dashboard_stats import get_dashboard_stats
+from .live_state import invalidate_bus_state
+from .outbox import enqueue_email
+from .member_import import import_members, read_rows
 
 User = get_user_model()
 
@@ -45,7 +52,7 @@ class RegisterManagementView(APIView):
             user.is_management = True
             user.save()
 
-            # Send Email
+            # Queue Email
             try:
                 subject = 'Your Management Account Credentials'
                 message = f"""
@@ -63,15 +70,9 @@ class RegisterManagementView(APIView):
                 Admin Team
                 """
                 
-                send_mail(
-                    subject,
-                    message,
-                    None,
-                    [email],
-                    fail_silently=False,
-                )
+                enqueue_email(subject, message, [email])
             except Exception as e:
-                print(f"Failed to send email to management user {email}: {e}")
+                print(f"Failed to queue email to management user {email}: {e}")
 
             return Response({'message': 'Management user created and email sent successfully'}, status=status.HTTP_201_CREATED)
 
@@ -85,74 +86,87 @@ class DashboardStatsView(APIView):
         if not (request.user.is_superuser or request.user.is_management):
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        if request.user.is_superuser:
-            total_users = User.objects.count()
-            # Verified Institutions logic: is_management=True AND is_active=True
-            verified_institutions = User.objects.filter(is_management=True, is_active=True).count()
-            # Pending Institution Verifications logic: is_management=True AND is_active=False
-            pending_institutions = User.objects.filter(is_management=True, is_active=False).count()
-            
-            management_users = verified_institutions + pending_institutions # total management users
-            active_users = User.objects.filter(is_active=True).count()
-            total_buses = Bus.objects.count() # Superuser sees all buses
-
-            # Active users per management
-            management_breakdown = []
-            verified_admins = User.objects.filter(is_management=True, is_active=True)
-            for admin in verified_admins:
-                count = User.objects.filter(managed_by=admin, is_active=True).count()
-                management_breakdown.append({
-                    'id': admin.id,
-                    'username': admin.username,
-                    'email': admin.email,
-                    'active_users': count
-                })
+        # Whole system for superusers, their members and buses for management; cached briefly
+        return Response(get_dashboard_stats(request.user))
 
-        else:
-            # Management view: only their managed members
-            total_users = User.objects.filter(managed_by=request.user).count()
-            verified_institutions = 0 
-            pending_institutions = 0
-            management_users = 0 
-            active_users = User.objects.filter(managed_by=request.user, is_active=True).count()
-            total_buses = Bus.objects.filter(management=request.user).count() # Only their buses
-            management_breakdown = []
-        
-        # Mock Revenue Calculation
-        revenue = total_users * 120 # Assuming $120 ARPU
-
-        # Open Complaints
-        if request.user.is_superuser:
-            open_complaints = Complaint.objects.filter(status__in=['submitted', 'in_action']).count()
-        else:
-            # Get students managed by this user
-            student_ids = User.objects.filter(managed_by=request.user).values_list('id', flat=True)
-            open_complaints = Complaint.objects.filter(user__id__in=student_ids, status__in=['submitted', 'in_action']).count()
-        
-        return Response({
-            'total_users': total_users,
-            'management_users': management_users,
-            'verified_institutions': verified_institutions,
-            'pending_institutions': pending_institutions,
-            'active_users': active_users,
-            'total_buses': total_buses,
-            'management_breakdown': management_breakdown,
-            'revenue': revenue,
-            'open_complaints': open_complaints
-        })
+# Fields UserListView can return; `fields=` picks a subset, `id` is always included
+USER_LIST_FIELDS = (
+    'id', 'username', 'email', 'is_superuser', 'is_management', 'is_teacher', 'is_driver',
+    'is_parent', 'is_student', 'is_active', 'phone', 'organization_name',
+)
+USER_LIST_ROLES = ('superuser', 'management', 'teacher', 'driver', 'parent', 'student')
+USER_LIST_PAGE_SIZE = 50
+USER_LIST_MAX_PAGE_SIZE = 200
 
 class UserListView(APIView):
+    """
+    Users visible to the requester (everyone for superusers, their members for management),
+    one page at a time in id order.
+
+    Query parameters:
+        after      id of the last user of the previous page (the `next` value it returned)
+        limit      page size, default 50, at most 200
+        role       comma-separated roles, e.g. "teacher,driver"; matches users having any of them
+        is_active  true or false
+        search     case-insensitive prefix of the username or email
+        fields     comma-separated subset of USER_LIST_FIELDS
+
+    Returns {"results": [...], "next": <cursor or null>}. Paging on id rather than an offset
+    keeps later pages as cheap as the first.
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         if not (request.user.is_superuser or request.user.is_management):
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
-        
+
+        params = request.query_params
         if request.user.is_superuser:
-            users = User.objects.all().values('id', 'username', 'email', 'is_superuser', 'is_management', 'is_teacher', 'is_driver', 'is_parent', 'is_student', 'is_active', 'phone', 'organization_name')
+            users = User.objects.all()
         else:
-            users = User.objects.filter(managed_by=request.user).values('id', 'username', 'email', 'is_superuser', 'is_management', 'is_teacher', 'is_driver', 'is_parent', 'is_student', 'is_active', 'phone', 'organization_name')
-        return Response(list(users))
+            users = User.objects.filter(managed_by=request.user)
+
+        try:
+            after = int(params.get('after', 0))
+            limit = int(params.get('limit', USER_LIST_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= USER_LIST_MAX_PAGE_SIZE:
+            return Response({'error': f'limit must be between 1 and {USER_LIST_MAX_PAGE_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if params.get('role'):
+            roles = params['role'].split(',')
+            unknown = set(roles) - set(USER_LIST_ROLES)
+            if unknown:
+                return Response({'error': f"Unknown role: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+            role_filter = Q()
+            for role in roles:
+                role_filter |= Q(**{f'is_{role}': True})
+            users = users.filter(role_filter)
+
+        if 'is_active' in params:
+            if params['is_active'] not in ('true', 'false'):
+                return Response({'error': 'is_active must be true or false'}, status=status.HTTP_400_BAD_REQUEST)
+            users = users.filter(is_active=params['is_active'] == 'true')
+
+        if params.get('search'):
+            users = users.filter(Q(username__istartswith=params['search']) | Q(email__istartswith=params['search']))
+
+        fields = USER_LIST_FIELDS
+        if params.get('fields'):
+            requested = params['fields'].split(',')
+            unknown = set(requested) - set(USER_LIST_FIELDS)
+            if unknown:
+                return Response({'error': f"Unknown field: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+            fields = ['id'] + [field for field in USER_LIST_FIELDS if field in requested and field != 'id']
+
+        # One row more than the page tells whether there is a next page
+        page = list(users.filter(id__gt=after).order_by('id').values(*fields)[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1]['id']
+        return Response({'results': page, 'next': next_cursor})
 
 class DeleteUserView(APIView):
     permission_classes = [IsAuthenticated]
@@ -287,17 +301,15 @@ class RegisterMemberView(APIView):
                 user.managed_by = request.user
                 user.save()
             
-            # Send Email to Member
+            # Queue Email to Member
             try:
-                send_mail(
+                enqueue_email(
                     subject='Account Created',
-                    message=f'Your {role} account has been created.\nUsername: {username}\nPassword: {password}',
-                    from_email=None,
-                    recipient_list=[email],
-                    fail_silently=False,
+                    body=f'Your {role} account has been created.\nUsername: {username}\nPassword: {password}',
+                    to=[email],
                 )
             except Exception as e:
-                print(f"Failed to send email to member {email}: {e}")
+                print(f"Failed to queue email to member {email}: {e}")
 
             response_data = {
                 "message": f"{role.capitalize()} account created successfully",
@@ -336,7 +348,7 @@ class RegisterMemberView(APIView):
                     parent_user.managed_by = request.user
                     parent_user.save()
 
-                # Send Email to Parent
+                # Queue Email to Parent
                 try:
                     parent_msg = f"""
                     Hello {parent_name},
@@ -352,15 +364,13 @@ class RegisterMemberView(APIView):
                     Please login to manage your child's activities.
                     """
 
-                    send_mail(
+                    enqueue_email(
                         subject='Parent & Student Account Created',
-                        message=parent_msg,
-                        from_email=None,
-                        recipient_list=[parent_email],
-                        fail_silently=False,
+                        body=parent_msg,
+                        to=[parent_email],
                     )
                 except Exception as e:
-                    print(f"Failed to send email to parent {parent_email}: {e}")
+                    print(f"Failed to queue email to parent {parent_email}: {e}")
                 
                 response_data["parent_username"] = parent_name
                 response_data["parent_password"] = parent_password
@@ -370,6 +380,44 @@ class RegisterMemberView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Rows per ImportMembersView request. Every password is hashed before the response (PBKDF2, about
+# 0.5 s each on one core) and a student row can add a parent, so 20 rows stay well inside the
+# worker timeout (30 s by default in gunicorn). Larger files go through the import_members command.
+MAX_IMPORT_ROWS = 20
+
+
+class ImportMembersView(APIView):
+    """
+    Registers many teachers, drivers and students (with their parents) in one request, for onboarding.
+    Upload a CSV (with a header line) or JSON file as "file", or post {"members": [...]}; see
+    accounts.member_import for the columns. Credentials are emailed through the outbox as for
+    RegisterMemberView. Larger files go through the import_members command.
+
+    Returns {"created": n, "failed": n, "emails_queued": n, "errors": [{"row", "username", "errors"}]}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not (request.user.is_management or request.user.is_superuser):
+            return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
+
+        upload = request.FILES.get('file')
+        try:
+            if upload is not None:
+                is_json = upload.name.lower().endswith('.json') or upload.content_type == 'application/json'
+                rows = read_rows(upload, 'json' if is_json else 'csv')
+            else:
+                rows = request.data.get('members')
+                if not isinstance(rows, list):
+                    return Response({"error": "Upload a CSV or JSON file, or post a members list"}, status=status.HTTP_400_BAD_REQUEST)
+            rows = list(islice(rows, MAX_IMPORT_ROWS + 1))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return Response({"error": f"Could not read the file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > MAX_IMPORT_ROWS:
+            return Response({"error": f"At most {MAX_IMPORT_ROWS} members per request; use the import_members command for more"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(import_members(request.user, rows), status=status.HTTP_200_OK)
+
 class BusListView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -522,6 +570,7 @@ class BusDetailView(APIView):
         serializer = BusSerializer(bus, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            invalidate_bus_state(bus.id)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -530,7 +579,9 @@ class BusDetailView(APIView):
         if not bus:
             return Response({'error': 'Bus not found or permission denied'}, status=status.HTTP_404_NOT_FOUND)
         
+        bus_id = bus.id
         bus.delete()
+        invalidate_bus_state(bus_id)
         return Response({'message': 'Bus deleted successfully'}, status=status.HTTP_200_OK)
 
 class UserProfileView(APIView):
@@ -0,0 +1,59 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+
+from .notifications import FEED_MAX_PAGE_SIZE, FEED_PAGE_SIZE, mark_read, notification_feed
+
+
+class NotificationFeedView(APIView):
+    """
+    The requester's notifications, a page at a time.
+
+    Query parameters:
+        before    id cursor: the `next` value of the previous page (older notifications)
+        since_id  highest id the client already has: returns only newer ones, oldest first;
+                  while `next` is not null, poll again with since_id=next
+        limit     page size, default 20, at most 100
+
+    Returns {"results": [...], "next": <cursor or null>, "unread_count": n}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            before = int(params['before']) if params.get('before') else None
+            since_id = int(params['since_id']) if params.get('since_id') else None
+            limit = int(params.get('limit', FEED_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'before, since_id and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= FEED_MAX_PAGE_SIZE:
+            return Response({'error': f'limit must be between 1 and {FEED_MAX_PAGE_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, next_cursor = notification_feed(request.user, before, since_id, limit)
+        return Response({
+            'results': results,
+            'next': next_cursor,
+            'unread_count': request.user.unread_notifications,
+        })
+
+
+class NotificationMarkReadView(APIView):
+    """
+    Marks the requester's notifications as read. Body: {"ids": [...]} for some of them, or
+    {"all": true} for every one. Returns {"marked": n, "unread_count": n}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('all') is True:
+            ids = None
+        else:
+            ids = request.data.get('ids')
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                return Response({'error': 'Provide ids (a list of integers) or all: true'}, status=status.HTTP_400_BAD_REQUEST)
+
+        marked = mark_read(request.user, ids)
+        request.user.refresh_from_db(fields=['unread_notifications'])
+        return Response({'marked': marked, 'unread_count': request.user.unread_notifications})
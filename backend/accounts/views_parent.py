@@ -2,9 +2,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from django.db.models import Prefetch, Q
 from django.utils import timezone
 from .models import Bus, Trip, BoardingLog, Complaint, Notification
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .conditional import parent_dashboard_etag
 
+@method_decorator(condition(etag_func=parent_dashboard_etag), name='get')
 class ParentDashboardView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -13,13 +18,26 @@ class ParentDashboardView(APIView):
         if not user.is_parent:
              return Response({'error': 'Not a parent'}, status=status.HTTP_403_FORBIDDEN)
 
+        today = timezone.localtime().date()
+        current_time = timezone.localtime().time()
+
         # 1. Children Info and their Buses
-        children = user.children.all()
+        # Buses, their active trip (with driver) and recent boarding logs are loaded
+        # for all children at once, so the query count does not grow with family size.
+        children = user.children.select_related('bus').prefetch_related(
+            Prefetch(
+                'bus__trips',
+                queryset=Trip.objects.filter(is_active=True).select_related('driver'),
+                to_attr='active_trips'
+            ),
+            Prefetch(
+                'boarding_logs',
+                queryset=BoardingLog.objects.filter(Q(trip__is_active=True) | Q(date=today)),
+                to_attr='recent_logs'
+            ),
+        )
         children_data = []
         is_any_boarded = False
-        
-        today = timezone.localtime().date()
-        current_time = timezone.localtime().time()
 
         for child in children:
             bus = child.bus
@@ -28,19 +46,19 @@ class ParentDashboardView(APIView):
             is_boarded = False
 
             if bus:
+                active_trip = bus.active_trips[0] if bus.active_trips else None
+
                 bus_data = {
                     'id': bus.id,
                     'number': bus.bus_number,
                     'plate': bus.number_plate,
-                    'driver_name': bus.trips.filter(is_active=True).first().driver.get_full_name() if bus.trips.filter(is_active=True).exists() else "N/A"
+                    'driver_name': active_trip.driver.get_full_name() if active_trip else "N/A"
                 }
 
                 trip_type = 'morning'
                 if current_time >= bus.evening_trip_start_time:
                      trip_type = 'evening'
 
-                active_trip = Trip.objects.filter(bus=bus, is_active=True).first()
-
                 trip_status = {
                     'type': trip_type.capitalize(),
                     'status': 'Scheduled'
@@ -53,9 +71,9 @@ class ParentDashboardView(APIView):
                     }
 
                 if active_trip:
-                    is_boarded = BoardingLog.objects.filter(student=child, trip=active_trip).exists()
+                    is_boarded = any(log.trip_id == active_trip.id for log in child.recent_logs)
                 else:
-                    is_boarded = BoardingLog.objects.filter(student=child, date=today).exists()
+                    is_boarded = any(log.date == today for log in child.recent_logs)
                 
                 if is_boarded:
                     is_any_boarded = True
@@ -75,7 +93,8 @@ class ParentDashboardView(APIView):
         return Response({
             'children': children_data,
             'any_boarded': is_any_boarded,
-            'notifications': notif_list
+            'notifications': notif_list,
+            'unread_notifications': user.unread_notifications,
         })
 
 class ParentComplaintView(APIView):
@@ -4,7 +4,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.utils import timezone
 from .models import Bus, Trip, BoardingLog, Complaint, Notification
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .conditional import student_dashboard_etag
 
+@method_decorator(condition(etag_func=student_dashboard_etag), name='get')
 class StudentDashboardView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -66,7 +70,8 @@ class StudentDashboardView(APIView):
             'bus': bus_data,
             'trip': trip_status,
             'boarding': {'status': 'Boarded' if is_boarded else 'Not Boarded'},
-            'notifications': notif_list
+            'notifications': notif_list,
+            'unread_notifications': user.unread_notifications,
         })
 
 class StudentComplaintView(APIView):
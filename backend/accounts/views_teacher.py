@@ -4,12 +4,27 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
+from django.db.models import OuterRef, Subquery
 from django.utils import timezone
-from .models import BoardingLog, Trip, Notification, Grade
-from datetime import date
+from django.utils.dateparse import parse_date
+from .models import BoardingLog, DailyAttendance, Trip, TripGradeCount, Notification, Grade
+from .attendance import AttendanceError, mark_attendance
+from datetime import date, datetime, time, timedelta
 
 User = get_user_model()
 
+# Upper bound on students marked in one request
+MAX_ATTENDANCE_MARKS = 500
+
+# Alerts returned by TeacherAlertsView; older ones are in the notification feed
+TEACHER_ALERTS_LIMIT = 50
+
+def day_bounds(day):
+    """Start and end of a local calendar day, so trips can be filtered by start_time range (indexed) rather than start_time__date."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
 class TeacherDashboardStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -32,12 +47,13 @@ class TeacherDashboardStatsView(APIView):
         total_students = students.count()
 
         # Get today's active trip (if any)
-        today = timezone.now().date()
+        today = timezone.localdate()
+        day_start, day_end = day_bounds(today)
         # Find any active trip for today. 
         # Note: In a real scenario, we might need to filter by the bus associated with the class or general trips.
         # Assuming trips are global or we pick the most relevant one.
         # For simplicity, let's look for ANY active trip today.
-        active_trip = Trip.objects.filter(start_time__date=today, is_active=True).first()
+        active_trip = Trip.objects.filter(start_time__gte=day_start, start_time__lt=day_end, is_active=True).order_by('start_time').first()
         
         boarded_count = 0
         trip_status = 'No Active Trip'
@@ -47,14 +63,14 @@ class TeacherDashboardStatsView(APIView):
             trip_status = f"{active_trip.get_trip_type_display()} Trip Ongoing"
             trip_type = active_trip.trip_type
             
-            # Count boarded students from this class
-            boarded_count = BoardingLog.objects.filter(
+            # Boarded students from this class, from the trip's counters
+            boarded_count = TripGradeCount.objects.filter(
                 trip=active_trip,
-                student__in=students
-            ).count()
+                grade=class_in_charge
+            ).values_list('boarded_count', flat=True).first() or 0
         else:
              # Check for completed trips today to show "Completed" status
-             last_trip = Trip.objects.filter(start_time__date=today, is_active=False).last()
+             last_trip = Trip.objects.filter(start_time__gte=day_start, start_time__lt=day_end, is_active=False).order_by('start_time').last()
              if last_trip:
                  trip_status = f"{last_trip.get_trip_type_display()} Trip Completed"
                  trip_type = last_trip.trip_type
@@ -71,10 +87,7 @@ class TeacherDashboardStatsView(APIView):
 
         # Alerts (Mock logic for now, or based on 'Not Boarded' if trip ended)
         # Real logic: Count notifications for this teacher's students
-        pending_alerts = Notification.objects.filter(
-            user=user, 
-            is_read=False
-        ).count()
+        pending_alerts = user.unread_notifications
 
         return Response({
             'boarded': boarded_count,
@@ -96,33 +109,39 @@ class TeacherStudentListView(APIView):
         if not class_in_charge:
             return Response([])
 
-        students = User.objects.filter(class_in_charge=class_in_charge, is_student=True)
-        
-        today = timezone.now().date()
-        active_trip = Trip.objects.filter(start_time__date=today, is_active=True).first()
+        # Each student's log on the active trip of their own bus today: the class may ride several buses.
+        # Along with the teacher's latest mark for today, one query for the whole class, whatever its size.
+        today = timezone.localdate()
+        day_start, day_end = day_bounds(today)
+        boarding_log = BoardingLog.objects.filter(
+            student=OuterRef('pk'),
+            trip__bus=OuterRef('bus'),
+            trip__is_active=True,
+            trip__start_time__gte=day_start,
+            trip__start_time__lt=day_end,
+        ).values('scan_time')[:1]
+        attendance_mark = DailyAttendance.objects.filter(student=OuterRef('pk'), date=today).order_by('-updated_at').values('status')[:1]
+        students = (
+            User.objects.filter(class_in_charge=class_in_charge, is_student=True)
+            .annotate(scan_time=Subquery(boarding_log), attendance_status=Subquery(attendance_mark))
+            .values('id', 'username', 'first_name', 'last_name', 'scan_time', 'attendance_status')
+            .order_by('id')
+        )
+        status_labels = dict(DailyAttendance.STATUS_CHOICES)
 
         student_data = []
         for student in students:
-            status_text = 'Not Boarded'
-            board_time = None
-            
-            if active_trip:
-                log = BoardingLog.objects.filter(trip=active_trip, student=student).first()
-                if log:
-                    status_text = 'Boarded'
-                    board_time = log.scan_time.strftime('%I:%M %p')
-            
-            # Check for manual overrides (Absent/Leave) - Assuming we might have extended User model or a separate Status model
-            # For now, we don't have a dedicated "Status" field on User for daily attendance, 
-            # so we'll just return default or mock if we want to stick to the requirement
-            # Let's assume we use a temporary field or just rely on BoardingLog for now.
-            
+            if student['scan_time']:
+                status_text = 'Boarded'
+            else:
+                # Absent/Leave/Late as marked by the teacher
+                status_text = status_labels.get(student['attendance_status'], 'Not Boarded')
             student_data.append({
-                'id': student.id,
-                'name': f"{student.first_name} {student.last_name}".strip() or student.username,
+                'id': student['id'],
+                'name': f"{student['first_name']} {student['last_name']}".strip() or student['username'],
                 'class': str(class_in_charge),
                 'status': status_text,
-                'time': board_time,
+                'time': timezone.localtime(student['scan_time']).strftime('%I:%M %p') if student['scan_time'] else None,
                 'image': None # user.profile_picture.url if user.profile_picture else None
             })
 
@@ -136,8 +155,8 @@ class TeacherAlertsView(APIView):
         if not user.is_teacher:
              return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
         
-        # In a real app, we would query the Notification model
-        notifications = Notification.objects.filter(user=user).order_by('-created_at')
+        # Latest alerts only; the app pages through older ones with the notification feed
+        notifications = Notification.objects.filter(user=user).order_by('-created_at')[:TEACHER_ALERTS_LIMIT]
         
         data = []
         for notif in notifications:
@@ -152,18 +171,41 @@ class TeacherAlertsView(APIView):
         return Response(data)
 
 class UpdateStudentStatusView(APIView):
+    """
+    Marks students of the teacher's class Present, Absent, Leave or Late.
+
+    Body: {"student_id": ..., "status": ...} for one student, or {"marks": [{"student_id", "status"}, ...]}
+    for any number of them in one request, plus optional "date" (YYYY-MM-DD, default today) and
+    "trip_type" ("morning" or "evening", default both). Students marked Absent or Leave are left out
+    of the missing-student alert.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         user = request.user
         if not user.is_teacher:
              return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
-        
-        student_id = request.data.get('student_id')
-        new_status = request.data.get('status') # 'Absent', 'Leave', 'Late'
-        
-        # Here we would save this status to a DailyAttendance model
-        # For this demo, we will just return success as we don't have that model yet.
-        
-        return Response({'success': True, 'message': f'Status updated to {new_status}'})
 
+        marks = request.data.get('marks')
+        if marks is None:
+            marks = [{'student_id': request.data.get('student_id'), 'status': request.data.get('status')}]
+        if not isinstance(marks, list) or not marks:
+            return Response({'error': 'marks must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(marks) > MAX_ATTENDANCE_MARKS:
+            return Response({'error': f'At most {MAX_ATTENDANCE_MARKS} marks per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        day = None
+        if request.data.get('date'):
+            try:
+                day = parse_date(str(request.data['date']))
+            except ValueError:
+                day = None
+            if day is None:
+                return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            marked = mark_attendance(user, marks, day, request.data.get('trip_type') or None)
+        except AttendanceError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'success': True, 'message': f'Status updated for {len(marks)} students', 'marked': marked})
@@ -2,8 +2,21 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from .models import Trip, Bus
+from django.db import IntegrityError, transaction
+from .models import Trip, Bus, LocationSample
+from .live_state import can_track_bus, get_bus_state, set_bus_state
+from .trip_stats import start_trip_stats
+from .tracking import (
+    MAX_BATCH_FIXES,
+    MAX_CLOCK_SKEW,
+    build_sample,
+    parse_timestamp,
+    record_location_samples,
+)
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .conditional import bus_location_etag, bus_location_last_modified
 
 class StartTripView(APIView):
     permission_classes = [IsAuthenticated]
@@ -26,10 +39,17 @@ class StartTripView(APIView):
             trip_type = 'evening'
 
 
-        # End any existing active trips for this bus (Safety cleanup)
-        Trip.objects.filter(bus=bus, is_active=True).update(is_active=False, end_time=timezone.now())
-        
-        trip = Trip.objects.create(bus=bus, driver=request.user, trip_type=trip_type)
+        try:
+            with transaction.atomic():
+                # End any existing active trips for this bus (Safety cleanup)
+                Trip.objects.filter(bus=bus, is_active=True).update(is_active=False, end_time=timezone.now())
+
+                trip = Trip.objects.create(bus=bus, driver=request.user, trip_type=trip_type)
+                start_trip_stats(trip)
+        except IntegrityError:
+            # Another request started a trip for this bus at the same moment (one active trip per bus)
+            return Response({'error': 'A trip was just started for this bus'}, status=status.HTTP_409_CONFLICT)
+        set_bus_state(bus, trip.id)
         return Response({
             'message': f'{trip_type.capitalize()} Trip started', 
             'trip_id': trip.id,
@@ -53,7 +73,8 @@ class EndTripView(APIView):
         bus.latitude = None
         bus.longitude = None
         bus.last_update = None
-        bus.save()
+        bus.save(update_fields=['latitude', 'longitude', 'last_update'])
+        set_bus_state(bus, None)
         
         return Response({'message': 'Trip ended'}, status=status.HTTP_200_OK)
 
@@ -70,65 +91,122 @@ class UpdateLocationView(APIView):
         if not latitude or not longitude:
             return Response({'error': 'Missing coordinates'}, status=status.HTTP_400_BAD_REQUEST)
             
-        bus = request.user.bus
-        if not bus:
+        # Only the FK id is needed here, no need to load the Bus row
+        bus_id = request.user.bus_id
+        if not bus_id:
              return Response({'error': 'No bus assigned'}, status=status.HTTP_400_BAD_REQUEST)
              
-        # Update Bus Location
         # Check if there is an active trip for this bus
-        try:
-             trip = Trip.objects.get(bus=bus, is_active=True)
-        except Trip.DoesNotExist:
+        trip_id = Trip.objects.filter(bus_id=bus_id, is_active=True).values_list('id', flat=True).first()
+        if trip_id is None:
              return Response({'error': 'No active trip for this bus.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        bus.latitude = latitude
-        bus.longitude = longitude
-        bus.last_update = timezone.now()
-        bus.save()
+        sample = build_sample(trip_id, timezone.now(), request.data)
+        if sample is None:
+            return Response({'error': 'Invalid coordinates'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Append to the trip breadcrumbs and move the bus's latest position pointer
+        record_location_samples(bus_id, [sample])
         
         return Response({'message': 'Location updated'}, status=status.HTTP_200_OK)
 
+class UpdateLocationBatchView(APIView):
+    """
+    Accepts a list of timestamped fixes in one request so the driver app can
+    coalesce pings and replay what it buffered while offline.
+
+    Body: {"fixes": [{"timestamp": ..., "latitude": ..., "longitude": ...,
+                      "speed": ..., "heading": ..., "accuracy": ...}, ...]}
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not request.user.is_driver:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        fixes = request.data.get('fixes')
+        if not isinstance(fixes, list) or not fixes:
+            return Response({'error': 'A non-empty list of fixes is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(fixes) > MAX_BATCH_FIXES:
+            return Response({'error': f'At most {MAX_BATCH_FIXES} fixes per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        bus_id = request.user.bus_id
+        if not bus_id:
+             return Response({'error': 'No bus assigned'}, status=status.HTTP_400_BAD_REQUEST)
+
+        trip = Trip.objects.filter(bus_id=bus_id, is_active=True).values('id', 'start_time').first()
+        if trip is None:
+             return Response({'error': 'No active trip for this bus.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every fix before writing anything
+        latest_allowed = timezone.now() + MAX_CLOCK_SKEW
+        samples = []
+        previous_ts = None
+        for index, fix in enumerate(fixes):
+            if not isinstance(fix, dict):
+                return Response({'error': f'Fix {index} is not an object'}, status=status.HTTP_400_BAD_REQUEST)
+
+            ts = parse_timestamp(fix.get('timestamp'))
+            if ts is None:
+                return Response({'error': f'Fix {index} has a missing or invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+            if ts > latest_allowed:
+                return Response({'error': f'Fix {index} is in the future'}, status=status.HTTP_400_BAD_REQUEST)
+            if previous_ts is not None and ts < previous_ts:
+                return Response({'error': f'Fix {index} is older than the fix before it. Fixes must be sent in time order.'}, status=status.HTTP_400_BAD_REQUEST)
+            previous_ts = ts
+
+            sample = build_sample(trip['id'], ts, fix)
+            if sample is None:
+                return Response({'error': f'Fix {index} has invalid coordinates'}, status=status.HTTP_400_BAD_REQUEST)
+            samples.append(sample)
+
+        # Fixes buffered before this trip started belong to an earlier trip
+        stale = [s for s in samples if s.ts < trip['start_time']]
+        samples = [s for s in samples if s.ts >= trip['start_time']]
+
+        # Dedupe by (trip, timestamp): within the batch and against what is already stored
+        unique_samples = {}
+        for sample in samples:
+            unique_samples.setdefault(sample.ts, sample)
+
+        if unique_samples:
+            stored = set(LocationSample.objects.filter(
+                trip_id=trip['id'],
+                ts__range=(min(unique_samples), max(unique_samples)),
+            ).values_list('ts', flat=True))
+        else:
+            stored = set()
+        new_samples = [s for ts, s in unique_samples.items() if ts not in stored]
+
+        with transaction.atomic():
+            record_location_samples(bus_id, new_samples)
+
+        return Response({
+            'message': 'Locations recorded',
+            'accepted': len(new_samples),
+            'duplicates': len(samples) - len(new_samples),
+            'stale': len(stale),
+        }, status=status.HTTP_200_OK)
+
+@method_decorator(condition(etag_func=bus_location_etag, last_modified_func=bus_location_last_modified), name='get')
 class BusLocationView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, bus_id):
-        try:
-            bus = Bus.objects.get(id=bus_id)
-            user = request.user
-            
-            # Permission Check
-            has_permission = False
-            
-            if user.is_superuser:
-                has_permission = True
-            elif user.is_management:
-                if bus.management == user:
-                    has_permission = True
-            elif user.is_driver:
-                if user.bus == bus:
-                    has_permission = True
-            elif user.is_student or user.is_teacher:
-                if user.bus == bus:
-                    has_permission = True
-            elif user.is_parent:
-                # Check if any child is assigned to this bus
-                if user.children.filter(bus=bus).exists():
-                    has_permission = True
-            
-            if not has_permission:
-                return Response({'error': 'You do not have permission to track this bus.'}, status=status.HTTP_403_FORBIDDEN)
-            
-            # Check if there is an active trip
-            active_trip = Trip.objects.filter(bus=bus, is_active=True).exists()
-            
-            data = {
-                'bus_id': bus.id,
-                'bus_number': bus.bus_number,
-                'is_active_trip': active_trip,
-                'latitude': bus.latitude,
-                'longitude': bus.longitude,
-                'last_update': bus.last_update
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        except Bus.DoesNotExist:
+        # Served from the live cache; only a cache miss touches the database
+        state = get_bus_state(bus_id)
+        if state is None:
             return Response({'error': 'Bus not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if not can_track_bus(request.user, state):
+            return Response({'error': 'You do not have permission to track this bus.'}, status=status.HTTP_403_FORBIDDEN)
+
+        data = {
+            'bus_id': state['bus_id'],
+            'bus_number': state['bus_number'],
+            'is_active_trip': state['active_trip_id'] is not None,
+            'latitude': state['latitude'],
+            'longitude': state['longitude'],
+            'last_update': state['last_update']
+        }
+        return Response(data, status=status.HTTP_200_OK)
@@ -61,6 +61,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework_simplejwt",
     "corsheaders",
+    "django_apscheduler",
     # Local
     "accounts",
 ]
@@ -114,6 +115,33 @@ if 'DATABASE_URL' in os.environ:
     )
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# "live" holds the per-bus tracking state (position, last update, active trip)
+# read by the tracking endpoints. It lives in process memory by default, with a
+# short timeout since each worker has its own copy. Set LIVE_CACHE_URL to any
+# Redis-protocol server (redis://localhost:6379/1 locally) to share it between workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "live": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "live-bus-state",
+        "TIMEOUT": 5,
+    },
+}
+
+if 'LIVE_CACHE_URL' in os.environ:
+    CACHES['live'] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get('LIVE_CACHE_URL'),
+        "TIMEOUT": 3600,
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -167,3 +195,18 @@ EMAIL_HOST_USER = 'akhiljoji1451@gmail.com'
 EMAIL_HOST_PASSWORD = 'pfzc jpoc hbva xgvq'
 DEFAULT_FROM_EMAIL = 'akhiljoji1451@gmail.com'
 
+
+# Expo Push Notifications
+# Point these at a local stub server to test push delivery without Expo.
+# EXPO_ACCESS_TOKEN is only needed if "Enhanced Push Security" is enabled for the Expo project.
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+EXPO_RECEIPTS_URL = os.environ.get('EXPO_RECEIPTS_URL', 'https://exp.host/--/api/v2/push/getReceipts')
+EXPO_ACCESS_TOKEN = os.environ.get('EXPO_ACCESS_TOKEN')
+
+# Bulk email limits (accounts/mailer.py). The defaults suit a personal Gmail account:
+# at most 100 messages per SMTP connection and a few per second. Set EMAIL_DAILY_QUOTA to the
+# provider's daily limit (500 for Gmail) to hold bulk mail past it until the next day; urgent
+# mail (OTPs, alerts) is never held. 0, the default, means no daily limit.
+EMAIL_MAX_PER_CONNECTION = 100
+EMAIL_MAX_PER_SECOND = float(os.environ.get('EMAIL_MAX_PER_SECOND', 5))
+EMAIL_DAILY_QUOTA = int(os.environ.get('EMAIL_DAILY_QUOTA', 0))